@@ -0,0 +1,90 @@
+import sys
+import uuid
+from time import perf_counter
+
+from hash_db import CoreConfiguration, TableDefinition, TableDescriptor, FieldDefinition, FieldDescriptor, \
+    FunctionalDependency, MetadataStore, TableRecord, FieldValue, KeyPolicyType, StorageLayout
+from hash_db.extensions.insertion import get_insert_script_arguments
+
+
+def create_metadata_store(key_policy: KeyPolicyType, storage_layout: StorageLayout) -> MetadataStore:
+    table = TableDefinition(
+        table_descriptor=TableDescriptor("key_benchmark_table"),
+        fields=[
+            FieldDefinition(FieldDescriptor("primary_field_1"), primary_key=True),
+            FieldDefinition(FieldDescriptor("primary_field_2"), primary_key=True),
+            FieldDefinition(FieldDescriptor("field_1")),
+            FieldDefinition(FieldDescriptor("field_2")),
+            FieldDefinition(FieldDescriptor("field_3"))
+        ],
+        dependencies=[
+            FunctionalDependency(
+                determinants=[
+                    FieldDescriptor("field_1"),
+                    FieldDescriptor("field_2"),
+                ],
+                dependent=FieldDescriptor("field_3")
+            )
+        ],
+        indexes=[
+            FieldDescriptor("field_2")
+        ]
+    )
+
+    return MetadataStore(
+        tables=[
+            table
+        ],
+        config=CoreConfiguration(
+            key_policy=key_policy,
+            storage_layout=storage_layout
+        )
+    )
+
+
+def create_records(rows_count: int) -> list[TableRecord]:
+    return [TableRecord(
+        table_descriptor=TableDescriptor("key_benchmark_table"),
+        values={
+            FieldDescriptor("primary_field_1"): FieldValue(str(uuid.uuid4())),
+            FieldDescriptor("primary_field_2"): FieldValue(str(uuid.uuid4())),
+            FieldDescriptor("field_1"): FieldValue(f"field_1_{i % 10}"),
+            FieldDescriptor("field_2"): FieldValue(f"field_2_{i % 10}"),
+            FieldDescriptor("field_3"): FieldValue(f"field_3_{i % 10}"),
+        }
+    ) for i in range(rows_count)]
+
+
+def benchmark_key_generation(key_policy: KeyPolicyType, storage_layout: StorageLayout, rows_count: int):
+    metadata_store = create_metadata_store(key_policy, storage_layout)
+    records = create_records(rows_count)
+
+    start = perf_counter()
+    for record in records:
+        record.get_primary_key_identifier(metadata_store)
+    identifiers_time = perf_counter() - start
+
+    start = perf_counter()
+    for record in records:
+        # every key and argument of insert script, which is all key generation needed to insert record
+        get_insert_script_arguments(metadata_store, record, [], [])
+    arguments_time = perf_counter() - start
+
+    print(f"{key_policy.value} keys, {storage_layout.value}: "
+          f"{rows_count / identifiers_time:.0f} primary key identifiers/s, "
+          f"{rows_count / arguments_time:.0f} records encoded for insert/s")
+
+
+def main():
+    rows_count = 100_000
+
+    if len(sys.argv) > 1:
+        rows_count = int(sys.argv[1])
+
+    for key_policy in KeyPolicyType:
+        for storage_layout in StorageLayout:
+            benchmark_key_generation(key_policy, storage_layout, rows_count)
+
+
+if __name__ == "__main__":
+    main()
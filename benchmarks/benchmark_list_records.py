@@ -0,0 +1,95 @@
+import sys
+import os
+import uuid
+import tracemalloc
+from time import perf_counter
+
+from dotenv import load_dotenv
+
+from hash_db import Core, CoreConfiguration, TableDefinition, TableDescriptor, FieldDefinition, FieldDescriptor, \
+    MetadataStore, TableRecord, FieldValue, ListRecordsType
+from hash_db.tools.selection_tools import TableIterator
+
+load_dotenv()
+redis_host = os.environ["REDIS_HOST"]
+redis_port = os.environ["REDIS_PORT"]
+
+
+def create_core(list_records_type: ListRecordsType, scan_count: int | None, clean_redis: bool) -> Core:
+    table = TableDefinition(
+        table_descriptor=TableDescriptor("list_benchmark_table"),
+        fields=[
+            FieldDefinition(FieldDescriptor("primary_field_1"), primary_key=True),
+            FieldDefinition(FieldDescriptor("field_1"))
+        ]
+    )
+
+    return Core(
+        redis_host=redis_host,
+        redis_port=redis_port,
+        metadata_store=MetadataStore(
+            tables=[
+                table
+            ],
+            config=CoreConfiguration(
+                list_records_type=list_records_type,
+                scan_count=scan_count
+            )
+        ),
+        clean_redis=clean_redis
+    )
+
+
+def fill_table(core: Core, rows_count: int):
+    core.insert_many(TableRecord(
+        table_descriptor=TableDescriptor("list_benchmark_table"),
+        values={
+            FieldDescriptor("primary_field_1"): FieldValue(str(uuid.uuid4())),
+            FieldDescriptor("field_1"): FieldValue(f"field_1_{i}")
+        }
+    ) for i in range(rows_count))
+
+
+def benchmark_list_records(list_records_type: ListRecordsType, scan_count: int | None):
+    core = create_core(list_records_type, scan_count, False)
+
+    identifiers_count = 0
+    # longest wait for next identifier, which is time of the biggest single reply
+    max_gap = 0
+
+    tracemalloc.start()
+    start = perf_counter()
+    last = start
+    for _ in TableIterator(core.conn, core.metadata_store, TableDescriptor("list_benchmark_table")):
+        now = perf_counter()
+        max_gap = max(max_gap, now - last)
+        last = now
+        identifiers_count += 1
+    time_spent = perf_counter() - start
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{list_records_type.value} (count {scan_count}): listed {identifiers_count} identifiers in {time_spent:.3f}s, "
+          f"longest wait {max_gap * 1000:.1f}ms, peak client memory {peak_memory / 1024 / 1024:.1f}MiB")
+
+
+def main():
+    rows_count = 100000
+    scan_count = 1000
+
+    if len(sys.argv) > 1:
+        rows_count = int(sys.argv[1])
+
+    if len(sys.argv) > 2:
+        scan_count = int(sys.argv[2])
+
+    fill_table(create_core(ListRecordsType.SET, None, True), rows_count)
+
+    benchmark_list_records(ListRecordsType.SET, None)
+    benchmark_list_records(ListRecordsType.KEYS, None)
+    benchmark_list_records(ListRecordsType.SCAN, scan_count)
+    benchmark_list_records(ListRecordsType.SSCAN, scan_count)
+
+
+if __name__ == "__main__":
+    main()
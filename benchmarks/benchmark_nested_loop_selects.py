@@ -7,7 +7,7 @@ import random
 from dotenv import load_dotenv
 
 from hash_db import Core, CoreConfiguration, TableDefinition, TableDescriptor, FieldDefinition, FieldDescriptor, \
-    MetadataStore, TableRecord, FieldValue, Selector, JoinStatement
+    MetadataStore, TableRecord, FieldValue, Selector, JoinStatement, JoiningAlgorithm
 
 load_dotenv()
 redis_host = os.environ["REDIS_HOST"]
@@ -84,6 +84,12 @@ def benchmark_select(table1_size, table2_size, select_count):
 
     populate_database(core, table1_size, table2_size)
 
+    for joining_algorithm in JoiningAlgorithm:
+        core.metadata_store.config.joining_algorithm = joining_algorithm
+        benchmark_joining_algorithm(core, table1_size, table2_size, select_count)
+
+
+def benchmark_joining_algorithm(core, table1_size, table2_size, select_count):
     selector = Selector(
         select_fields={
             TableDescriptor("select_benchmark_table_1"): [
@@ -117,7 +123,7 @@ def benchmark_select(table1_size, table2_size, select_count):
     time_spent = perf_counter() - start
 
     print(
-        f"Benchmark ran in {time_spent}s doing {select_count} selects. table1 size = {table1_size}, table2 size = {table2_size}, result size = {len(result)}")
+        f"Benchmark ({core.metadata_store.config.joining_algorithm.value}) ran in {time_spent}s doing {select_count} selects. table1 size = {table1_size}, table2 size = {table2_size}, result size = {len(result)}")
 
 
 def main():
@@ -0,0 +1,104 @@
+import sys
+import os
+import uuid
+from time import perf_counter
+
+from dotenv import load_dotenv
+
+from hash_db import Core, CoreConfiguration, TableDefinition, TableDescriptor, FieldDefinition, FieldDescriptor, \
+    MetadataStore, TableRecord, FieldValue, Selector
+
+load_dotenv()
+redis_host = os.environ["REDIS_HOST"]
+redis_port = os.environ["REDIS_PORT"]
+
+
+def create_core(scan_workers: int, clean_redis: bool) -> Core:
+    table = TableDefinition(
+        table_descriptor=TableDescriptor("scan_benchmark_table"),
+        fields=[
+            FieldDefinition(FieldDescriptor("primary_field_1"), primary_key=True),
+            FieldDefinition(FieldDescriptor("field_1")),
+            FieldDefinition(FieldDescriptor("field_2")),
+            FieldDefinition(FieldDescriptor("field_3"))
+        ]
+    )
+
+    return Core(
+        redis_host=redis_host,
+        redis_port=redis_port,
+        metadata_store=MetadataStore(
+            tables=[
+                table
+            ],
+            config=CoreConfiguration(
+                scan_workers=scan_workers
+            )
+        ),
+        clean_redis=clean_redis
+    )
+
+
+def fill_table(core: Core, rows_count: int):
+    core.insert_many(TableRecord(
+        table_descriptor=TableDescriptor("scan_benchmark_table"),
+        values={
+            FieldDescriptor("primary_field_1"): FieldValue(str(uuid.uuid4())),
+            FieldDescriptor("field_1"): FieldValue(f"field_1_{i}"),
+            FieldDescriptor("field_2"): FieldValue(f"field_2_{i}"),
+            FieldDescriptor("field_3"): FieldValue(f"field_3_{i}"),
+        }
+    ) for i in range(rows_count))
+
+
+def benchmark_scan(scan_workers: int, repeats: int):
+    core = create_core(scan_workers, False)
+
+    selector = Selector(
+        select_fields={
+            TableDescriptor("scan_benchmark_table"): [
+                FieldDescriptor("primary_field_1"),
+                FieldDescriptor("field_1"),
+                FieldDescriptor("field_2"),
+                FieldDescriptor("field_3")
+            ]
+        },
+        from_table=TableDescriptor("scan_benchmark_table"),
+        join_statements=[],
+        conditions=[]
+    )
+
+    rows_count = 0
+    start = perf_counter()
+    for _ in range(repeats):
+        rows_count += sum(len(batch) for batch in core.select_batches(selector))
+    time_spent = perf_counter() - start
+
+    print(f"{scan_workers} scan workers read {rows_count} rows in {time_spent}s ({rows_count / time_spent:.0f} rows/s)")
+
+
+def main():
+    rows_count = 100000
+    max_scan_workers = 8
+    repeats = 3
+
+    if len(sys.argv) > 1:
+        rows_count = int(sys.argv[1])
+
+    if len(sys.argv) > 2:
+        max_scan_workers = int(sys.argv[2])
+
+    if len(sys.argv) > 3:
+        repeats = int(sys.argv[3])
+
+    fill_table(create_core(1, True), rows_count)
+
+    # throughput is measured for doubling number of scan workers, to show how it scales
+    scan_workers = 1
+    while scan_workers <= max_scan_workers:
+        benchmark_scan(scan_workers, repeats)
+        scan_workers *= 2
+
+
+if __name__ == "__main__":
+    main()
@@ -68,6 +68,18 @@ def populate_database(core, table1_size, table2_size):
         ))
 
 
+class RoundTripCounter:
+    # counts commands sent by connection, every command outside of pipeline is a single round trip
+    def __init__(self, conn):
+        self.round_trips = 0
+        self.execute_command = conn.execute_command
+        conn.execute_command = self.counted_execute_command
+
+    def counted_execute_command(self, *args, **options):
+        self.round_trips += 1
+        return self.execute_command(*args, **options)
+
+
 def benchmark_select(table1_size, table2_size, select_count):
     core = Core(
         redis_host=redis_host,
@@ -84,6 +96,13 @@ def benchmark_select(table1_size, table2_size, select_count):
 
     populate_database(core, table1_size, table2_size)
 
+    # batch of single row behaves like joining row by row, with one existence check and one fetch per row
+    for join_batch_size in [1, CoreConfiguration().join_batch_size]:
+        core.metadata_store.config.join_batch_size = join_batch_size
+        benchmark_join_batch_size(core, table1_size, table2_size, select_count)
+
+
+def benchmark_join_batch_size(core, table1_size, table2_size, select_count):
     selector = Selector(
         select_fields={
             TableDescriptor("select_benchmark_table_1"): [
@@ -104,14 +123,19 @@ def benchmark_select(table1_size, table2_size, select_count):
         conditions=[]
     )
 
+    round_trip_counter = RoundTripCounter(core.conn)
+
     start = perf_counter()
     result = []
     for i in range(select_count):
         result = list(core.select(selector))
     time_spent = perf_counter() - start
 
+    round_trips_per_row = round_trip_counter.round_trips / max(len(result) * select_count, 1)
+    core.conn.execute_command = round_trip_counter.execute_command
+
     print(
-        f"Benchmark ran in {time_spent}s doing {select_count} selects. table1 size = {table1_size}, table2 size = {table2_size}, result size = {len(result)}")
+        f"Benchmark (join batch size = {core.metadata_store.config.join_batch_size}) ran in {time_spent}s doing {select_count} selects. table1 size = {table1_size}, table2 size = {table2_size}, result size = {len(result)}, round trips per output row = {round_trips_per_row:.4f}")
 
 
 def main():
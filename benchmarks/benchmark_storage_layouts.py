@@ -0,0 +1,106 @@
+import sys
+import os
+import uuid
+from time import perf_counter
+import random
+
+from dotenv import load_dotenv
+
+from hash_db import Core, CoreConfiguration, TableDefinition, TableDescriptor, FieldDefinition, FieldDescriptor, \
+    FunctionalDependency, MetadataStore, TableRecord, FieldValue, Selector, StorageLayout
+
+load_dotenv()
+redis_host = os.environ["REDIS_HOST"]
+redis_port = os.environ["REDIS_PORT"]
+
+table = TableDefinition(
+    table_descriptor=TableDescriptor("layout_benchmark_table"),
+    fields=[
+        FieldDefinition(FieldDescriptor("primary_field_1"), primary_key=True),
+        FieldDefinition(FieldDescriptor("field_1")),
+        FieldDefinition(FieldDescriptor("field_2")),
+        FieldDefinition(FieldDescriptor("field_3")),
+    ],
+    dependencies=[
+        FunctionalDependency(
+            determinants=[
+                FieldDescriptor("field_1")
+            ],
+            dependent=FieldDescriptor("field_2")
+        )
+    ]
+)
+
+
+def generate_records(rows_count, dependency_size):
+    for _ in range(rows_count):
+        dep_random = str(random.randint(1, dependency_size))
+
+        yield TableRecord(
+            table_descriptor=TableDescriptor("layout_benchmark_table"),
+            values={
+                FieldDescriptor("primary_field_1"): FieldValue(str(uuid.uuid4())),
+                FieldDescriptor("field_1"): FieldValue("field_1_" + dep_random),
+                FieldDescriptor("field_2"): FieldValue("field_2_" + dep_random),
+                FieldDescriptor("field_3"): FieldValue(str(uuid.uuid4())),
+            }
+        )
+
+
+def benchmark_layout(storage_layout: StorageLayout, rows_count, dependency_size):
+    core = Core(
+        redis_host=redis_host,
+        redis_port=redis_port,
+        metadata_store=MetadataStore(
+            tables=[
+                table
+            ],
+            config=CoreConfiguration(
+                storage_layout=storage_layout
+            )
+        ),
+        clean_redis=True
+    )
+
+    memory_before = core.conn.info("memory")["used_memory"]
+
+    start = perf_counter()
+    core.insert_many(generate_records(rows_count, dependency_size))
+    insert_time_spent = perf_counter() - start
+
+    memory_used = core.conn.info("memory")["used_memory"] - memory_before
+
+    selector = Selector(
+        select_fields={
+            TableDescriptor("layout_benchmark_table"): table.get_all_fields()
+        },
+        from_table=TableDescriptor("layout_benchmark_table"),
+        join_statements=[],
+        conditions=[]
+    )
+
+    start = perf_counter()
+    result = list(core.select(selector))
+    select_time_spent = perf_counter() - start
+
+    print(f"Layout {storage_layout.value}: {core.conn.dbsize()} keys, {memory_used} bytes "
+          f"({memory_used / rows_count:.1f} per row), inserted in {insert_time_spent}s, "
+          f"selected {len(result)} rows in {select_time_spent}s")
+
+
+def main():
+    rows_count = 10000
+    dependency_size = 10
+
+    if len(sys.argv) > 1:
+        rows_count = int(sys.argv[1])
+
+    if len(sys.argv) > 2:
+        dependency_size = int(sys.argv[2])
+
+    for storage_layout in StorageLayout:
+        benchmark_layout(storage_layout, rows_count, dependency_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import sys
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+import random
+
+from dotenv import load_dotenv
+
+from hash_db import Core, CoreConfiguration, TableDefinition, TableDescriptor, FieldDefinition, FieldDescriptor, \
+    FunctionalDependency, MetadataStore, TableRecord, FieldValue, InsertType
+
+load_dotenv()
+redis_host = os.environ["REDIS_HOST"]
+redis_port = os.environ["REDIS_PORT"]
+
+
+def create_core(insert_type: InsertType, max_connections: int) -> Core:
+    table = TableDefinition(
+        table_descriptor=TableDescriptor("insert_benchmark_table"),
+        fields=[
+            FieldDefinition(FieldDescriptor("primary_field_1"), primary_key=True),
+            FieldDefinition(FieldDescriptor("primary_field_2"), primary_key=True),
+            FieldDefinition(FieldDescriptor("field_1")),
+            FieldDefinition(FieldDescriptor("field_2")),
+            FieldDefinition(FieldDescriptor("field_3"))
+        ],
+        dependencies=[
+            FunctionalDependency(
+                determinants=[
+                    FieldDescriptor("field_1"),
+                    FieldDescriptor("field_2"),
+                ],
+                dependent=FieldDescriptor("field_3")
+            )
+        ]
+    )
+
+    return Core(
+        redis_host=redis_host,
+        redis_port=redis_port,
+        metadata_store=MetadataStore(
+            tables=[
+                table
+            ],
+            config=CoreConfiguration(
+                insert_type=insert_type,
+                max_connections=max_connections
+            )
+        ),
+        clean_redis=True
+    )
+
+
+def benchmark_worker(core: Core, rows_count, dependency_size):
+    for _ in range(rows_count):
+        # generate some data, which does not break functional dependencies
+        dep_2_random = str(random.randint(1, dependency_size))
+
+        core.insert(TableRecord(
+            table_descriptor=TableDescriptor("insert_benchmark_table"),
+            values={
+                FieldDescriptor("primary_field_1"): FieldValue(str(uuid.uuid4())),
+                FieldDescriptor("primary_field_2"): FieldValue(str(uuid.uuid4())),
+                FieldDescriptor("field_1"): FieldValue("field_1_" + dep_2_random),
+                FieldDescriptor("field_2"): FieldValue("field_2_" + dep_2_random),
+                FieldDescriptor("field_3"): FieldValue("field_3_" + dep_2_random),
+            }
+        ))
+
+
+def benchmark_threaded_insert(insert_type: InsertType, rows_count, threads_count, dependency_size):
+    # all threads share one Core and its connection pool
+    core = create_core(insert_type, threads_count)
+
+    rows_per_thread = rows_count // threads_count
+
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=threads_count) as executor:
+        futures = [executor.submit(benchmark_worker, core, rows_per_thread, dependency_size)
+                   for _ in range(threads_count)]
+        for future in futures:
+            future.result()
+    time_spent = perf_counter() - start
+
+    inserted_rows = rows_per_thread * threads_count
+    print(f"{threads_count} threads inserted {inserted_rows} rows in {time_spent}s "
+          f"({inserted_rows / time_spent:.0f} rows/s) with {core.metadata_store.insert_retries} insert retries")
+
+
+def main():
+    insert_type = InsertType.REDIS_SCRIPT
+    rows_count = 10000
+    max_threads_count = 16
+    dependency_size = 10
+
+    if len(sys.argv) > 1:
+        insert_type = InsertType[sys.argv[1].upper()]
+
+    if len(sys.argv) > 2:
+        rows_count = int(sys.argv[2])
+
+    if len(sys.argv) > 3:
+        max_threads_count = int(sys.argv[3])
+
+    if len(sys.argv) > 4:
+        dependency_size = int(sys.argv[4])
+
+    # throughput is measured for doubling number of threads, to show how it scales
+    threads_count = 1
+    while threads_count <= max_threads_count:
+        benchmark_threaded_insert(insert_type, rows_count, threads_count, dependency_size)
+        threads_count *= 2
+
+
+if __name__ == "__main__":
+    main()
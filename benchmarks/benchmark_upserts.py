@@ -0,0 +1,110 @@
+import sys
+import os
+import random
+from time import perf_counter
+
+from dotenv import load_dotenv
+
+from hash_db import Core, CoreConfiguration, TableDefinition, TableDescriptor, FieldDefinition, FieldDescriptor, \
+    MetadataStore, TableRecord, FieldValue, FunctionalDependency, InsertType
+
+load_dotenv()
+redis_host = os.environ["REDIS_HOST"]
+redis_port = os.environ["REDIS_PORT"]
+
+
+def create_core(insert_type: InsertType) -> Core:
+    table = TableDefinition(
+        table_descriptor=TableDescriptor("upsert_benchmark_table"),
+        fields=[
+            FieldDefinition(FieldDescriptor("primary_field_1"), primary_key=True),
+            FieldDefinition(FieldDescriptor("field_1")),
+            FieldDefinition(FieldDescriptor("field_2"))
+        ],
+        dependencies=[
+            FunctionalDependency(
+                determinants=[
+                    FieldDescriptor("field_1")
+                ],
+                dependent=FieldDescriptor("field_2")
+            )
+        ]
+    )
+
+    return Core(
+        redis_host=redis_host,
+        redis_port=redis_port,
+        metadata_store=MetadataStore(
+            tables=[
+                table
+            ],
+            config=CoreConfiguration(
+                insert_type=insert_type
+            )
+        ),
+        clean_redis=True
+    )
+
+
+def create_records(rows_count: int, fd_values: int) -> list[TableRecord]:
+    records = []
+    for i in range(rows_count):
+        # dependent value is derived from determinant, so records never break the dependency
+        value = random.randrange(fd_values)
+        records.append(TableRecord(
+            table_descriptor=TableDescriptor("upsert_benchmark_table"),
+            values={
+                FieldDescriptor("primary_field_1"): FieldValue(f"primary_{i}"),
+                FieldDescriptor("field_1"): FieldValue(f"field_1_{value}"),
+                FieldDescriptor("field_2"): FieldValue(f"field_2_{value}")
+            }
+        ))
+
+    return records
+
+
+def count_dependency_members(core: Core) -> int:
+    return sum(core.conn.scard(key) for key in core.conn.scan_iter("__dependency_index__:*"))
+
+
+def benchmark_upserts(insert_type: InsertType, rows_count: int, fd_values: int, rounds: int):
+    core = create_core(insert_type)
+    random.seed(0)
+    core.insert_many(create_records(rows_count, fd_values))
+
+    # every round writes all primary keys again with new determinant values
+    broken_count = 0
+    start = perf_counter()
+    for _ in range(rounds):
+        results = core.insert_many(create_records(rows_count, fd_values))
+        broken_count += sum(result is not None for result in results)
+    time_spent = perf_counter() - start
+
+    written_count = rows_count * rounds
+    # every record should be member of exactly one dependency index, surplus members are stale
+    stale_count = count_dependency_members(core) - rows_count
+
+    print(f"{insert_type.value}: wrote {written_count} rows in {time_spent:.3f}s ({written_count / time_spent:.0f} rows/s), "
+          f"{broken_count} rejected as broken, {stale_count} stale dependency index members")
+
+
+def main():
+    rows_count = 10000
+    fd_values = 100
+    rounds = 5
+
+    if len(sys.argv) > 1:
+        rows_count = int(sys.argv[1])
+
+    if len(sys.argv) > 2:
+        fd_values = int(sys.argv[2])
+
+    if len(sys.argv) > 3:
+        rounds = int(sys.argv[3])
+
+    benchmark_upserts(InsertType.REDIS_SCRIPT, rows_count, fd_values, rounds)
+    benchmark_upserts(InsertType.REDIS_SCRIPT_UPSERT, rows_count, fd_values, rounds)
+
+
+if __name__ == "__main__":
+    main()
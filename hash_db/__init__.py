@@ -1,6 +1,9 @@
 from hash_db.core import Core
-from hash_db.config import CoreConfiguration, InsertType, DeleteType, KeyPolicyType, ListRecordsType, JoiningAlgorithm
+from hash_db.async_core import AsyncCore
+from hash_db.config import CoreConfiguration, InsertType, DeleteType, KeyPolicyType, ListRecordsType, JoiningAlgorithm, \
+    StorageLayout, ScriptType
 
 from hash_db.models.basic_models import TableDescriptor, FieldDefinition, FieldValue, FieldDescriptor, Selector, JoinStatement, \
-    SelectorConditionEquals, SelectorConditionNot, ResultRow
+    SelectorConditionEquals, SelectorConditionIn, SelectorConditionNot, ResultRow, ResultSchema, CompactResultRow, \
+    PlanOperation, PlanStep, QueryPlan
 from hash_db.models.models import FunctionalDependency, TableDefinition, TableRecord, MetadataStore
@@ -0,0 +1,118 @@
+from typing import AsyncIterable, AsyncIterator, Iterable
+
+from redis.asyncio import Redis
+
+from hash_db.models import Selector, MetadataStore, TableRecord, CompactResultRow, QueryPlan
+from hash_db.config import ScriptType
+
+from hash_db.exceptions import DependencyBrokenException
+from hash_db.extensions.insertion import get_insert_script_arguments, INSERT_SCRIPTS
+from hash_db.extensions.deletion import get_delete_script_arguments, get_delete_selector, get_deleted_record, \
+    must_read_before_delete, DELETE_SCRIPTS
+from hash_db.extensions.async_selection import planned_select, execute_plan, get_statistics, iterate
+from hash_db.extensions.planner import get_planner, estimate_plan_rows
+from hash_db.tools.selection_tools import select_projection
+from hash_db.tools.scripts import AsyncScriptRegistry, AsyncFunctionRegistry
+from hash_db.tools.tools import chunked, async_chunked
+
+
+def get_async_script_registry(conn: Redis, metadata_store: MetadataStore,
+                              scripts: dict[str, str]) -> AsyncScriptRegistry:
+    if metadata_store.config.script_type == ScriptType.FUNCTION:
+        return AsyncFunctionRegistry(conn, scripts, metadata_store.get_schema_version())
+    return AsyncScriptRegistry(conn, scripts)
+
+
+class AsyncCore:
+    # Inserts and deletes always use the same Lua scripts as InsertType.REDIS_SCRIPT and DeleteType.REDIS_SCRIPT,
+    # so every write is single atomic round trip and does not need WATCH, which cannot be shared between coroutines.
+    # Instances are created with create, because connecting and loading scripts has to be awaited.
+    def __init__(self, redis_host: str, redis_port: str, metadata_store: MetadataStore):
+        self.conn: Redis = Redis(host=redis_host, port=redis_port, decode_responses=True)
+        self.metadata_store = metadata_store
+        self.scripts = get_async_script_registry(self.conn, metadata_store, {**INSERT_SCRIPTS, **DELETE_SCRIPTS})
+
+    @classmethod
+    async def create(cls, redis_host: str, redis_port: str, metadata_store: MetadataStore,
+                     clean_redis=False) -> "AsyncCore":
+        core = cls(redis_host, redis_port, metadata_store)
+        await core.conn.ping()  # throws redis.exceptions.ConnectionError if ping fails
+
+        if clean_redis:
+            await core.conn.flushdb()
+
+        await core.scripts.load_all()
+        return core
+
+    async def close(self):
+        await self.conn.aclose()
+
+    async def insert_many(self, records: Iterable[TableRecord], batch_size: int = 1000) -> list[
+        DependencyBrokenException | None]:
+        results = []
+
+        for batch in chunked(records, batch_size):
+            keys = []
+            args = []
+
+            for record in batch:
+                get_insert_script_arguments(self.metadata_store, record, keys, args)
+
+            res = await self.scripts.call("insert_records", keys, args)
+            results.extend(None if inserted == 1 else DependencyBrokenException() for inserted in res)
+
+        return results
+
+    async def insert(self, record: TableRecord):
+        result, = await self.insert_many([record])
+
+        if result is not None:
+            raise result
+
+    async def delete_many(self, records: Iterable[TableRecord] | AsyncIterable[TableRecord],
+                          batch_size: int = 1000) -> int:
+        if isinstance(records, AsyncIterable):
+            batches = async_chunked(records, batch_size)
+        else:
+            batches = iterate(chunked(records, batch_size))
+
+        deleted_count = 0
+        async for batch in batches:
+            keys = []
+            args = []
+
+            for record in batch:
+                get_delete_script_arguments(self.metadata_store, record, keys, args)
+
+            deleted_count += await self.scripts.call("delete_records", keys, args)
+
+        return deleted_count
+
+    async def delete(self, record: TableRecord) -> int:
+        return await self.delete_many([record])
+
+    async def delete_where(self, selector: Selector, batch_size: int = 1000) -> int:
+        delete_selector = get_delete_selector(self.metadata_store, selector)
+        results = planned_select(self.conn, self.metadata_store, delete_selector)
+
+        records = (get_deleted_record(delete_selector, result_row) async for result_row in results)
+        if must_read_before_delete(delete_selector):
+            records = [record async for record in records]
+
+        return await self.delete_many(records, batch_size)
+
+    async def select(self, selector: Selector) -> AsyncIterator[CompactResultRow]:
+        async for result_row in planned_select(self.conn, self.metadata_store, selector):
+            yield select_projection(selector, result_row)
+
+    async def explain(self, selector: Selector) -> QueryPlan:
+        statistics = await get_statistics(self.conn, self.metadata_store, selector)
+        plan = get_planner(self.metadata_store.config.joining_algorithm)(statistics, self.metadata_store, selector)
+
+        if any(step.estimated_rows is None for step in plan.steps):
+            estimate_plan_rows(statistics, self.metadata_store, selector, plan)
+
+        async for _ in execute_plan(self.conn, self.metadata_store, selector, plan):
+            pass
+
+        return plan
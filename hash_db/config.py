@@ -3,14 +3,26 @@ from dataclasses import dataclass
 
 
 class InsertType(Enum):
+    # not atomic, should not be used when records are inserted concurrently
     SIMPLE = "simple"
     TRANSACTIONAL = "transactional"
     REDIS_SCRIPT = "redis_script"
+    # existing record with the same primary key is replaced, its old dependency and index memberships are removed
+    REDIS_SCRIPT_UPSERT = "redis_script_upsert"
 
 
 class DeleteType(Enum):
     SIMPLE = "simple"
     REDIS_SCRIPT = "redis_script"
+    # record needs only primary key values, script deletes current state of record using links written by insert
+    REDIS_SCRIPT_BY_KEY = "redis_script_by_key"
+
+
+class ScriptType(Enum):
+    # scripts are loaded into script cache of server, which is lost on restart and is not replicated
+    EVAL = "eval"
+    # scripts are loaded once as library of Redis Functions, stored and replicated by server, requires redis 7
+    FUNCTION = "function"
 
 
 class KeyPolicyType(Enum):
@@ -18,20 +30,59 @@ class KeyPolicyType(Enum):
     HASH = "hash"
 
 
+class StorageLayout(Enum):
+    # every field of record is stored under separate string key
+    KEY_PER_FIELD = "key_per_field"
+    # every record is stored as single hash, with field names as hash fields
+    HASH_PER_RECORD = "hash_per_record"
+
+
 class ListRecordsType(Enum):
     SCAN = "scan"
     KEYS = "keys"
     SET = "set"
+    # set of table keys iterated incrementally with SSCAN, instead of reading it whole with SMEMBERS
+    SSCAN = "sscan"
 
 
 class JoiningAlgorithm(Enum):
     NESTED_LOOPS = "nested_loops"
+    HASH_JOIN = "hash_join"
+    # joins are reordered and joining method is chosen per join, using table statistics
+    COST_BASED = "cost_based"
 
 
 @dataclass
 class CoreConfiguration:
     insert_type: InsertType = InsertType.REDIS_SCRIPT
     delete_type: DeleteType = DeleteType.REDIS_SCRIPT
+    script_type: ScriptType = ScriptType.EVAL
     key_policy: KeyPolicyType = KeyPolicyType.JSON
+    storage_layout: StorageLayout = StorageLayout.KEY_PER_FIELD
     list_records_type: ListRecordsType = ListRecordsType.SET
+    # number of records whose fields are fetched with a single MGET during table scan
+    scan_chunk_size: int = 1000
+    # COUNT hint of every SCAN and SSCAN call, None uses redis default of 10
+    scan_count: int | None = None
+    # number of threads fetching scanned chunks concurrently, each of them borrows its own connection from the pool
+    scan_workers: int = 1
+    # number of joined rows checked with single SMISMEMBER and fetched with single MGET during primary key join
+    join_batch_size: int = 1000
     joining_algorithm: JoiningAlgorithm = JoiningAlgorithm.NESTED_LOOPS
+    # max number of rows kept in hash join build table, bigger inputs are partitioned to disk
+    hash_join_memory_budget: int = 100_000
+    hash_join_spill_partitions: int = 16
+    # connection pool shared by all threads using the same Core, None means no limit on number of connections,
+    # otherwise threads wait up to pool_timeout seconds for free connection
+    max_connections: int | None = None
+    pool_timeout: float | None = 20
+    socket_keepalive: bool = False
+    socket_timeout: float | None = None
+    socket_connect_timeout: float | None = None
+    # max number of read replies kept in client side cache of redis-py, None disables the cache,
+    # cache needs RESP3 connections and client tracking, so it requires redis 7.4 or newer
+    client_cache_size: int | None = None
+    # seconds for which select results are cached, None disables the cache
+    result_cache_ttl: float | None = None
+    # max number of result rows kept in result cache, counted over all cached selects
+    result_cache_max_rows: int = 100_000
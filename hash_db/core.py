@@ -1,16 +1,70 @@
-from redis import Redis
+from functools import partial
+from typing import Iterable, Iterator
 
-from hash_db.models import Selector, MetadataStore, TableRecord
+from redis import Redis, ConnectionPool, BlockingConnectionPool
+from redis.backoff import ExponentialBackoff
+from redis.retry import Retry
 
-from hash_db.extensions.insertion import get_insert_function
-from hash_db.extensions.selection import get_select_function
+from hash_db.models import Selector, MetadataStore, TableRecord, QueryPlan, FieldDescriptor, FieldValue
+from hash_db.config import DeleteType, ScriptType
+
+from hash_db.exceptions import DatabaseException, DependencyBrokenException
+from hash_db.extensions.insertion import get_insert_function, get_insert_many_function, INSERT_SCRIPTS
+from hash_db.extensions.update import update_using_redis_script, update_many_using_redis_script, \
+    upsert_using_redis_script, upsert_many_using_redis_script, UPDATE_SCRIPTS
+from hash_db.extensions.selection import planned_select, execute_plan, select_batches
+from hash_db.extensions.planner import get_planner, get_statistics, estimate_plan_rows
 from hash_db.tools.selection_tools import select_projection
-from hash_db.extensions.deletion import get_delete_function
+from hash_db.extensions.deletion import get_delete_function, get_delete_many_function, get_delete_selector, \
+    get_deleted_record, must_read_before_delete, DELETE_SCRIPTS
+from hash_db.tools.scripts import ScriptRegistry, FunctionRegistry
+from hash_db.tools.client_cache import ClientCache, get_cache_kwargs
+from hash_db.tools.result_cache import ResultCache, cached_select
+from hash_db.tools.batches import ColumnBatch
+from hash_db.tools.tools import chunked
+
+
+def get_connection_kwargs(redis_host: str, redis_port: str, metadata_store: MetadataStore) -> dict:
+    config = metadata_store.config
+
+    return dict(
+        host=redis_host,
+        port=redis_port,
+        decode_responses=True,
+        socket_keepalive=config.socket_keepalive,
+        socket_timeout=config.socket_timeout,
+        socket_connect_timeout=config.socket_connect_timeout,
+        # pool passed to Redis client does not get its default retry policy, so it is set here
+        retry=Retry(ExponentialBackoff(), 3),
+        **get_cache_kwargs(config.client_cache_size, metadata_store.tables.values())
+    )
+
+
+def create_connection_pool(redis_host: str, redis_port: str, metadata_store: MetadataStore) -> ConnectionPool:
+    config = metadata_store.config
+    connection_kwargs = get_connection_kwargs(redis_host, redis_port, metadata_store)
+
+    # blocking pool makes threads wait for free connection, instead of failing when the limit is reached
+    if config.max_connections is None:
+        return ConnectionPool(**connection_kwargs)
+    return BlockingConnectionPool(max_connections=config.max_connections, timeout=config.pool_timeout,
+                                  **connection_kwargs)
+
+
+def get_script_registry(conn: Redis, metadata_store: MetadataStore, scripts: dict[str, str]) -> ScriptRegistry:
+    if metadata_store.config.script_type == ScriptType.FUNCTION:
+        return FunctionRegistry(conn, scripts, metadata_store.get_schema_version())
+    return ScriptRegistry(conn, scripts)
 
 
+# Core can be shared by many threads, every command borrows connection from the pool only for its duration
 class Core:
-    def __init__(self, redis_host: str, redis_port: str, metadata_store: MetadataStore, clean_redis=False):
-        self.conn: Redis = Redis(host=redis_host, port=redis_port, decode_responses=True)
+    def __init__(self, redis_host: str, redis_port: str, metadata_store: MetadataStore, clean_redis=False,
+                 connection_pool: ConnectionPool | None = None):
+        if connection_pool is None:
+            connection_pool = create_connection_pool(redis_host, redis_port, metadata_store)
+
+        self.conn: Redis = Redis(connection_pool=connection_pool)
         self.conn.ping()  # throws redis.exceptions.ConnectionError if ping fails
 
         self.metadata_store = metadata_store
@@ -18,15 +72,135 @@ class Core:
         if clean_redis:
             self.conn.flushdb()
 
+        # scripts are loaded once, inserts and deletes call them by SHA or as functions of loaded library
+        self.scripts = get_script_registry(self.conn, metadata_store, {**INSERT_SCRIPTS, **DELETE_SCRIPTS,
+                                                                       **UPDATE_SCRIPTS})
+
+        # cache exists only if connection pool was created with client side caching by create_connection_pool
+        self.cache: ClientCache | None = None
+        if isinstance(self.conn.get_cache(), ClientCache):
+            self.cache = self.conn.get_cache()
+
+        self.result_cache: ResultCache | None = None
+        if metadata_store.config.result_cache_ttl is not None:
+            self.result_cache = ResultCache(metadata_store.config.result_cache_ttl,
+                                            metadata_store.config.result_cache_max_rows)
+
+    # keys of written tables are dropped from client cache right after the write, instead of waiting for invalidation
+    def invalidate_cache(self, records: Iterable[TableRecord]) -> None:
+        if self.cache is not None:
+            table_descriptors = {record.table_descriptor for record in records}
+            self.cache.invalidate_tables(self.metadata_store.get_table_by_name(table_descriptor)
+                                         for table_descriptor in table_descriptors)
+
     def insert(self, record: TableRecord):
-        return get_insert_function(self.metadata_store.config.insert_type)(self.conn, self.metadata_store, record)
+        insert_function = get_insert_function(self.metadata_store.config.insert_type)
+        try:
+            return insert_function(self.conn, self.scripts, self.metadata_store, record)
+        finally:
+            self.invalidate_cache([record])
+
+    def insert_many(self, records: Iterable[TableRecord], batch_size: int = 1000) -> list[
+        DependencyBrokenException | None]:
+        # every batch is checked and inserted atomically, broken records are reported instead of raised
+        insert_many_function = get_insert_many_function(self.metadata_store.config.insert_type)
+
+        results = []
+        for batch in chunked(records, batch_size):
+            results.extend(insert_many_function(self.conn, self.scripts, self.metadata_store, batch))
+            self.invalidate_cache(batch)
+
+        return results
+
+    # inserts record or replaces existing one with the same primary key, whatever insert type is configured
+    def upsert(self, record: TableRecord):
+        try:
+            upsert_using_redis_script(self.conn, self.scripts, self.metadata_store, record)
+        finally:
+            self.invalidate_cache([record])
+
+    def upsert_many(self, records: Iterable[TableRecord], batch_size: int = 1000) -> list[
+        DependencyBrokenException | None]:
+        results = []
+        for batch in chunked(records, batch_size):
+            results.extend(upsert_many_using_redis_script(self.conn, self.scripts, self.metadata_store, batch))
+            self.invalidate_cache(batch)
+
+        return results
+
+    # record needs only primary key values, raises RecordNotFoundException or DependencyBrokenException
+    def update(self, record: TableRecord, changes: dict[FieldDescriptor, FieldValue]):
+        try:
+            update_using_redis_script(self.conn, self.scripts, self.metadata_store, record, changes)
+        finally:
+            self.invalidate_cache([record])
+
+    # every batch is updated by single script call, failed updates are reported instead of raised
+    def update_many(self, updates: Iterable[tuple[TableRecord, dict[FieldDescriptor, FieldValue]]],
+                    batch_size: int = 1000) -> list[DatabaseException | None]:
+        results = []
+        for batch in chunked(updates, batch_size):
+            results.extend(update_many_using_redis_script(self.conn, self.scripts, self.metadata_store, batch))
+            self.invalidate_cache(record for record, _ in batch)
+
+        return results
 
     def delete(self, record: TableRecord):
-        return get_delete_function(self.metadata_store.config.delete_type)(self.conn, self.metadata_store, record)
+        delete_function = get_delete_function(self.metadata_store.config.delete_type)
+        try:
+            return delete_function(self.conn, self.scripts, self.metadata_store, record)
+        finally:
+            self.invalidate_cache([record])
+
+    # returns number of deleted records, records which are not in the table are skipped
+    def delete_many(self, records: Iterable[TableRecord], batch_size: int = 1000) -> int:
+        delete_many_function = get_delete_many_function(self.metadata_store.config.delete_type)
+
+        deleted_count = 0
+        for batch in chunked(records, batch_size):
+            deleted_count += delete_many_function(self.conn, self.scripts, self.metadata_store, batch)
+            self.invalidate_cache(batch)
+
+        return deleted_count
+
+    # deletes records of selector's from_table which match its joins and conditions, returns their number
+    def delete_where(self, selector: Selector, batch_size: int = 1000) -> int:
+        primary_key_only = self.metadata_store.config.delete_type == DeleteType.REDIS_SCRIPT_BY_KEY
+        delete_selector = get_delete_selector(self.metadata_store, selector, primary_key_only)
+        results = planned_select(self.conn, self.metadata_store, delete_selector)
+
+        records = (get_deleted_record(delete_selector, result_row) for result_row in results)
+        if must_read_before_delete(delete_selector):
+            records = list(records)
+
+        return self.delete_many(records, batch_size)
 
     def select(self, selector: Selector):
-        results = get_select_function(self.metadata_store.config.joining_algorithm)(self.conn, self.metadata_store,
-                                                                                    selector)
+        if self.result_cache is not None:
+            return cached_select(self.conn, self.metadata_store, self.result_cache, selector,
+                                 partial(self.select_uncached, selector))
+
+        return self.select_uncached(selector)
+
+    def select_uncached(self, selector: Selector):
+        results = planned_select(self.conn, self.metadata_store, selector)
 
         for result_row in results:
             yield select_projection(selector, result_row)
+
+    # yields ColumnBatch objects with at most batch_size rows, stored as one list of values per selected field
+    def select_batches(self, selector: Selector, batch_size: int = 10000) -> Iterator[ColumnBatch]:
+        return select_batches(self.conn, self.metadata_store, selector, batch_size)
+
+    def explain(self, selector: Selector) -> QueryPlan:
+        statistics = get_statistics(self.conn, self.metadata_store, selector)
+        plan = get_planner(self.metadata_store.config.joining_algorithm)(statistics, self.metadata_store, selector)
+
+        if any(step.estimated_rows is None for step in plan.steps):
+            estimate_plan_rows(statistics, self.metadata_store, selector, plan)
+
+        # plan is executed to fill actual row counts of every step
+        for _ in execute_plan(self.conn, self.metadata_store, selector, plan):
+            pass
+
+        return plan
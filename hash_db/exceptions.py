@@ -20,3 +20,7 @@ class DependencyException(DatabaseException):
 
 class DependencyBrokenException(DependencyException):
     pass
+
+
+class RecordNotFoundException(DatabaseException):
+    pass
@@ -0,0 +1,245 @@
+import asyncio
+from functools import partial
+from typing import AsyncIterable, AsyncIterator, Awaitable, Iterable, TypeVar
+
+from redis.asyncio import Redis
+
+from hash_db.tools.tools import get_key_generator, chunked, async_chunked
+from hash_db.tools.selection_tools import AsyncTableIterator, async_spill_to_partitions, read_partition
+from hash_db.tools.storage import async_fetch_field_values
+from hash_db.extensions.planner import get_planner, get_statistics_keys, needs_statistics
+from hash_db.extensions.selection import build_result_rows, get_joined_key_identifier, build_joined_rows, \
+    get_dependency_index_keys, get_dependency_index_key_identifiers, get_secondary_index_keys, \
+    join_with_target_records, get_join_fields, get_join_key, build_hash_table, probe_hash_table, hash_join_in_memory
+from hash_db.models import ResultRow, JoinStatement, Selector, MetadataStore, TableDescriptor, PlanOperation, \
+    PlanStep, QueryPlan
+
+T = TypeVar("T")
+
+
+async def take(records: AsyncIterator[T], count: int | None) -> list[T]:
+    # iterator is left open, so remaining records can still be read from it
+    head = []
+    if count == 0:
+        return head
+
+    async for record in records:
+        head.append(record)
+
+        if len(head) == count:
+            break
+
+    return head
+
+
+async def iterate(records: Iterable[T]) -> AsyncIterator[T]:
+    for record in records:
+        yield record
+
+
+async def chain_head(head: Iterable[T], records: AsyncIterable[T]) -> AsyncIterator[T]:
+    for record in head:
+        yield record
+
+    async for record in records:
+        yield record
+
+
+async def get_statistics(conn: Redis, metadata_store: MetadataStore, selector: Selector) -> dict[str, int]:
+    keys = get_statistics_keys(metadata_store, selector)
+
+    async with conn.pipeline(transaction=False) as pipeline:
+        for key in keys:
+            pipeline.scard(key)
+
+        return dict(zip(keys, await pipeline.execute()))
+
+
+# Index sets of all conditions are read concurrently
+async def get_indexed_key_identifiers(conn: Redis, metadata_store: MetadataStore, selector: Selector,
+                                      table_descriptor: TableDescriptor) -> set[str] | None:
+    equals_index_keys, in_index_keys = get_secondary_index_keys(metadata_store, selector, table_descriptor)
+    dependency_index_keys = get_dependency_index_keys(metadata_store, selector, table_descriptor)
+
+    if not equals_index_keys and not in_index_keys and not dependency_index_keys:
+        return None
+
+    async def read_dependency_index(dependency_key: str, member_prefix: str) -> set[str]:
+        return get_dependency_index_key_identifiers(await conn.smembers(dependency_key), member_prefix)
+
+    async def read_in_index(index_keys: list[str]) -> set[str]:
+        return await conn.sunion(index_keys) if index_keys else set()
+
+    reads = [read_dependency_index(dependency_key, member_prefix)
+             for dependency_key, member_prefix in dependency_index_keys]
+    reads.extend(read_in_index(index_keys) for index_keys in in_index_keys)
+    if equals_index_keys:
+        reads.append(conn.sinter(equals_index_keys))
+
+    return set.intersection(*await asyncio.gather(*reads))
+
+
+async def single_table_select(conn: Redis, metadata_store: MetadataStore, selector: Selector,
+                              table_descriptor: TableDescriptor) -> AsyncIterator[ResultRow]:
+    table = metadata_store.get_table_by_name(table_descriptor)
+
+    table_conditions = selector.parsed_conditions.get(table_descriptor, dict())
+    fields = list(selector.all_needed_fields[table_descriptor])
+
+    indexed_key_identifiers = await get_indexed_key_identifiers(conn, metadata_store, selector, table_descriptor)
+    if indexed_key_identifiers is None:
+        key_identifiers_chunks = AsyncTableIterator(conn, metadata_store, table_descriptor).chunks()
+    else:
+        key_identifiers_chunks = iterate(chunked(indexed_key_identifiers, metadata_store.config.scan_chunk_size))
+
+    # values of chunk are fetched while next chunk of keys is listed, at most one fetch is in flight
+    pending_fetch: asyncio.Task | None = None
+    try:
+        async for key_identifiers in key_identifiers_chunks:
+            fetch = asyncio.create_task(async_fetch_field_values(conn, metadata_store, table, key_identifiers,
+                                                                 fields))
+
+            if pending_fetch is not None:
+                for result_row in build_result_rows(table_descriptor, fields, await pending_fetch, table_conditions):
+                    yield result_row
+
+            pending_fetch = fetch
+
+        if pending_fetch is not None:
+            for result_row in build_result_rows(table_descriptor, fields, await pending_fetch, table_conditions):
+                yield result_row
+    finally:
+        if pending_fetch is not None:
+            pending_fetch.cancel()
+
+
+async def primary_key_join(conn: Redis, accumulator: AsyncIterable[ResultRow], metadata_store: MetadataStore,
+                           join_statement: JoinStatement, selector: Selector) -> AsyncIterator[ResultRow]:
+    target_table = metadata_store.get_table_by_name(join_statement.target_table)
+    fields = list(selector.all_needed_fields[join_statement.target_table])
+    table_conditions = selector.parsed_conditions.get(join_statement.target_table, dict())
+    key_generator = get_key_generator(metadata_store.config.key_policy)
+
+    async for accumulator_batch in async_chunked(accumulator, metadata_store.config.join_batch_size):
+        key_identifiers = [get_joined_key_identifier(accumulator_record, join_statement, key_generator)
+                           for accumulator_record in accumulator_batch]
+
+        # membership check and value fetch are independent, so both run concurrently
+        memberships, records_values = await asyncio.gather(
+            conn.smismember(target_table.get_table_key(), key_identifiers),
+            async_fetch_field_values(conn, metadata_store, target_table, key_identifiers, fields)
+        )
+
+        matching = [(accumulator_record, record_values)
+                    for accumulator_record, record_values, is_member
+                    in zip(accumulator_batch, records_values, memberships) if is_member]
+
+        for result_row in build_joined_rows(join_statement, [accumulator_record for accumulator_record, _ in matching],
+                                            fields, [record_values for _, record_values in matching],
+                                            table_conditions):
+            yield result_row
+
+
+async def nested_loops_join(accumulator: AsyncIterable[ResultRow], target_records: Awaitable[list[ResultRow]],
+                            join_statement: JoinStatement) -> AsyncIterator[ResultRow]:
+    target_records = await target_records
+
+    async for accumulator_record in accumulator:
+        for result_row in join_with_target_records(accumulator_record, target_records, join_statement):
+            yield result_row
+
+
+async def hash_join(accumulator: AsyncIterator[ResultRow], target_head: Awaitable[list[ResultRow]],
+                    target_records: AsyncIterator[ResultRow], join_statement: JoinStatement,
+                    metadata_store: MetadataStore) -> AsyncIterator[ResultRow]:
+    base_fields, target_fields = get_join_fields(join_statement)
+
+    config = metadata_store.config
+
+    # heads hold at most budget + 1 records, all of them fit only if input is not bigger than budget
+    target_head = await target_head
+    target_fits = len(target_head) <= config.hash_join_memory_budget
+    accumulator_head = await take(accumulator, config.hash_join_memory_budget + 1)
+    accumulator_fits = len(accumulator_head) <= config.hash_join_memory_budget
+
+    target_records = chain_head(target_head, target_records)
+    accumulator = chain_head(accumulator_head, accumulator)
+
+    # hash table is built on the smaller input, the other one is streamed as probe side
+    if accumulator_fits and (not target_fits or len(accumulator_head) < len(target_head)):
+        hash_table = build_hash_table(accumulator_head, base_fields)
+
+        async for target_record in target_records:
+            for result_row in probe_hash_table(hash_table, target_record, target_fields, True):
+                yield result_row
+        return
+
+    if target_fits:
+        hash_table = build_hash_table(target_head, target_fields)
+
+        async for accumulator_record in accumulator:
+            for result_row in probe_hash_table(hash_table, accumulator_record, base_fields, False):
+                yield result_row
+        return
+
+    build_partitions = await async_spill_to_partitions(target_records, partial(get_join_key, fields=target_fields),
+                                                       config.hash_join_spill_partitions)
+    probe_partitions = await async_spill_to_partitions(accumulator, partial(get_join_key, fields=base_fields),
+                                                       config.hash_join_spill_partitions)
+
+    for build_partition, probe_partition in zip(build_partitions, probe_partitions):
+        for result_row in hash_join_in_memory(read_partition(build_partition), target_fields,
+                                              read_partition(probe_partition), base_fields, False):
+            yield result_row
+
+
+async def count_rows(step: PlanStep, records: AsyncIterable[ResultRow]) -> AsyncIterator[ResultRow]:
+    step.actual_rows = 0
+
+    async for record in records:
+        step.actual_rows += 1
+        yield record
+
+
+# Join targets are read in background tasks as soon as execution starts,
+# so they are loaded concurrently with base table and with each other
+async def execute_plan(conn: Redis, metadata_store: MetadataStore, selector: Selector,
+                       plan: QueryPlan) -> AsyncIterator[ResultRow]:
+    base_step, *join_steps = plan.steps
+    tasks: list[asyncio.Task] = []
+
+    result = count_rows(base_step, single_table_select(conn, metadata_store, selector, base_step.table_descriptor))
+
+    for step in join_steps:
+        if step.operation == PlanOperation.PRIMARY_KEY_JOIN:
+            result = primary_key_join(conn, result, metadata_store, step.join_statement, selector)
+        else:
+            target_records = single_table_select(conn, metadata_store, selector, step.table_descriptor)
+
+            if step.operation == PlanOperation.HASH_JOIN:
+                target_head = asyncio.create_task(take(target_records,
+                                                       metadata_store.config.hash_join_memory_budget + 1))
+                tasks.append(target_head)
+                result = hash_join(result, target_head, target_records, step.join_statement, metadata_store)
+            else:
+                target_head = asyncio.create_task(take(target_records, None))
+                tasks.append(target_head)
+                result = nested_loops_join(result, target_head, step.join_statement)
+
+        result = count_rows(step, result)
+
+    try:
+        async for result_row in result:
+            yield result_row
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def planned_select(conn: Redis, metadata_store: MetadataStore, selector: Selector) -> AsyncIterator[ResultRow]:
+    joining_algorithm = metadata_store.config.joining_algorithm
+    statistics = await get_statistics(conn, metadata_store, selector) if needs_statistics(joining_algorithm) else dict()
+    plan = get_planner(joining_algorithm)(statistics, metadata_store, selector)
+
+    async for result_row in execute_plan(conn, metadata_store, selector, plan):
+        yield result_row
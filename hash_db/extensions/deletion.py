@@ -1,86 +1,356 @@
+from functools import partial
+
 from redis import Redis
-from hash_db.models import MetadataStore, TableRecord
+from hash_db.models import MetadataStore, TableRecord, TableDescriptor, Selector, ResultRow, FieldValue
 from hash_db.config import DeleteType
+from hash_db.tools.scripts import ScriptRegistry
+from hash_db.tools.storage import delete_field, fetch_field_values
+
+
+LUA_DELETE_RECORDS = """
+-- empty hash field means that value is stored in plain string key
+local function delete_field(key, hash_field)
+    if hash_field == "" then
+        redis.call("DEL", key)
+    else
+        redis.call("HDEL", key, hash_field)
+    end
+end
+
+local keys_idx = 1
+local argv_idx = 1
+
+local deleted_count = 0
+
+while argv_idx <= #ARGV do
+    local table_key = KEYS[keys_idx]
+    local table_version_key = KEYS[keys_idx + 1]
+    local links_key = KEYS[keys_idx + 2]
+    local key_identifier = ARGV[argv_idx]
+    local field_count = tonumber(ARGV[argv_idx + 1])
+    keys_idx = keys_idx + 3
+    argv_idx = argv_idx + 2
+
+    -- records which are not in the table are skipped, so they are not counted as deleted
+    local record_exists = redis.call("SREM", table_key, key_identifier) == 1
+
+    for field_iter = 1, field_count do
+        local field_key = KEYS[keys_idx]
+        local hash_field = ARGV[argv_idx]
+        local dependency_count = tonumber(ARGV[argv_idx + 1])
+        local index_count = tonumber(ARGV[argv_idx + 2])
+        argv_idx = argv_idx + 3
+
+        if record_exists then
+            -- every dependency has index key followed by companion key holding dependent value
+            for dependency_iter = 1, dependency_count do
+                local dependency_key = KEYS[keys_idx + 2 * dependency_iter - 1]
+                local dependency_value_key = KEYS[keys_idx + 2 * dependency_iter]
+
+                redis.call("SREM", dependency_key, field_key)
+
+                -- dependent value is kept only as long as any record uses it
+                if redis.call("SCARD", dependency_key) == 0 then
+                    redis.call("DEL", dependency_value_key)
+                end
+            end
+
+            for index_iter = 1, index_count do
+                redis.call("SREM", KEYS[keys_idx + 2 * dependency_count + index_iter], key_identifier)
+            end
+
+            delete_field(field_key, hash_field)
+        end
+
+        keys_idx = keys_idx + 2 * dependency_count + index_count + 1
+    end
+
+    if record_exists then
+        redis.call("DEL", links_key)
+        redis.call("INCR", table_version_key)
+        deleted_count = deleted_count + 1
+    end
+end
+
+return deleted_count
+"""
+
+LUA_DELETE_RECORDS_BY_KEY = """
+-- empty hash field means that value is stored in plain string key
+local function delete_field(key, hash_field)
+    if hash_field == "" then
+        redis.call("DEL", key)
+    else
+        redis.call("HDEL", key, hash_field)
+    end
+end
+
+local keys_idx = 1
+local argv_idx = 1
+
+-- 1 for deleted record, 0 for record which is not in the table and -1 for record without links,
+-- which was inserted before links existed, so it has to be deleted using its field values
+local results = {}
+
+while argv_idx <= #ARGV do
+    local table_key = KEYS[keys_idx]
+    local table_version_key = KEYS[keys_idx + 1]
+    local links_key = KEYS[keys_idx + 2]
+    local key_identifier = ARGV[argv_idx]
+    local field_count = tonumber(ARGV[argv_idx + 1])
+    local has_links = ARGV[argv_idx + 2] == "1"
+    keys_idx = keys_idx + 3
+    argv_idx = argv_idx + 3
+
+    local field_keys = {}
+    local field_locations = {}
+    for field_iter = 1, field_count do
+        local field_key = KEYS[keys_idx]
+        local field_name = ARGV[argv_idx]
+        local hash_field = ARGV[argv_idx + 1]
+
+        field_keys[field_name] = field_key
+        table.insert(field_locations, {field_key, hash_field})
+
+        keys_idx = keys_idx + 1
+        argv_idx = argv_idx + 2
+    end
+
+    local result = 0
+
+    if redis.call("SISMEMBER", table_key, key_identifier) == 1 then
+        local links = redis.call("LRANGE", links_key, 0, -1)
+
+        if has_links and #links == 0 then
+            result = -1
+        else
+            -- links are triples of index key, dependent field name and companion key of dependency index
+            for i = 1, #links, 3 do
+                local index_key = links[i]
+                local field_name = links[i + 1]
+                local dependency_value_key = links[i + 2]
+
+                if field_name == "" then
+                    redis.call("SREM", index_key, key_identifier)
+                else
+                    redis.call("SREM", index_key, field_keys[field_name])
+
+                    -- dependent value is kept only as long as any record uses it
+                    if redis.call("SCARD", index_key) == 0 then
+                        redis.call("DEL", dependency_value_key)
+                    end
+                end
+            end
+
+            for i = 1, #field_locations do
+                delete_field(field_locations[i][1], field_locations[i][2])
+            end
+
+            redis.call("SREM", table_key, key_identifier)
+            redis.call("DEL", links_key)
+            redis.call("INCR", table_version_key)
+            result = 1
+        end
+    end
+
+    table.insert(results, result)
+end
+
+return results
+"""
+
+DELETE_SCRIPTS = {
+    "delete_records": LUA_DELETE_RECORDS,
+    "delete_records_by_key": LUA_DELETE_RECORDS_BY_KEY
+}
 
 
 def get_delete_function(delete_type: DeleteType):
     return {
         DeleteType.SIMPLE: simple_delete,
-        DeleteType.REDIS_SCRIPT: delete_using_redis_script
+        DeleteType.REDIS_SCRIPT: delete_using_redis_script,
+        DeleteType.REDIS_SCRIPT_BY_KEY: delete_by_key_using_redis_script
     }[delete_type]
 
 
-def simple_delete(conn: Redis, metadata_store: MetadataStore, record: TableRecord) -> None:
+def get_delete_many_function(delete_type: DeleteType):
+    return {
+        DeleteType.SIMPLE: partial(delete_many_one_by_one, simple_delete),
+        DeleteType.REDIS_SCRIPT: delete_many_using_redis_script,
+        DeleteType.REDIS_SCRIPT_BY_KEY: delete_many_by_key_using_redis_script
+    }[delete_type]
+
+
+# returns number of deleted records, which is 0 when record was not in the table
+def simple_delete(conn: Redis, scripts: ScriptRegistry, metadata_store: MetadataStore, record: TableRecord) -> int:
     with conn.pipeline() as pipeline:
         table = metadata_store.get_table_by_name(record.table_descriptor)
 
         pipeline.multi()
 
+        table_key = table.get_table_key()
+        key_identifier = record.get_primary_key_identifier(metadata_store)
+
         for field_descriptor in table.get_all_fields():
-            field_key = record.get_field_key(metadata_store, field_descriptor)
+            field_key, hash_field = record.get_field_location(metadata_store, field_descriptor, key_identifier)
 
             for dependency in table.functional_dependencies.get(field_descriptor, []):
                 dependency_key = dependency.get_key(metadata_store, record)
                 conn.srem(dependency_key, field_key)
 
-            conn.delete(field_key)
+                if conn.scard(dependency_key) == 0:
+                    conn.delete(dependency.get_value_key(metadata_store, record))
 
-        table_key = table.get_table_key()
-        key_identifier = record.get_primary_key_identifier(metadata_store)
-        conn.srem(table_key, key_identifier)
+            for index_key in table.get_index_keys(field_descriptor, record.get_value(field_descriptor)):
+                conn.srem(index_key, key_identifier)
+
+            delete_field(conn, field_key, hash_field)
+
+        deleted_count = conn.srem(table_key, key_identifier)
+        conn.delete(table.get_links_key(key_identifier))
+        conn.incr(table.get_version_key())
 
         pipeline.execute()
 
+        return deleted_count
 
-def delete_using_redis_script(conn: Redis, metadata_store: MetadataStore, record: TableRecord):
-    keys = []
-    args = []
 
+def get_delete_script_arguments(metadata_store: MetadataStore, record: TableRecord,
+                                keys: list[str], args: list) -> None:
     table = metadata_store.get_table_by_name(record.table_descriptor)
     table_key = table.get_table_key()
     key_identifier = record.get_primary_key_identifier(metadata_store)
+    all_fields = table.get_all_fields()
+
     keys.append(table_key)
+    keys.append(table.get_version_key())
+    keys.append(table.get_links_key(key_identifier))
     args.append(key_identifier)
+    args.append(len(all_fields))
 
-    table = metadata_store.get_table_by_name(record.table_descriptor)
-
-    for field_descriptor in table.get_all_fields():
-        field_key = record.get_field_key(metadata_store, field_descriptor)
+    for field_descriptor in all_fields:
+        field_key, hash_field = record.get_field_location(metadata_store, field_descriptor, key_identifier)
 
         dependencies = table.functional_dependencies.get(field_descriptor, [])
+        index_keys = table.get_index_keys(field_descriptor, record.get_value(field_descriptor))
 
         keys.append(field_key)
+        args.append(hash_field)
         args.append(len(dependencies))
+        args.append(len(index_keys))
 
         for dependency in dependencies:
-            dependency_key = dependency.get_key(metadata_store, record)
-            keys.append(dependency_key)
+            keys.extend(dependency.get_keys(metadata_store, record))
 
-    lua_delete_record_script = """
-    local argv_idx = 2
-    local keys_idx = 2
+        keys.extend(index_keys)
 
-    while keys_idx <= #KEYS do
-        local field_key = KEYS[keys_idx]
-        local dependency_count = ARGV[argv_idx]
 
-        for dependency_iter = 1, dependency_count do
-            local dependency_key = KEYS[keys_idx + dependency_iter]
+def delete_many_using_redis_script(conn: Redis, scripts: ScriptRegistry, metadata_store: MetadataStore,
+                                   records: list[TableRecord]) -> int:
+    keys = []
+    args = []
+
+    for record in records:
+        get_delete_script_arguments(metadata_store, record, keys, args)
+
+    return scripts.call("delete_records", keys, args)
+
+
+def delete_using_redis_script(conn: Redis, scripts: ScriptRegistry, metadata_store: MetadataStore,
+                              record: TableRecord) -> int:
+    return delete_many_using_redis_script(conn, scripts, metadata_store, [record])
+
+
+def get_delete_by_key_script_arguments(metadata_store: MetadataStore, record: TableRecord,
+                                       keys: list[str], args: list) -> None:
+    table = metadata_store.get_table_by_name(record.table_descriptor)
+    key_identifier = record.get_primary_key_identifier(metadata_store)
+    all_fields = table.get_all_fields()
+
+    keys.append(table.get_table_key())
+    keys.append(table.get_version_key())
+    keys.append(table.get_links_key(key_identifier))
+    args.append(key_identifier)
+    args.append(len(all_fields))
+    args.append(1 if table.has_links() else 0)
+
+    for field_descriptor in all_fields:
+        field_key, hash_field = record.get_field_location(metadata_store, field_descriptor, key_identifier)
+
+        keys.append(field_key)
+        args.append(field_descriptor.name)
+        args.append(hash_field)
+
+
+# record read from redis, with current values of all fields
+def read_record(conn: Redis, metadata_store: MetadataStore, record: TableRecord) -> TableRecord:
+    table = metadata_store.get_table_by_name(record.table_descriptor)
+    fields = table.get_all_fields()
+
+    record_values, = fetch_field_values(conn, metadata_store, table, [record.get_primary_key_identifier(metadata_store)],
+                                        fields)
+
+    return TableRecord(
+        table_descriptor=record.table_descriptor,
+        values={field: FieldValue(value) for field, value in zip(fields, record_values) if value is not None}
+    )
+
+
+# Records need only primary key values, keys of indexes are read from links stored by insert,
+# so current state of record is deleted in single round trip, no matter what values caller knows
+def delete_many_by_key_using_redis_script(conn: Redis, scripts: ScriptRegistry, metadata_store: MetadataStore,
+                                          records: list[TableRecord]) -> int:
+    keys = []
+    args = []
+
+    for record in records:
+        get_delete_by_key_script_arguments(metadata_store, record, keys, args)
+
+    results = scripts.call("delete_records_by_key", keys, args)
+
+    # records inserted before links existed are read and deleted using their current values
+    unlinked_records = [read_record(conn, metadata_store, record)
+                        for record, result in zip(records, results) if result == -1]
+
+    deleted_count = results.count(1)
+    if unlinked_records:
+        deleted_count += delete_many_using_redis_script(conn, scripts, metadata_store, unlinked_records)
+
+    return deleted_count
+
+
+def delete_by_key_using_redis_script(conn: Redis, scripts: ScriptRegistry, metadata_store: MetadataStore,
+                                     record: TableRecord) -> int:
+    return delete_many_by_key_using_redis_script(conn, scripts, metadata_store, [record])
+
+
+def delete_many_one_by_one(delete_function, conn: Redis, scripts: ScriptRegistry, metadata_store: MetadataStore,
+                           records: list[TableRecord]) -> int:
+    return sum(delete_function(conn, scripts, metadata_store, record) for record in records)
+
+
+# Selector reading fields of deleted table needed by delete, so matching rows can be turned into records.
+# Delete by key needs only primary key, other deletes need every field
+def get_delete_selector(metadata_store: MetadataStore, selector: Selector, primary_key_only: bool = False) -> Selector:
+    table = metadata_store.get_table_by_name(selector.from_table)
+    fields = table.get_primary_key_fields() if primary_key_only else table.get_all_fields()
+
+    return Selector(
+        select_fields={selector.from_table: fields},
+        from_table=selector.from_table,
+        join_statements=selector.join_statements,
+        conditions=selector.conditions
+    )
 
-            redis.call("SREM", dependency_key, field_key)
-        end
-        
-        redis.call("DEL", field_key)
-        
-        keys_idx = keys_idx + dependency_count + 1
-        argv_idx = argv_idx + 1
-    end
 
-    local table_key = KEYS[1]
-    local key_identifier = ARGV[1]
-    redis.call("SREM", table_key, key_identifier)
+def get_deleted_record(selector: Selector, result_row: ResultRow) -> TableRecord:
+    return TableRecord(
+        table_descriptor=TableDescriptor(selector.from_table.name),
+        values=result_row.values[selector.from_table.get_alias()]
+    )
 
-    return "OK"
-    """
 
-    conn.register_script(lua_delete_record_script)(keys=keys, args=args)
+# rows are deleted while select is still reading following rows, unless deleted table is also joined,
+# then all matching rows are read first, so deletes do not change which rows match
+def must_read_before_delete(selector: Selector) -> bool:
+    return any(statement.target_table.name == selector.from_table.name for statement in selector.join_statements)
@@ -1,3 +1,5 @@
+from functools import partial
+
 import redis
 from redis import Redis
 from redis.client import Pipeline
@@ -5,83 +7,192 @@ from redis.client import Pipeline
 from hash_db.exceptions import DependencyBrokenException
 
 from hash_db.config import InsertType
-from hash_db.models import MetadataStore, TableRecord
+from hash_db.models import MetadataStore, TableRecord, FieldDescriptor
+from hash_db.tools.scripts import ScriptRegistry
+from hash_db.tools.storage import read_field, write_field
+from hash_db.extensions.update import upsert_using_redis_script, upsert_many_using_redis_script
 
 
 def get_insert_function(insert_type: InsertType):
     return {
         InsertType.SIMPLE: simple_insert_value,
         InsertType.TRANSACTIONAL: insert_value_transaction,
-        InsertType.REDIS_SCRIPT: insert_using_lua_script
+        InsertType.REDIS_SCRIPT: insert_using_lua_script,
+        InsertType.REDIS_SCRIPT_UPSERT: upsert_using_redis_script
     }[insert_type]
 
 
+def get_insert_many_function(insert_type: InsertType):
+    return {
+        InsertType.SIMPLE: partial(insert_many_one_by_one, simple_insert_value),
+        InsertType.TRANSACTIONAL: partial(insert_many_one_by_one, insert_value_transaction),
+        InsertType.REDIS_SCRIPT: insert_many_using_lua_script,
+        InsertType.REDIS_SCRIPT_UPSERT: upsert_many_using_redis_script
+    }[insert_type]
+
+
+def read_dependent_value(conn: Redis | Pipeline, dependency_key: str, dependency_value_key: str, hash_field: str,
+                         watch: bool) -> tuple[bool, str | None]:
+    # returns whether dependency index has any member, and dependent value shared by its members
+
+    # canonical value is kept next to dependency index, so it is checked with single GET
+    dependent_value = conn.get(dependency_value_key)
+    if dependent_value is not None:
+        return True, dependent_value
+
+    # records inserted before companion keys existed, or with empty dependent value, are checked using any member
+    dependency_index_random_member = conn.srandmember(dependency_key)
+    if dependency_index_random_member is None:
+        return False, None
+
+    if watch:
+        conn.watch(dependency_index_random_member)
+
+    return True, read_field(conn, dependency_index_random_member, hash_field)
+
+
 def check_dependencies(conn: Redis | Pipeline, metadata_store: MetadataStore, record: TableRecord) -> tuple[
-    bool, list[tuple[str, str]]]:
-    dependency_indexes_update_list: list[tuple[str, str]] = []
+    bool, list[tuple[str, str, str, str, str | None]]]:
+    # update list holds dependency index key, its companion value key, field key, field name and dependent value
+    dependency_indexes_update_list: list[tuple[str, str, str, str, str | None]] = []
 
     table = metadata_store.get_table_by_name(record.table_descriptor)
 
+    # WATCH is meaningful only on pipeline, which holds its own connection. Sent through shared client,
+    # it would stay on pooled connection and break transaction of other thread, which gets that connection next
+    watch = isinstance(conn, Pipeline)
+
+    key_identifier = record.get_primary_key_identifier(metadata_store)
+
     for field_descriptor in table.get_all_fields():
         field_value = record.get_value(field_descriptor)
-        value_key = record.get_field_key(metadata_store, field_descriptor)
+        value_key, hash_field = record.get_field_location(metadata_store, field_descriptor, key_identifier)
 
         # ensure value will not be changed until transaction executed
-        conn.watch(value_key)
+        if watch:
+            conn.watch(value_key)
 
         for dependency in table.functional_dependencies.get(field_descriptor, []):
-            dependency_key = dependency.get_key(metadata_store, record)
+            dependency_key, dependency_value_key = dependency.get_keys(metadata_store, record)
 
             # ensure dependency index will not be changed until transaction executed
-            conn.watch(dependency_key)
+            if watch:
+                conn.watch(dependency_key, dependency_value_key)
 
-            dependency_index_random_member = conn.srandmember(dependency_key)
+            has_members, expected_value = read_dependent_value(conn, dependency_key, dependency_value_key, hash_field,
+                                                               watch)
+            if has_members and expected_value != field_value:
+                return False, []
 
-            if dependency_index_random_member is not None:
-                conn.watch(dependency_index_random_member)
+            dependency_indexes_update_list.append((dependency_key, dependency_value_key, value_key,
+                                                   field_descriptor.name, field_value))
 
-                expected_value = conn.get(dependency_index_random_member)
-                if expected_value != field_value:
-                    # print(f"{value_key}, {dependency_key}, {expected_value}, {field_value}")
-                    return False, []
+    return True, dependency_indexes_update_list
 
-            dependency_indexes_update_list.append((dependency_key, value_key))
 
-    return True, dependency_indexes_update_list
+def read_replaced_links(conn: Redis | Pipeline, metadata_store: MetadataStore, record: TableRecord,
+                        dependency_indexes_update_list: list[tuple[str, str, str, str, str | None]]) -> list[
+        tuple[str, str, str, bool]]:
+    # returns memberships of previously inserted version of the record, which new version does not keep,
+    # as index key, member, companion value key and whether index is left empty, so its companion is dropped too
+    table = metadata_store.get_table_by_name(record.table_descriptor)
+    if not table.has_links():
+        return []
+
+    watch = isinstance(conn, Pipeline)
+
+    key_identifier = record.get_primary_key_identifier(metadata_store)
+    links_key = table.get_links_key(key_identifier)
+    if watch:
+        conn.watch(links_key)
+
+    kept_index_keys = {dependency_key for dependency_key, *_ in dependency_indexes_update_list}
+    for field_descriptor in table.get_all_fields():
+        kept_index_keys.update(table.get_index_keys(field_descriptor, record.get_value(field_descriptor)))
+
+    links = conn.lrange(links_key, 0, -1)
+    replaced_links = []
+    for link_idx in range(0, len(links), 3):
+        index_key, field_name, dependency_value_key = links[link_idx:link_idx + 3]
+        if index_key in kept_index_keys:
+            continue
+
+        # dependency indexes hold field keys, secondary indexes hold record identifiers
+        if field_name:
+            member, _ = record.get_field_location(metadata_store, FieldDescriptor(field_name), key_identifier)
+        else:
+            member = key_identifier
+
+        if watch:
+            conn.watch(index_key)
+
+        left_empty = conn.scard(index_key) == 1 and bool(conn.sismember(index_key, member))
+        replaced_links.append((index_key, member, dependency_value_key, left_empty))
+
+    return replaced_links
 
 
 def insert_record_data(conn: Redis | Pipeline, metadata_store: MetadataStore, record: TableRecord,
-                       dependency_indexes_update_list: list[tuple[str, str]]) -> None:
+                       dependency_indexes_update_list: list[tuple[str, str, str, str, str | None]],
+                       replaced_links: list[tuple[str, str, str, bool]]) -> None:
     table = metadata_store.get_table_by_name(record.table_descriptor)
 
-    for dependency_key, value_key in dependency_indexes_update_list:
+    # memberships of previously inserted version are removed, so links always describe all memberships of the record
+    for index_key, member, dependency_value_key, left_empty in replaced_links:
+        conn.srem(index_key, member)
+        if left_empty and dependency_value_key:
+            conn.delete(dependency_value_key)
+
+    for dependency_key, dependency_value_key, value_key, _, field_value in dependency_indexes_update_list:
         conn.sadd(dependency_key, value_key)
 
+        if field_value is not None:
+            conn.set(dependency_value_key, field_value)
+
     # we should maintain records index set to use when listing records
     table_key = table.get_table_key()
     key_identifier = record.get_primary_key_identifier(metadata_store)
     conn.sadd(table_key, key_identifier)
+    conn.incr(table.get_version_key())
+
+    links = []
+    for dependency_key, dependency_value_key, value_key, field_name, _ in dependency_indexes_update_list:
+        links.extend((dependency_key, field_name, dependency_value_key))
 
     for field_descriptor in table.get_all_fields():
-        value_key = record.get_field_key(metadata_store, field_descriptor)
+        value_key, hash_field = record.get_field_location(metadata_store, field_descriptor, key_identifier)
         field_value = record.get_value_object(field_descriptor)
 
         if field_value is not None:
-            conn.set(value_key, field_value.value)
+            write_field(conn, value_key, hash_field, field_value.value)
 
+        for index_key in table.get_index_keys(field_descriptor, record.get_value(field_descriptor)):
+            conn.sadd(index_key, key_identifier)
+            links.extend((index_key, "", ""))
 
-def simple_insert_value(conn: Redis, metadata_store: MetadataStore, record: TableRecord) -> None:
+    if table.has_links():
+        links_key = table.get_links_key(key_identifier)
+        conn.delete(links_key)
+        if links:
+            conn.rpush(links_key, *links)
+
+
+def simple_insert_value(conn: Redis, scripts: ScriptRegistry, metadata_store: MetadataStore,
+                        record: TableRecord) -> None:
     # check all dependencies for all fields. raises exception if dependency is broken
     was_dependency_fulfilled, dependency_indexes_update_list = check_dependencies(conn, metadata_store, record)
 
     if not was_dependency_fulfilled:
         raise DependencyBrokenException
 
+    replaced_links = read_replaced_links(conn, metadata_store, record, dependency_indexes_update_list)
+
     # if no dependency is broken, update dependency indexes and insert values
-    insert_record_data(conn, metadata_store, record, dependency_indexes_update_list)
+    insert_record_data(conn, metadata_store, record, dependency_indexes_update_list, replaced_links)
 
 
-def insert_value_transaction(conn: Redis, metadata_store: MetadataStore, record: TableRecord) -> None:
+def insert_value_transaction(conn: Redis, scripts: ScriptRegistry, metadata_store: MetadataStore,
+                             record: TableRecord) -> None:
     with conn.pipeline() as pipeline:
         while True:
             try:
@@ -99,97 +210,234 @@ def insert_value_transaction(conn: Redis, metadata_store: MetadataStore, record:
                     pipeline.execute()
                     raise DependencyBrokenException
 
+                replaced_links = read_replaced_links(pipeline, metadata_store, record, dependency_indexes_update_list)
+
                 # start actual transaction
                 pipeline.multi()
 
                 # if no dependency is broken, update dependency indexes and insert values
-                insert_record_data(pipeline, metadata_store, record, dependency_indexes_update_list)
+                insert_record_data(pipeline, metadata_store, record, dependency_indexes_update_list,
+                                   replaced_links)
 
                 pipeline.execute()
                 break
 
             except redis.WatchError:
-                metadata_store.insert_retries += 1
+                metadata_store.add_insert_retry()
 
 
-def insert_using_lua_script(conn: Redis, metadata_store: MetadataStore, record: TableRecord) -> None:
-    keys = []
-    args = []
+LUA_INSERT_RECORDS = """
+-- empty hash field means that value is stored in plain string key
+local function get_field(key, hash_field)
+    if hash_field == "" then
+        return redis.call("GET", key)
+    end
+    return redis.call("HGET", key, hash_field)
+end
+
+local function set_field(key, hash_field, value)
+    if hash_field == "" then
+        redis.call("SET", key, value)
+    else
+        redis.call("HSET", key, hash_field, value)
+    end
+end
+
+local keys_idx = 1
+local argv_idx = 1
 
+local results = {}
+
+while argv_idx <= #ARGV do
+    local table_key = KEYS[keys_idx]
+    local table_version_key = KEYS[keys_idx + 1]
+    local links_key = KEYS[keys_idx + 2]
+    local key_identifier = ARGV[argv_idx]
+    local field_count = tonumber(ARGV[argv_idx + 1])
+    keys_idx = keys_idx + 3
+    argv_idx = argv_idx + 2
+
+    local dependency_fulfilled = true
+    local dependency_indexes_update_list = {}
+    local secondary_indexes_update_list = {}
+    local field_keys_values = {}
+    local field_keys_by_name = {}
+    local links = {}
+    local kept_index_keys = {}
+
+    for field_iter = 1, field_count do
+        local field_key = KEYS[keys_idx]
+        local field_name = ARGV[argv_idx]
+        local hash_field = ARGV[argv_idx + 1]
+        local field_value = ARGV[argv_idx + 2]
+        table.insert(field_keys_values, {field_key, hash_field, field_value})
+        field_keys_by_name[field_name] = field_key
+
+        local dependency_count = tonumber(ARGV[argv_idx + 3])
+        local index_count = tonumber(ARGV[argv_idx + 4])
+        argv_idx = argv_idx + 5
+
+        -- every dependency has index key followed by companion key holding dependent value
+        for dependency_iter = 1, dependency_count do
+            local dependency_key = KEYS[keys_idx + 2 * dependency_iter - 1]
+            local dependency_value_key = KEYS[keys_idx + 2 * dependency_iter]
+
+            -- keep consuming keys of broken record, so the next record starts at the right index
+            if dependency_fulfilled then
+                local dependent_value = redis.call("GET", dependency_value_key)
+                if dependent_value then
+                    if field_value ~= dependent_value then
+                        dependency_fulfilled = false
+                    end
+                else
+                    -- fallback for dependency indexes created before companion keys
+                    local random_dependency_member = redis.call("SRANDMEMBER", dependency_key)
+                    if random_dependency_member then
+                        if field_value ~= get_field(random_dependency_member, hash_field) then
+                            dependency_fulfilled = false
+                        end
+                    end
+                end
+            end
+
+            table.insert(dependency_indexes_update_list, {dependency_key, field_key, dependency_value_key, field_value})
+            kept_index_keys[dependency_key] = true
+            table.insert(links, dependency_key)
+            table.insert(links, field_name)
+            table.insert(links, dependency_value_key)
+        end
+
+        for index_iter = 1, index_count do
+            local index_key = KEYS[keys_idx + 2 * dependency_count + index_iter]
+            table.insert(secondary_indexes_update_list, index_key)
+            kept_index_keys[index_key] = true
+            table.insert(links, index_key)
+            table.insert(links, "")
+            table.insert(links, "")
+        end
+
+        keys_idx = keys_idx + 2 * dependency_count + index_count + 1
+    end
+
+    -- records are written one by one, so following records in the batch are checked against this one
+    if dependency_fulfilled then
+        -- memberships of previously inserted version are removed, so links always describe all memberships of the record
+        local old_links = redis.call("LRANGE", links_key, 0, -1)
+        for i = 1, #old_links, 3 do
+            local index_key = old_links[i]
+            if not kept_index_keys[index_key] then
+                -- dependency indexes hold field keys, secondary indexes hold record identifiers
+                local member = key_identifier
+                if old_links[i + 1] ~= "" then
+                    member = field_keys_by_name[old_links[i + 1]]
+                end
+                redis.call("SREM", index_key, member)
+                if old_links[i + 2] ~= "" and redis.call("SCARD", index_key) == 0 then
+                    redis.call("DEL", old_links[i + 2])
+                end
+            end
+        end
+
+        for i = 1, #dependency_indexes_update_list do
+            redis.call("SADD", dependency_indexes_update_list[i][1], dependency_indexes_update_list[i][2])
+            redis.call("SET", dependency_indexes_update_list[i][3], dependency_indexes_update_list[i][4])
+        end
+
+        redis.call("SADD", table_key, key_identifier)
+        redis.call("INCR", table_version_key)
+
+        for i = 1, #secondary_indexes_update_list do
+            redis.call("SADD", secondary_indexes_update_list[i], key_identifier)
+        end
+
+        for i = 1, #field_keys_values do
+            set_field(field_keys_values[i][1], field_keys_values[i][2], field_keys_values[i][3])
+        end
+
+        redis.call("DEL", links_key)
+        if #links > 0 then
+            redis.call("RPUSH", links_key, unpack(links))
+        end
+
+        table.insert(results, 1)
+    else
+        table.insert(results, 0)
+    end
+end
+
+return results
+"""
+
+INSERT_SCRIPTS = {
+    "insert_records": LUA_INSERT_RECORDS
+}
+
+
+def get_insert_script_arguments(metadata_store: MetadataStore, record: TableRecord,
+                                keys: list[str], args: list) -> None:
     table = metadata_store.get_table_by_name(record.table_descriptor)
     table_key = table.get_table_key()
     key_identifier = record.get_primary_key_identifier(metadata_store)
-    keys.append(table_key)
-    args.append(key_identifier)
-
-    table = metadata_store.get_table_by_name(record.table_descriptor)
 
     all_fields = table.get_all_fields()
 
+    keys.append(table_key)
+    keys.append(table.get_version_key())
+    keys.append(table.get_links_key(key_identifier))
+    args.append(key_identifier)
+    args.append(len(all_fields))
+
     for field_descriptor in all_fields:
         field_value = record.get_value(field_descriptor)
-        field_key = record.get_field_key(metadata_store, field_descriptor)
+        field_key, hash_field = record.get_field_location(metadata_store, field_descriptor, key_identifier)
 
+        args.append(field_descriptor.name)
+        args.append(hash_field)
         args.append(field_value)
         keys.append(field_key)
 
         dependencies = table.functional_dependencies.get(field_descriptor, [])
+        index_keys = table.get_index_keys(field_descriptor, field_value)
 
         args.append(len(dependencies))
+        args.append(len(index_keys))
 
         for dependency in dependencies:
-            dependency_key = dependency.get_key(metadata_store, record)
-            keys.append(dependency_key)
+            keys.extend(dependency.get_keys(metadata_store, record))
+
+        keys.extend(index_keys)
+
+
+def insert_many_using_lua_script(conn: Redis, scripts: ScriptRegistry, metadata_store: MetadataStore,
+                                 records: list[TableRecord]) -> list[DependencyBrokenException | None]:
+    keys = []
+    args = []
+
+    for record in records:
+        get_insert_script_arguments(metadata_store, record, keys, args)
+
+    res = scripts.call("insert_records", keys, args)
+
+    return [None if inserted == 1 else DependencyBrokenException() for inserted in res]
+
+
+def insert_using_lua_script(conn: Redis, scripts: ScriptRegistry, metadata_store: MetadataStore,
+                            record: TableRecord) -> None:
+    result, = insert_many_using_lua_script(conn, scripts, metadata_store, [record])
+
+    if result is not None:
+        raise result
 
-    lua_check_and_set = """
-    local argv_idx = 2
-    local keys_idx = 2
-    
-    local dependency_indexes_update_list = {}
-    local field_keys_values = {}
-    
-    while keys_idx <= #KEYS do
-        local field_key = KEYS[keys_idx]
-        local field_value = ARGV[argv_idx]
-        table.insert(field_keys_values, {field_key, field_value})
-        
-        local dependency_count = ARGV[argv_idx + 1]
-        argv_idx = argv_idx + 2
-        
-        for dependency_iter = 1, dependency_count do
-            local dependency_key = KEYS[keys_idx + dependency_iter]
-        
-            local random_dependency_member = redis.call("SRANDMEMBER", dependency_key)
-            if random_dependency_member then
-                if field_value ~= redis.call("GET", random_dependency_member) then
-                    return nil
-                end
-            end
-            
-            table.insert(dependency_indexes_update_list, {dependency_key, field_key})
-        end
-        keys_idx = keys_idx + dependency_count + 1
-    end
-    
-    
-    for i = 1, #dependency_indexes_update_list do
-        redis.call("SADD", dependency_indexes_update_list[i][1], dependency_indexes_update_list[i][2])
-    end
-    
-    local table_key = KEYS[1]
-    local key_identifier = ARGV[1]
-    redis.call("SADD", table_key, key_identifier)
-    
-    for i = 1, #field_keys_values do
-        redis.call("SET", field_keys_values[i][1], field_keys_values[i][2])
-    end
-    
-    return "OK"
-    """
 
-    check_set_script = conn.register_script(lua_check_and_set)
+def insert_many_one_by_one(insert_function, conn: Redis, scripts: ScriptRegistry,
+                           metadata_store: MetadataStore, records: list[TableRecord]) -> list[DependencyBrokenException | None]:
+    results = []
 
-    res = check_set_script(keys=keys, args=args)
+    for record in records:
+        try:
+            insert_function(conn, scripts, metadata_store, record)
+            results.append(None)
+        except DependencyBrokenException as exception:
+            results.append(exception)
 
-    if res != "OK":
-        raise DependencyBrokenException()
+    return results
@@ -0,0 +1,200 @@
+from functools import partial
+
+from redis import Redis
+
+from hash_db.config import JoiningAlgorithm
+from hash_db.models import TableDescriptor, JoinStatement, Selector, MetadataStore, SelectorCondition, \
+    SelectorConditionEquals, SelectorConditionIn, SelectorConditionNot, PlanOperation, PlanStep, QueryPlan, \
+    TableDefinition, FieldDescriptor
+
+# selectivity of equality condition on field without index, when no better statistics are available
+DEFAULT_EQUALS_SELECTIVITY = 0.1
+# nested loops are used instead of hash join for joins comparing at most this many pairs of rows
+NESTED_LOOPS_MAX_COMPARISONS = 1000
+
+
+def get_planner(joining_algorithm: JoiningAlgorithm):
+    # planners receive statistics fetched with get_statistics, see needs_statistics
+    return {
+        JoiningAlgorithm.NESTED_LOOPS: partial(plan_in_given_order, join_operation=PlanOperation.NESTED_LOOPS_JOIN),
+        JoiningAlgorithm.HASH_JOIN: partial(plan_in_given_order, join_operation=PlanOperation.HASH_JOIN),
+        JoiningAlgorithm.COST_BASED: plan_cost_based
+    }[joining_algorithm]
+
+
+def needs_statistics(joining_algorithm: JoiningAlgorithm) -> bool:
+    return joining_algorithm == JoiningAlgorithm.COST_BASED
+
+
+def check_if_primary_key_joinable(metadata_store: MetadataStore, join_statement: JoinStatement):
+    target_table = metadata_store.get_table_by_name(join_statement.target_table)
+    target_primary_key_fields = target_table.get_primary_key_fields()
+
+    if len(join_statement.target_fields) != len(target_primary_key_fields):
+        return False
+
+    for field in join_statement.target_fields:
+        if field not in target_primary_key_fields:
+            return False
+
+    return True
+
+
+def get_statistics_keys(metadata_store: MetadataStore, selector: Selector) -> list[str]:
+    table_descriptors = [selector.from_table] + [statement.target_table for statement in selector.join_statements]
+    keys = []
+
+    for table_descriptor in table_descriptors:
+        table = metadata_store.get_table_by_name(table_descriptor)
+        keys.append(table.get_table_key())
+
+        for field, conditions in selector.parsed_conditions.get(table_descriptor, dict()).items():
+            for condition in conditions:
+                while isinstance(condition, SelectorConditionNot):
+                    condition = condition.condition
+
+                if isinstance(condition, SelectorConditionEquals) and field in table.indexes \
+                        and condition.condition_data is not None:
+                    keys.append(table.get_index_key(field, condition.condition_data))
+
+    return keys
+
+
+# Row counts of tables and secondary indexes are read from their sets, statistics are fetched up front,
+# so planning itself does not talk to redis and is shared by sync and async cores
+# https://redis.io/docs/latest/commands/scard/
+def get_statistics(conn: Redis, metadata_store: MetadataStore, selector: Selector) -> dict[str, int]:
+    keys = get_statistics_keys(metadata_store, selector)
+
+    with conn.pipeline(transaction=False) as pipeline:
+        for key in keys:
+            pipeline.scard(key)
+
+        return dict(zip(keys, pipeline.execute()))
+
+
+def get_table_size(statistics: dict[str, int], metadata_store: MetadataStore,
+                   table_descriptor: TableDescriptor) -> int:
+    return statistics[metadata_store.get_table_by_name(table_descriptor).get_table_key()]
+
+
+def estimate_condition_selectivity(statistics: dict[str, int], table: TableDefinition, table_size: int,
+                                   field: FieldDescriptor, condition: SelectorCondition) -> float:
+    if isinstance(condition, SelectorConditionNot):
+        return 1 - estimate_condition_selectivity(statistics, table, table_size, field, condition.condition)
+
+    if isinstance(condition, SelectorConditionEquals):
+        if field in table.indexes and condition.condition_data is not None and table_size > 0:
+            return statistics[table.get_index_key(field, condition.condition_data)] / table_size
+        return DEFAULT_EQUALS_SELECTIVITY
+
+    if isinstance(condition, SelectorConditionIn):
+        return min(1.0, len(condition.condition_data) * DEFAULT_EQUALS_SELECTIVITY)
+
+    return 1.0
+
+
+def estimate_table_rows(statistics: dict[str, int], metadata_store: MetadataStore, selector: Selector,
+                        table_descriptor: TableDescriptor) -> float:
+    table = metadata_store.get_table_by_name(table_descriptor)
+    table_size = get_table_size(statistics, metadata_store, table_descriptor)
+
+    estimated_rows = float(table_size)
+    for field, conditions in selector.parsed_conditions.get(table_descriptor, dict()).items():
+        for condition in conditions:
+            estimated_rows *= estimate_condition_selectivity(statistics, table, table_size, field, condition)
+
+    return estimated_rows
+
+
+def estimate_join_rows(join_statement: JoinStatement, operation: PlanOperation, accumulator_rows: float,
+                       target_rows: float, target_size: int) -> float:
+    if operation == PlanOperation.PRIMARY_KEY_JOIN:
+        # every accumulator row matches at most one target row, which passes target conditions
+        return accumulator_rows * (target_rows / target_size if target_size > 0 else 0)
+
+    if not join_statement.base_fields:
+        return accumulator_rows * target_rows
+
+    return accumulator_rows * target_rows / max(accumulator_rows, target_rows, 1)
+
+
+def choose_join_operation(metadata_store: MetadataStore, join_statement: JoinStatement, accumulator_rows: float,
+                          target_rows: float, target_size: int) -> PlanOperation:
+    # looking up every accumulator row by primary key pays off, while there are fewer lookups than target rows
+    if check_if_primary_key_joinable(metadata_store, join_statement) and accumulator_rows <= target_size:
+        return PlanOperation.PRIMARY_KEY_JOIN
+
+    if not join_statement.base_fields or accumulator_rows * target_rows <= NESTED_LOOPS_MAX_COMPARISONS:
+        return PlanOperation.NESTED_LOOPS_JOIN
+
+    return PlanOperation.HASH_JOIN
+
+
+def plan_in_given_order(statistics: dict[str, int], metadata_store: MetadataStore, selector: Selector,
+                        join_operation: PlanOperation) -> QueryPlan:
+    steps = [PlanStep(PlanOperation.SCAN, selector.from_table)]
+
+    for join_statement in selector.join_statements:
+        if check_if_primary_key_joinable(metadata_store, join_statement):
+            operation = PlanOperation.PRIMARY_KEY_JOIN
+        else:
+            operation = join_operation
+
+        steps.append(PlanStep(operation, join_statement.target_table, join_statement))
+
+    return QueryPlan(steps)
+
+
+def plan_cost_based(statistics: dict[str, int], metadata_store: MetadataStore, selector: Selector) -> QueryPlan:
+    table_descriptors = [selector.from_table] + [statement.target_table for statement in selector.join_statements]
+    table_rows = {table_descriptor: estimate_table_rows(statistics, metadata_store, selector, table_descriptor)
+                  for table_descriptor in table_descriptors}
+
+    accumulator_rows = table_rows[selector.from_table]
+    steps = [PlanStep(PlanOperation.SCAN, selector.from_table, estimated_rows=accumulator_rows)]
+
+    joined_tables = {selector.from_table}
+    remaining_statements = list(selector.join_statements)
+
+    while remaining_statements:
+        # only joins whose base tables are already joined can be executed next
+        candidates = [statement for statement in remaining_statements
+                      if all(base_table in joined_tables for base_table, _ in statement.base_fields)]
+        if not candidates:
+            candidates = remaining_statements[:1]
+
+        # greedily pick join producing the fewest rows, so following joins work on smaller inputs
+        best_step = None
+        for statement in candidates:
+            target_rows = table_rows[statement.target_table]
+            target_size = get_table_size(statistics, metadata_store, statement.target_table)
+
+            operation = choose_join_operation(metadata_store, statement, accumulator_rows, target_rows, target_size)
+            estimated_rows = estimate_join_rows(statement, operation, accumulator_rows, target_rows, target_size)
+
+            if best_step is None or estimated_rows < best_step.estimated_rows:
+                best_step = PlanStep(operation, statement.target_table, statement, estimated_rows)
+
+        steps.append(best_step)
+        accumulator_rows = best_step.estimated_rows
+        joined_tables.add(best_step.table_descriptor)
+        remaining_statements.remove(best_step.join_statement)
+
+    return QueryPlan(steps)
+
+
+def estimate_plan_rows(statistics: dict[str, int], metadata_store: MetadataStore, selector: Selector,
+                       plan: QueryPlan) -> None:
+    accumulator_rows = 0.0
+    for step in plan.steps:
+        target_size = get_table_size(statistics, metadata_store, step.table_descriptor)
+        target_rows = estimate_table_rows(statistics, metadata_store, selector, step.table_descriptor)
+
+        if step.operation == PlanOperation.SCAN:
+            accumulator_rows = target_rows
+        else:
+            accumulator_rows = estimate_join_rows(step.join_statement, step.operation, accumulator_rows,
+                                                  target_rows, target_size)
+
+        step.estimated_rows = accumulator_rows
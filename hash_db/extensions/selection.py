@@ -1,130 +1,391 @@
-from typing import Iterable
+from collections import defaultdict
+from functools import partial
+from itertools import chain, islice
+from typing import Iterable, Iterator
 
 from redis import Redis
 
-from hash_db.tools.tools import get_key_generator
-from hash_db.config import JoiningAlgorithm
-from hash_db.tools.selection_tools import TableIterator
+from hash_db.tools.tools import get_key_generator, chunked, parallel_map
+from hash_db.tools.selection_tools import TableIterator, spill_to_partitions, read_partition
+from hash_db.tools.storage import fetch_field_values, check_table_membership
+from hash_db.tools.batches import ColumnBatch
+from hash_db.extensions.planner import get_planner, get_statistics, needs_statistics
 from hash_db.models import FieldValue, FieldDescriptor, TableDescriptor, ResultRow, JoinStatement, Selector, \
-    MetadataStore
+    MetadataStore, SelectorCondition, SelectorConditionEquals, SelectorConditionIn, TableRecord, PlanOperation, \
+    PlanStep, QueryPlan
 
 
-def get_select_function(joining_algorithm: JoiningAlgorithm):
-    return {
-        JoiningAlgorithm.NESTED_LOOPS: nested_loops_select
-    }[joining_algorithm]
+def build_table_values(fields: list[FieldDescriptor], record_values: list[str | None],
+                       table_conditions: dict[FieldDescriptor, list[SelectorCondition]]) -> dict | None:
+    # returns None if any condition is not fulfilled
+    values: dict[FieldDescriptor, FieldValue | None] = dict()
 
+    for field, value in zip(fields, record_values):
+        if value is None:
+            field_value = None
+        else:
+            field_value = FieldValue(value)
 
-def check_if_primary_key_joinable(metadata_store: MetadataStore, join_statement: JoinStatement):
-    target_table = metadata_store.get_table_by_name(join_statement.target_table)
-    target_primary_key_fields = target_table.get_primary_key_fields()
+        for condition in table_conditions.get(field, []):
+            if not condition.compare(field_value):
+                return None
 
-    if len(join_statement.target_fields) != len(target_primary_key_fields):
-        return False
+        values[field] = field_value
 
-    for field in join_statement.target_fields:
-        if field not in target_primary_key_fields:
-            return False
+    return values
 
-    return True
 
+def build_result_rows(table_descriptor: TableDescriptor, fields: list[FieldDescriptor],
+                      records_values: list[list[str | None]],
+                      table_conditions: dict[FieldDescriptor, list[SelectorCondition]]) -> Iterator[ResultRow]:
+    for record_values in records_values:
+        values = build_table_values(fields, record_values, table_conditions)
 
-def primary_key_join(conn: Redis, accumulator: Iterable[ResultRow], metadata_store: MetadataStore,
-                     join_statement: JoinStatement, select_fields: set[FieldDescriptor]):
-    joined_records = []
+        if values is not None:
+            yield ResultRow({table_descriptor.get_alias(): values})
+
+
+def get_joined_key_identifier(accumulator_record: ResultRow, join_statement: JoinStatement, key_generator) -> str:
+    primary_key_values: dict[FieldDescriptor, FieldValue] = dict()
+    for (base_table, base_field), target_field in zip(join_statement.base_fields, join_statement.target_fields):
+        primary_key_values[target_field] = accumulator_record.values[base_table.get_alias()][base_field]
 
+    return key_generator(primary_key_values)
+
+
+def build_joined_rows(join_statement: JoinStatement, accumulator_records: list[ResultRow],
+                      fields: list[FieldDescriptor], records_values: list[list[str | None]],
+                      table_conditions: dict[FieldDescriptor, list[SelectorCondition]]) -> Iterator[ResultRow]:
+    for accumulator_record, record_values in zip(accumulator_records, records_values):
+        values = build_table_values(fields, record_values, table_conditions)
+
+        if values is not None:
+            yield ResultRow(values={**accumulator_record.values, join_statement.target_table.get_alias(): values})
+
+
+# Checking existence of whole batch of joined records with single SMISMEMBER
+# https://redis.io/docs/latest/commands/smismember/
+def primary_key_join(conn: Redis, accumulator: Iterable[ResultRow], metadata_store: MetadataStore,
+                     join_statement: JoinStatement, selector: Selector) -> Iterator[ResultRow]:
     target_table = metadata_store.get_table_by_name(join_statement.target_table)
+    fields = list(selector.all_needed_fields[join_statement.target_table])
+    # conditions of target table are checked on fetched rows, before they are joined
+    table_conditions = selector.parsed_conditions.get(join_statement.target_table, dict())
+    key_generator = get_key_generator(metadata_store.config.key_policy)
 
-    for accumulator_record in accumulator:
-        primary_key_values: dict[FieldDescriptor, FieldValue] = dict()
-        for (base_table, base_field), target_field in zip(join_statement.base_fields, join_statement.target_fields):
-            primary_key_values[target_field] = accumulator_record.values[base_table.get_alias()][base_field]
+    for accumulator_batch in chunked(accumulator, metadata_store.config.join_batch_size):
+        key_identifiers = [get_joined_key_identifier(accumulator_record, join_statement, key_generator)
+                           for accumulator_record in accumulator_batch]
+
+        memberships = check_table_membership(conn, target_table, key_identifiers)
+        matching_records = [(accumulator_record, key_identifier)
+                            for accumulator_record, key_identifier, is_member
+                            in zip(accumulator_batch, key_identifiers, memberships) if is_member]
+
+        records_values = fetch_field_values(conn, metadata_store, target_table,
+                                            [key_identifier for _, key_identifier in matching_records], fields)
+
+        yield from build_joined_rows(join_statement, [accumulator_record for accumulator_record, _ in matching_records],
+                                     fields, records_values, table_conditions)
+
+
+def get_dependency_index_keys(metadata_store: MetadataStore, selector: Selector,
+                              table_descriptor: TableDescriptor) -> list[tuple[str, str]]:
+    # returns pairs of dependency index key and prefix of its members belonging to the table
+    table = metadata_store.get_table_by_name(table_descriptor)
+
+    equals_values: dict[FieldDescriptor, FieldValue] = dict()
+    for field, conditions in selector.parsed_conditions.get(table_descriptor, dict()).items():
+        for condition in conditions:
+            if isinstance(condition, SelectorConditionEquals) and condition.condition_data is not None:
+                equals_values[field] = FieldValue(condition.condition_data)
+                break
+
+    dependency_index_keys = []
+    used_determinants: set[frozenset[FieldDescriptor]] = set()
+
+    for dependencies in table.functional_dependencies.values():
+        for dependency in dependencies:
+            determinants = frozenset(dependency.determinants)
 
-        key_identifier = get_key_generator(metadata_store.config.key_policy)(primary_key_values)
+            # dependencies with the same determinants have index sets holding the same records
+            if determinants in used_determinants or not all(field in equals_values for field in determinants):
+                continue
+            used_determinants.add(determinants)
 
-        if not conn.sismember(target_table.get_table_key(), key_identifier):
+            dependency_key = dependency.get_key(metadata_store, TableRecord(table_descriptor, equals_values))
+
+            # dependency indexes are shared between tables, so only members of this table are taken
+            member_prefix = table.get_key_prefix(metadata_store.config.storage_layout, dependency.dependent) + ":"
+            dependency_index_keys.append((dependency_key, member_prefix))
+
+    return dependency_index_keys
+
+
+def get_dependency_index_key_identifiers(members: Iterable[str], member_prefix: str) -> set[str]:
+    return {member[len(member_prefix):] for member in members if member.startswith(member_prefix)}
+
+
+def get_secondary_index_keys(metadata_store: MetadataStore, selector: Selector,
+                             table_descriptor: TableDescriptor) -> tuple[list[str], list[list[str]]]:
+    # returns index keys of equality conditions, which are intersected,
+    # and index keys of every IN condition, which are joined in union first
+    table = metadata_store.get_table_by_name(table_descriptor)
+
+    equals_index_keys: list[str] = []
+    in_index_keys: list[list[str]] = []
+
+    for field, conditions in selector.parsed_conditions.get(table_descriptor, dict()).items():
+        if field not in table.indexes:
             continue
 
-        values: dict[FieldDescriptor, FieldValue] = {}
-        for field in select_fields:
-            key_prefix = target_table.get_field_key_prefix(field)
-            key = f"{key_prefix}:{key_identifier}"
+        for condition in conditions:
+            if isinstance(condition, SelectorConditionEquals) and condition.condition_data is not None:
+                equals_index_keys.append(table.get_index_key(field, condition.condition_data))
+            elif isinstance(condition, SelectorConditionIn) and None not in condition.condition_data:
+                in_index_keys.append([table.get_index_key(field, value) for value in condition.condition_data])
 
-            values[field] = FieldValue(conn.get(key))
+    return equals_index_keys, in_index_keys
 
-        joined_records.append(
-            ResultRow(values={**accumulator_record.values, join_statement.target_table.get_alias(): values}))
 
-    return joined_records
+# Looking up records matching equality conditions in secondary indexes and functional dependency indexes,
+# instead of scanning whole table
+# https://redis.io/docs/latest/commands/sinter/
+def get_indexed_key_identifiers(conn: Redis, metadata_store: MetadataStore, selector: Selector,
+                                table_descriptor: TableDescriptor) -> set[str] | None:
+    equals_index_keys, in_index_keys = get_secondary_index_keys(metadata_store, selector, table_descriptor)
+    dependency_index_keys = get_dependency_index_keys(metadata_store, selector, table_descriptor)
 
+    if not equals_index_keys and not in_index_keys and not dependency_index_keys:
+        return None
 
-def single_table_select(conn: Redis, metadata_store: MetadataStore, selector: Selector,
-                        table_descriptor: TableDescriptor) -> Iterable[ResultRow]:
+    key_identifiers_sets = []
+    if equals_index_keys:
+        key_identifiers_sets.append(conn.sinter(equals_index_keys))
+
+    for dependency_key, member_prefix in dependency_index_keys:
+        key_identifiers_sets.append(get_dependency_index_key_identifiers(conn.smembers(dependency_key),
+                                                                         member_prefix))
+
+    for index_keys in in_index_keys:
+        key_identifiers_sets.append(conn.sunion(index_keys) if index_keys else set())
+
+    return set.intersection(*key_identifiers_sets)
+
+
+def fetch_table_chunks(conn: Redis, metadata_store: MetadataStore, selector: Selector,
+                       table_descriptor: TableDescriptor,
+                       fields: list[FieldDescriptor]) -> Iterator[list[list[str | None]]]:
     table = metadata_store.get_table_by_name(table_descriptor)
 
-    table_conditions = selector.parsed_conditions.get(table_descriptor, dict())
+    indexed_key_identifiers = get_indexed_key_identifiers(conn, metadata_store, selector, table_descriptor)
+    if indexed_key_identifiers is None:
+        key_identifiers_chunks = TableIterator(conn, metadata_store, table_descriptor).chunks()
+    else:
+        key_identifiers_chunks = chunked(indexed_key_identifiers, metadata_store.config.scan_chunk_size)
 
-    for key_identifier in TableIterator(conn, metadata_store, table_descriptor):
-        values = {table_descriptor.get_alias(): dict()}
+    # Cursor of SCAN or SSCAN cannot be split, so identifiers are still listed by one cursor, while their
+    # field values, which are most of transferred data, are fetched by scan_workers threads at once
+    def fetch_chunk(key_identifiers: list[str]) -> list[list[str | None]]:
+        return fetch_field_values(conn, metadata_store, table, key_identifiers, fields)
 
-        condition_failed = False
-        for field in selector.all_needed_fields[table_descriptor]:
-            key_prefix = table.get_field_key_prefix(field)
-            field_key = f"{key_prefix}:{key_identifier}"
+    yield from parallel_map(fetch_chunk, key_identifiers_chunks, metadata_store.config.scan_workers)
 
-            value: str = conn.get(field_key)
 
-            if value is None:
-                field_value = None
-            else:
-                field_value = FieldValue(value)
+def single_table_select(conn: Redis, metadata_store: MetadataStore, selector: Selector,
+                        table_descriptor: TableDescriptor) -> Iterable[ResultRow]:
+    table_conditions = selector.parsed_conditions.get(table_descriptor, dict())
+    fields = list(selector.all_needed_fields[table_descriptor])
 
-            if field in table_conditions:
-                for condition in table_conditions[field]:
-                    if not condition.compare(field_value):
-                        condition_failed = True
-                        break
+    # records are fetched in chunks, but still yielded one by one
+    for records_values in fetch_table_chunks(conn, metadata_store, selector, table_descriptor, fields):
+        yield from build_result_rows(table_descriptor, fields, records_values, table_conditions)
 
-            if condition_failed:
-                break
 
-            values[table_descriptor.get_alias()][field] = field_value
+def join_with_target_records(accumulator_record: ResultRow, target_records: list[ResultRow],
+                             join_statement: JoinStatement) -> Iterator[ResultRow]:
+    for target_record in target_records:
+        check = True
+
+        for (base_table, base_field), target_field in zip(join_statement.base_fields,
+                                                          join_statement.target_fields):
+            if accumulator_record.values[base_table.get_alias()][base_field] != \
+                    target_record.values[join_statement.target_table.get_alias()][target_field]:
+                check = False
+                break
 
-        if not condition_failed:
-            yield ResultRow(values)
+        if check:
+            yield ResultRow(values={**accumulator_record.values, **target_record.values})
 
 
 def nested_loops_join(accumulator: Iterable[ResultRow], target_records: Iterable[ResultRow],
-                      join_statement: JoinStatement):
-    joined_records = []
+                      join_statement: JoinStatement) -> Iterator[ResultRow]:
+    # target records are compared with every accumulator row, so only they are kept in memory
+    target_records = list(target_records)
 
     for accumulator_record in accumulator:
-        for target_record in target_records:
-            check = True
+        yield from join_with_target_records(accumulator_record, target_records, join_statement)
+
+
+def get_join_fields(join_statement: JoinStatement) -> tuple[list[tuple[str, FieldDescriptor]],
+                                                            list[tuple[str, FieldDescriptor]]]:
+    base_fields = [(base_table.get_alias(), base_field) for base_table, base_field in join_statement.base_fields]
+    target_fields = [(join_statement.target_table.get_alias(), target_field)
+                     for target_field in join_statement.target_fields]
+
+    return base_fields, target_fields
+
+
+def get_join_key(record: ResultRow, fields: list[tuple[str, FieldDescriptor]]) -> tuple:
+    return tuple(record.values[alias][field] for alias, field in fields)
+
+
+def build_hash_table(build_records: Iterable[ResultRow],
+                     build_fields: list[tuple[str, FieldDescriptor]]) -> dict[tuple, list[ResultRow]]:
+    hash_table: dict[tuple, list[ResultRow]] = defaultdict(list)
+    for build_record in build_records:
+        hash_table[get_join_key(build_record, build_fields)].append(build_record)
+
+    return hash_table
+
+
+def probe_hash_table(hash_table: dict[tuple, list[ResultRow]], probe_record: ResultRow,
+                     probe_fields: list[tuple[str, FieldDescriptor]], build_is_accumulator: bool) -> Iterator[ResultRow]:
+    for build_record in hash_table.get(get_join_key(probe_record, probe_fields), []):
+        if build_is_accumulator:
+            yield ResultRow(values={**build_record.values, **probe_record.values})
+        else:
+            yield ResultRow(values={**probe_record.values, **build_record.values})
+
+
+def hash_join_in_memory(build_records: Iterable[ResultRow], build_fields: list[tuple[str, FieldDescriptor]],
+                        probe_records: Iterable[ResultRow], probe_fields: list[tuple[str, FieldDescriptor]],
+                        build_is_accumulator: bool) -> Iterator[ResultRow]:
+    hash_table = build_hash_table(build_records, build_fields)
+
+    for probe_record in probe_records:
+        yield from probe_hash_table(hash_table, probe_record, probe_fields, build_is_accumulator)
+
+
+def hash_join(accumulator: Iterable[ResultRow], target_records: Iterable[ResultRow], join_statement: JoinStatement,
+              metadata_store: MetadataStore) -> Iterator[ResultRow]:
+    base_fields, target_fields = get_join_fields(join_statement)
+
+    config = metadata_store.config
+
+    # at most memory budget + 1 rows of every input are read, to find out which of them fits in memory budget
+    target_records = iter(target_records)
+    target_head = list(islice(target_records, config.hash_join_memory_budget + 1))
+    target_fits = len(target_head) <= config.hash_join_memory_budget
+
+    accumulator = iter(accumulator)
+    accumulator_head = list(islice(accumulator, config.hash_join_memory_budget + 1))
+    accumulator_fits = len(accumulator_head) <= config.hash_join_memory_budget
+
+    # hash table is built on the smaller input, the other one is streamed as probe side
+    if accumulator_fits and (not target_fits or len(accumulator_head) < len(target_head)):
+        yield from hash_join_in_memory(accumulator_head, base_fields, chain(target_head, target_records),
+                                       target_fields, True)
+        return
+
+    if target_fits:
+        yield from hash_join_in_memory(target_head, target_fields, chain(accumulator_head, accumulator), base_fields,
+                                       False)
+        return
+
+    # neither input fits in memory budget, both inputs are partitioned by join key to disk,
+    # so matching rows end up in partitions with the same index and can be joined partition by partition
+    accumulator = chain(accumulator_head, accumulator)
+    target_records = chain(target_head, target_records)
+    build_partitions = spill_to_partitions(target_records, partial(get_join_key, fields=target_fields),
+                                           config.hash_join_spill_partitions)
+    probe_partitions = spill_to_partitions(accumulator, partial(get_join_key, fields=base_fields),
+                                           config.hash_join_spill_partitions)
 
-            for (base_table, base_field), target_field in zip(join_statement.base_fields,
-                                                              join_statement.target_fields):
-                if accumulator_record.values[base_table.get_alias()][base_field] != \
-                        target_record.values[join_statement.target_table.get_alias()][target_field]:
-                    check = False
-                    break
+    for build_partition, probe_partition in zip(build_partitions, probe_partitions):
+        yield from hash_join_in_memory(read_partition(build_partition), target_fields,
+                                       read_partition(probe_partition), base_fields, False)
 
-            if check:
-                joined_records.append(ResultRow(values={**accumulator_record.values, **target_record.values}))
 
-    return joined_records
+def count_rows(step: PlanStep, records: Iterable[ResultRow]) -> Iterator[ResultRow]:
+    step.actual_rows = 0
 
+    for record in records:
+        step.actual_rows += 1
+        yield record
 
-def nested_loops_select(conn: Redis, metadata_store: MetadataStore, selector: Selector) -> Iterable[ResultRow]:
-    result = list(
-        single_table_select(conn, metadata_store, selector, selector.from_table))
-    for join_statement in selector.join_statements:
-        if check_if_primary_key_joinable(metadata_store, join_statement):
-            result = primary_key_join(conn, result, metadata_store, join_statement,
-                                      selector.all_needed_fields[join_statement.target_table])
+
+# Every operator is a generator, so rows flow through scan, filter and joins one by one
+# and consumer can stop at any moment without building whole intermediate results
+def execute_plan(conn: Redis, metadata_store: MetadataStore, selector: Selector,
+                 plan: QueryPlan) -> Iterator[ResultRow]:
+    base_step, *join_steps = plan.steps
+
+    result = count_rows(base_step, single_table_select(conn, metadata_store, selector, base_step.table_descriptor))
+
+    for step in join_steps:
+        if step.operation == PlanOperation.PRIMARY_KEY_JOIN:
+            result = primary_key_join(conn, result, metadata_store, step.join_statement, selector)
         else:
-            target_table = list(
-                single_table_select(conn, metadata_store, selector, join_statement.target_table))
-            result = nested_loops_join(result, target_table, join_statement)
+            target_records = single_table_select(conn, metadata_store, selector, step.table_descriptor)
+
+            if step.operation == PlanOperation.HASH_JOIN:
+                result = hash_join(result, target_records, step.join_statement, metadata_store)
+            else:
+                result = nested_loops_join(result, target_records, step.join_statement)
+
+        result = count_rows(step, result)
 
     return result
+
+
+def planned_select(conn: Redis, metadata_store: MetadataStore, selector: Selector) -> Iterator[ResultRow]:
+    # joining algorithm decides whether joins are executed in given order or reordered using statistics
+    joining_algorithm = metadata_store.config.joining_algorithm
+    statistics = get_statistics(conn, metadata_store, selector) if needs_statistics(joining_algorithm) else dict()
+    plan = get_planner(joining_algorithm)(statistics, metadata_store, selector)
+
+    return execute_plan(conn, metadata_store, selector, plan)
+
+
+def record_values_match(fields: list[FieldDescriptor], record_values: list[str | None],
+                        table_conditions: dict[FieldDescriptor, list[SelectorCondition]]) -> bool:
+    for field, value in zip(fields, record_values):
+        conditions = table_conditions.get(field)
+
+        if conditions:
+            field_value = None if value is None else FieldValue(value)
+
+            if not all(condition.compare(field_value) for condition in conditions):
+                return False
+
+    return True
+
+
+# Values of selected columns of every matching row, taken straight from fetched chunks when no join is needed
+def select_row_values(conn: Redis, metadata_store: MetadataStore,
+                      selector: Selector) -> Iterator[tuple[str | None, ...]]:
+    if selector.join_statements:
+        for result_row in planned_select(conn, metadata_store, selector):
+            yield tuple(None if (field_value := result_row.values[alias][field]) is None else field_value.value
+                        for alias, field in selector.result_schema.columns)
+        return
+
+    table_descriptor = selector.from_table
+    table_conditions = selector.parsed_conditions.get(table_descriptor, dict())
+    fields = list(selector.all_needed_fields[table_descriptor])
+    field_indexes = [fields.index(field) for _, field in selector.result_schema.columns]
+
+    for records_values in fetch_table_chunks(conn, metadata_store, selector, table_descriptor, fields):
+        for record_values in records_values:
+            if record_values_match(fields, record_values, table_conditions):
+                yield tuple(record_values[index] for index in field_indexes)
+
+
+# Rows are transposed into columns batch by batch, so no ResultRow is built for select without joins
+def select_batches(conn: Redis, metadata_store: MetadataStore, selector: Selector,
+                   batch_size: int) -> Iterator[ColumnBatch]:
+    schema = selector.result_schema
+
+    for rows in chunked(select_row_values(conn, metadata_store, selector), batch_size):
+        yield ColumnBatch(schema, [list(column) for column in zip(*rows)])
@@ -0,0 +1,754 @@
+from collections import defaultdict
+
+from redis import Redis
+
+from hash_db.models import MetadataStore, TableRecord, TableDefinition, FieldDescriptor, FieldValue, \
+    FunctionalDependency
+from hash_db.exceptions import DatabaseException, DependencyBrokenException, RecordNotFoundException, \
+    InvalidDescriptorException
+from hash_db.tools.scripts import ScriptRegistry
+from hash_db.tools.storage import fetch_field_values
+from hash_db.extensions.deletion import read_record
+
+# results of update script for every record
+UPDATED = 1
+RECORD_NOT_FOUND = 0
+DEPENDENCY_BROKEN = 2
+# values read by client to compute new dependency keys were changed meanwhile
+VALUES_CHANGED = -1
+# record was inserted before links existed, so client has to send them
+RECORD_UNLINKED = -2
+
+LUA_UPDATE_RECORDS = """
+-- empty hash field means that value is stored in plain string key
+local function get_field(key, hash_field)
+    if hash_field == "" then
+        return redis.call("GET", key)
+    end
+    return redis.call("HGET", key, hash_field)
+end
+
+local function set_field(key, hash_field, value)
+    if hash_field == "" then
+        redis.call("SET", key, value)
+    else
+        redis.call("HSET", key, hash_field, value)
+    end
+end
+
+-- links are triples of index key, dependent field name and companion key of dependency index,
+-- returns position of the link whose index key starts with prefix, insert keeps one link per dependency and index
+local function find_link(links, prefix)
+    for i = 1, #links, 3 do
+        if string.sub(links[i], 1, #prefix) == prefix then
+            return i
+        end
+    end
+    return nil
+end
+
+local keys_idx = 1
+local argv_idx = 1
+
+local function next_key()
+    local key = KEYS[keys_idx]
+    keys_idx = keys_idx + 1
+    return key
+end
+
+local function next_arg()
+    local arg = ARGV[argv_idx]
+    argv_idx = argv_idx + 1
+    return arg
+end
+
+-- optional value is sent as flag followed by value
+local function next_optional_arg()
+    local has_value = next_arg() == "1"
+    local value = next_arg()
+    if has_value then
+        return value
+    end
+    return false
+end
+
+local results = {}
+
+while argv_idx <= #ARGV do
+    local table_key = next_key()
+    local table_version_key = next_key()
+    local links_key = next_key()
+    local key_identifier = next_arg()
+    local has_links = next_arg() == "1"
+
+    -- values which client read before computing new dependency keys
+    local expected_values = {}
+    for i = 1, tonumber(next_arg()) do
+        local field_key = next_key()
+        local hash_field = next_arg()
+        table.insert(expected_values, {field_key, hash_field, next_optional_arg()})
+    end
+
+    -- links computed by client for record inserted before links existed
+    local links_given = next_arg() == "1"
+    local given_links = {}
+    for i = 1, 3 * tonumber(next_arg()) do
+        table.insert(given_links, next_arg())
+    end
+
+    local changed_fields = {}
+    for i = 1, tonumber(next_arg()) do
+        local field_key = next_key()
+        local hash_field = next_arg()
+        table.insert(changed_fields, {field_key, hash_field, next_arg()})
+    end
+
+    -- dependencies whose dependent or determinants are changed
+    local dependencies = {}
+    for i = 1, tonumber(next_arg()) do
+        local dependency = {}
+        dependency.field_key = next_key()
+        dependency.hash_field = next_arg()
+        dependency.field_name = next_arg()
+        dependency.key_prefix = next_arg()
+        dependency.new_value = next_optional_arg()
+        -- index key changes only if any determinant is changed, then client sends new keys
+        dependency.moved = next_arg() == "1"
+        if dependency.moved then
+            dependency.index_key = next_key()
+            dependency.value_key = next_key()
+        end
+        table.insert(dependencies, dependency)
+    end
+
+    -- secondary indexes of changed fields
+    local indexes = {}
+    for i = 1, tonumber(next_arg()) do
+        local key_prefix = next_arg()
+        table.insert(indexes, {key_prefix, next_key()})
+    end
+
+    local result = 1
+    local links = {}
+
+    if redis.call("SISMEMBER", table_key, key_identifier) == 0 then
+        result = 0
+    end
+
+    if result == 1 then
+        for i = 1, #expected_values do
+            if get_field(expected_values[i][1], expected_values[i][2]) ~= expected_values[i][3] then
+                result = -1
+            end
+        end
+    end
+
+    if result == 1 then
+        links = redis.call("LRANGE", links_key, 0, -1)
+
+        if #links == 0 then
+            if links_given then
+                links = given_links
+            elseif has_links then
+                result = -2
+            end
+        end
+    end
+
+    -- every touched dependency is checked before anything is written, so broken update changes nothing
+    if result == 1 then
+        for i = 1, #dependencies do
+            local dependency = dependencies[i]
+
+            dependency.value = dependency.new_value
+            if not dependency.value then
+                dependency.value = get_field(dependency.field_key, dependency.hash_field)
+            end
+
+            dependency.link = find_link(links, dependency.key_prefix)
+            if not dependency.moved and dependency.link then
+                dependency.index_key = links[dependency.link]
+                dependency.value_key = links[dependency.link + 2]
+            end
+
+            if dependency.index_key then
+                -- other records in dependency index must have the same dependent value
+                local other_members = redis.call("SCARD", dependency.index_key)
+                if redis.call("SISMEMBER", dependency.index_key, dependency.field_key) == 1 then
+                    other_members = other_members - 1
+                end
+
+                if other_members > 0 then
+                    local dependent_value = redis.call("GET", dependency.value_key)
+
+                    -- fallback for dependency indexes created before companion keys
+                    if not dependent_value then
+                        for _, member in ipairs(redis.call("SRANDMEMBER", dependency.index_key, 2)) do
+                            if member ~= dependency.field_key then
+                                dependent_value = get_field(member, dependency.hash_field)
+                                break
+                            end
+                        end
+                    end
+
+                    if dependent_value ~= dependency.value then
+                        result = 2
+                    end
+                end
+            end
+        end
+    end
+
+    if result == 1 then
+        for i = 1, #dependencies do
+            local dependency = dependencies[i]
+
+            if dependency.moved then
+                if dependency.link then
+                    local old_index_key = links[dependency.link]
+                    local old_value_key = links[dependency.link + 2]
+
+                    redis.call("SREM", old_index_key, dependency.field_key)
+
+                    -- dependent value is kept only as long as any record uses it
+                    if redis.call("SCARD", old_index_key) == 0 then
+                        redis.call("DEL", old_value_key)
+                    end
+
+                    links[dependency.link] = dependency.index_key
+                    links[dependency.link + 2] = dependency.value_key
+                else
+                    table.insert(links, dependency.index_key)
+                    table.insert(links, dependency.field_name)
+                    table.insert(links, dependency.value_key)
+                end
+
+                redis.call("SADD", dependency.index_key, dependency.field_key)
+            end
+
+            if dependency.index_key and dependency.value then
+                redis.call("SET", dependency.value_key, dependency.value)
+            end
+        end
+
+        for i = 1, #indexes do
+            local key_prefix = indexes[i][1]
+            local index_key = indexes[i][2]
+            local link = find_link(links, key_prefix)
+
+            if link then
+                redis.call("SREM", links[link], key_identifier)
+                links[link] = index_key
+            else
+                table.insert(links, index_key)
+                table.insert(links, "")
+                table.insert(links, "")
+            end
+
+            redis.call("SADD", index_key, key_identifier)
+        end
+
+        for i = 1, #changed_fields do
+            set_field(changed_fields[i][1], changed_fields[i][2], changed_fields[i][3])
+        end
+
+        redis.call("DEL", links_key)
+        if #links > 0 then
+            redis.call("RPUSH", links_key, unpack(links))
+        end
+
+        redis.call("INCR", table_version_key)
+    end
+
+    table.insert(results, result)
+end
+
+return results
+"""
+
+LUA_UPSERT_RECORDS = """
+-- empty hash field means that value is stored in plain string key
+local function get_field(key, hash_field)
+    if hash_field == "" then
+        return redis.call("GET", key)
+    end
+    return redis.call("HGET", key, hash_field)
+end
+
+local function set_field(key, hash_field, value)
+    if hash_field == "" then
+        redis.call("SET", key, value)
+    else
+        redis.call("HSET", key, hash_field, value)
+    end
+end
+
+local function delete_field(key, hash_field)
+    if hash_field == "" then
+        redis.call("DEL", key)
+    else
+        redis.call("HDEL", key, hash_field)
+    end
+end
+
+local keys_idx = 1
+local argv_idx = 1
+
+local function next_key()
+    local key = KEYS[keys_idx]
+    keys_idx = keys_idx + 1
+    return key
+end
+
+local function next_arg()
+    local arg = ARGV[argv_idx]
+    argv_idx = argv_idx + 1
+    return arg
+end
+
+-- 1 for inserted or replaced record, 0 for broken dependency and -2 for existing record without links,
+-- which was inserted before links existed, so client has to send them
+local results = {}
+
+while argv_idx <= #ARGV do
+    local table_key = next_key()
+    local table_version_key = next_key()
+    local links_key = next_key()
+    local key_identifier = next_arg()
+    local has_links = next_arg() == "1"
+
+    -- links computed by client for record inserted before links existed
+    local links_given = next_arg() == "1"
+    local given_links = {}
+    for i = 1, 3 * tonumber(next_arg()) do
+        table.insert(given_links, next_arg())
+    end
+
+    local fields = {}
+    for i = 1, tonumber(next_arg()) do
+        local field = {}
+        field.key = next_key()
+        field.name = next_arg()
+        field.hash_field = next_arg()
+        local has_value = next_arg() == "1"
+        local value = next_arg()
+        field.value = has_value and value
+
+        -- every dependency has index key followed by companion key holding dependent value
+        field.dependencies = {}
+        local dependency_count = tonumber(next_arg())
+        local index_count = tonumber(next_arg())
+        for dependency_iter = 1, dependency_count do
+            local dependency_key = next_key()
+            table.insert(field.dependencies, {dependency_key, next_key()})
+        end
+
+        field.indexes = {}
+        for index_iter = 1, index_count do
+            table.insert(field.indexes, next_key())
+        end
+
+        table.insert(fields, field)
+    end
+
+    local result = 1
+    local exists = redis.call("SISMEMBER", table_key, key_identifier) == 1
+    local old_links = {}
+
+    if exists then
+        old_links = redis.call("LRANGE", links_key, 0, -1)
+
+        if #old_links == 0 then
+            if links_given then
+                old_links = given_links
+            elseif has_links then
+                result = -2
+            end
+        end
+    end
+
+    -- record itself is not counted as other member of dependency index, so its old value does not break it
+    if result == 1 then
+        for i = 1, #fields do
+            local field = fields[i]
+
+            for j = 1, #field.dependencies do
+                local dependency_key = field.dependencies[j][1]
+                local dependency_value_key = field.dependencies[j][2]
+
+                local other_members = redis.call("SCARD", dependency_key)
+                if redis.call("SISMEMBER", dependency_key, field.key) == 1 then
+                    other_members = other_members - 1
+                end
+
+                if other_members > 0 then
+                    local dependent_value = redis.call("GET", dependency_value_key)
+
+                    -- fallback for dependency indexes created before companion keys
+                    if not dependent_value then
+                        for _, member in ipairs(redis.call("SRANDMEMBER", dependency_key, 2)) do
+                            if member ~= field.key then
+                                dependent_value = get_field(member, field.hash_field)
+                                break
+                            end
+                        end
+                    end
+
+                    if dependent_value ~= field.value then
+                        result = 0
+                    end
+                end
+            end
+        end
+    end
+
+    if result == 1 then
+        -- memberships of previous version of record are removed, so indexes hold only current values
+        local field_keys = {}
+        for i = 1, #fields do
+            field_keys[fields[i].name] = fields[i].key
+        end
+
+        for i = 1, #old_links, 3 do
+            local index_key = old_links[i]
+            local field_name = old_links[i + 1]
+
+            if field_name == "" then
+                redis.call("SREM", index_key, key_identifier)
+            else
+                redis.call("SREM", index_key, field_keys[field_name])
+
+                if redis.call("SCARD", index_key) == 0 then
+                    redis.call("DEL", old_links[i + 2])
+                end
+            end
+        end
+
+        local links = {}
+        for i = 1, #fields do
+            local field = fields[i]
+
+            if field.value then
+                set_field(field.key, field.hash_field, field.value)
+            elseif exists then
+                delete_field(field.key, field.hash_field)
+            end
+
+            for j = 1, #field.dependencies do
+                local dependency_key = field.dependencies[j][1]
+                local dependency_value_key = field.dependencies[j][2]
+
+                redis.call("SADD", dependency_key, field.key)
+                if field.value then
+                    redis.call("SET", dependency_value_key, field.value)
+                end
+
+                table.insert(links, dependency_key)
+                table.insert(links, field.name)
+                table.insert(links, dependency_value_key)
+            end
+
+            for j = 1, #field.indexes do
+                redis.call("SADD", field.indexes[j], key_identifier)
+
+                table.insert(links, field.indexes[j])
+                table.insert(links, "")
+                table.insert(links, "")
+            end
+        end
+
+        redis.call("SADD", table_key, key_identifier)
+        redis.call("INCR", table_version_key)
+
+        redis.call("DEL", links_key)
+        if #links > 0 then
+            redis.call("RPUSH", links_key, unpack(links))
+        end
+    end
+
+    table.insert(results, result)
+end
+
+return results
+"""
+
+UPDATE_SCRIPTS = {
+    "update_records": LUA_UPDATE_RECORDS,
+    "upsert_records": LUA_UPSERT_RECORDS
+}
+
+
+def validate_changes(metadata_store: MetadataStore, record: TableRecord,
+                     changes: dict[FieldDescriptor, FieldValue]) -> None:
+    table = metadata_store.get_table_by_name(record.table_descriptor)
+    primary_key_fields = table.get_primary_key_fields()
+
+    for field in changes:
+        # changing primary key would make it a different record
+        if field not in table.fields or field in primary_key_fields:
+            raise InvalidDescriptorException(field)
+
+
+def get_touched_dependencies(table: TableDefinition, changes: dict[FieldDescriptor, FieldValue]) -> list[
+    tuple[FunctionalDependency, bool]]:
+    # returns dependencies whose fields are changed, with flag telling whether any determinant is changed
+    touched_dependencies = []
+
+    for dependency in table.get_dependencies():
+        moved = any(determinant in changes for determinant in dependency.determinants)
+
+        if moved or dependency.dependent in changes:
+            touched_dependencies.append((dependency, moved))
+
+    return touched_dependencies
+
+
+def get_read_fields(table: TableDefinition, changes: dict[FieldDescriptor, FieldValue],
+                    unlinked: bool) -> list[FieldDescriptor]:
+    # links of unlinked record are computed from all its values
+    if unlinked:
+        return table.get_all_fields()
+
+    # new index keys of dependencies with changed determinants need values of other determinants
+    read_fields = set()
+    for dependency, moved in get_touched_dependencies(table, changes):
+        if moved:
+            read_fields.update(determinant for determinant in dependency.determinants if determinant not in changes)
+
+    return [field for field in table.get_all_fields() if field in read_fields]
+
+
+def read_update_values(conn: Redis, metadata_store: MetadataStore,
+                       updates: list[tuple[TableRecord, dict[FieldDescriptor, FieldValue]]],
+                       positions: list[int], unlinked: set[int]) -> dict[int, dict[FieldDescriptor, str | None]]:
+    # records needing the same fields of the same table are read together
+    groups: dict[tuple[str, tuple[FieldDescriptor, ...]], list[int]] = defaultdict(list)
+
+    for position in positions:
+        record, changes = updates[position]
+        table = metadata_store.get_table_by_name(record.table_descriptor)
+        read_fields = get_read_fields(table, changes, position in unlinked)
+
+        if read_fields:
+            groups[(table.table_descriptor.name, tuple(read_fields))].append(position)
+
+    read_values = dict()
+    for (table_name, read_fields), group in groups.items():
+        table = metadata_store.tables[table_name]
+        key_identifiers = [updates[position][0].get_primary_key_identifier(metadata_store) for position in group]
+        records_values = fetch_field_values(conn, metadata_store, table, key_identifiers, list(read_fields))
+
+        for position, record_values in zip(group, records_values):
+            read_values[position] = dict(zip(read_fields, record_values))
+
+    return read_values
+
+
+def append_optional_argument(args: list, value: str | None) -> None:
+    args.append(0 if value is None else 1)
+    args.append("" if value is None else value)
+
+
+def get_record_links(metadata_store: MetadataStore, record: TableRecord) -> list[str]:
+    table = metadata_store.get_table_by_name(record.table_descriptor)
+    links = []
+
+    for field in table.get_all_fields():
+        for dependency in table.functional_dependencies.get(field, []):
+            dependency_key, dependency_value_key = dependency.get_keys(metadata_store, record)
+            links.extend((dependency_key, field.name, dependency_value_key))
+
+        for index_key in table.get_index_keys(field, record.get_value(field)):
+            links.extend((index_key, "", ""))
+
+    return links
+
+
+def get_update_script_arguments(metadata_store: MetadataStore, record: TableRecord,
+                                changes: dict[FieldDescriptor, FieldValue],
+                                read_values: dict[FieldDescriptor, str | None], unlinked: bool,
+                                keys: list[str], args: list) -> None:
+    table = metadata_store.get_table_by_name(record.table_descriptor)
+    key_identifier = record.get_primary_key_identifier(metadata_store)
+
+    primary_key = {field: value for field, value in record.get_primary_key(metadata_store).items() if value is not None}
+    read_record = TableRecord(
+        table_descriptor=record.table_descriptor,
+        values={**primary_key, **{field: FieldValue(value) for field, value in read_values.items() if value is not None}}
+    )
+    updated_record = TableRecord(table_descriptor=record.table_descriptor, values={**read_record.values, **changes})
+
+    keys.append(table.get_table_key())
+    keys.append(table.get_version_key())
+    keys.append(table.get_links_key(key_identifier))
+    args.append(key_identifier)
+    args.append(1 if table.has_links() else 0)
+
+    # update is applied only if values used to compute new keys were not changed meanwhile
+    args.append(len(read_values))
+    for field, value in read_values.items():
+        field_key, hash_field = table.get_field_location(metadata_store.config.storage_layout, field, key_identifier)
+        keys.append(field_key)
+        args.append(hash_field)
+        append_optional_argument(args, value)
+
+    args.append(1 if unlinked else 0)
+    links = get_record_links(metadata_store, read_record) if unlinked else []
+    args.append(len(links) // 3)
+    args.extend(links)
+
+    args.append(len(changes))
+    for field, value in changes.items():
+        field_key, hash_field = table.get_field_location(metadata_store.config.storage_layout, field, key_identifier)
+        keys.append(field_key)
+        args.append(hash_field)
+        args.append(value.value)
+
+    touched_dependencies = get_touched_dependencies(table, changes)
+    args.append(len(touched_dependencies))
+    for dependency, moved in touched_dependencies:
+        field_key, hash_field = table.get_field_location(metadata_store.config.storage_layout, dependency.dependent,
+                                                         key_identifier)
+        keys.append(field_key)
+        args.append(hash_field)
+        args.append(dependency.dependent.name)
+        args.append(dependency.get_key_prefix())
+        append_optional_argument(args, updated_record.get_value(dependency.dependent) if dependency.dependent in changes
+                                 else None)
+        args.append(1 if moved else 0)
+
+        if moved:
+            keys.extend(dependency.get_keys(metadata_store, updated_record))
+
+    changed_indexes = [field for field in changes if field in table.indexes]
+    args.append(len(changed_indexes))
+    for field in changed_indexes:
+        args.append(table.get_index_key_prefix(field))
+        keys.extend(table.get_index_keys(field, changes[field].value))
+
+
+# Only fields in changes are written, dependencies of changed fields are checked again and their indexes are moved.
+# Most updates take single round trip, values of other determinants are read first only when
+# determinant is changed, and script applies update only if they were not changed meanwhile
+def update_many_using_redis_script(conn: Redis, scripts: ScriptRegistry, metadata_store: MetadataStore,
+                                   updates: list[tuple[TableRecord, dict[FieldDescriptor, FieldValue]]]) -> list[
+    DatabaseException | None]:
+    for record, changes in updates:
+        validate_changes(metadata_store, record, changes)
+
+    results: list[DatabaseException | None] = [None] * len(updates)
+    pending = list(range(len(updates)))
+    unlinked: set[int] = set()
+
+    while pending:
+        read_values = read_update_values(conn, metadata_store, updates, pending, unlinked)
+
+        keys = []
+        args = []
+        for position in pending:
+            record, changes = updates[position]
+            get_update_script_arguments(metadata_store, record, changes, read_values.get(position, dict()),
+                                        position in unlinked, keys, args)
+
+        retried = []
+        for position, result in zip(pending, scripts.call("update_records", keys, args)):
+            if result == RECORD_NOT_FOUND:
+                results[position] = RecordNotFoundException()
+            elif result == DEPENDENCY_BROKEN:
+                results[position] = DependencyBrokenException()
+            elif result in (VALUES_CHANGED, RECORD_UNLINKED):
+                if result == RECORD_UNLINKED:
+                    unlinked.add(position)
+                else:
+                    metadata_store.add_update_retry()
+
+                retried.append(position)
+
+        pending = retried
+
+    return results
+
+
+def update_using_redis_script(conn: Redis, scripts: ScriptRegistry, metadata_store: MetadataStore,
+                              record: TableRecord, changes: dict[FieldDescriptor, FieldValue]) -> None:
+    result, = update_many_using_redis_script(conn, scripts, metadata_store, [(record, changes)])
+
+    if result is not None:
+        raise result
+
+
+def get_upsert_script_arguments(metadata_store: MetadataStore, record: TableRecord, old_record: TableRecord | None,
+                                keys: list[str], args: list) -> None:
+    table = metadata_store.get_table_by_name(record.table_descriptor)
+    key_identifier = record.get_primary_key_identifier(metadata_store)
+    all_fields = table.get_all_fields()
+
+    keys.append(table.get_table_key())
+    keys.append(table.get_version_key())
+    keys.append(table.get_links_key(key_identifier))
+    args.append(key_identifier)
+    args.append(1 if table.has_links() else 0)
+
+    # links of existing record inserted before links existed, computed from its current values
+    args.append(0 if old_record is None else 1)
+    links = [] if old_record is None else get_record_links(metadata_store, old_record)
+    args.append(len(links) // 3)
+    args.extend(links)
+
+    args.append(len(all_fields))
+    for field_descriptor in all_fields:
+        field_value = record.get_value(field_descriptor)
+        field_key, hash_field = table.get_field_location(metadata_store.config.storage_layout, field_descriptor,
+                                                         key_identifier)
+
+        dependencies = table.functional_dependencies.get(field_descriptor, [])
+        index_keys = table.get_index_keys(field_descriptor, field_value)
+
+        keys.append(field_key)
+        args.append(field_descriptor.name)
+        args.append(hash_field)
+        append_optional_argument(args, field_value)
+        args.append(len(dependencies))
+        args.append(len(index_keys))
+
+        for dependency in dependencies:
+            keys.extend(dependency.get_keys(metadata_store, record))
+
+        keys.extend(index_keys)
+
+
+# Record is inserted, or replaces existing record with the same primary key. Memberships of replaced record
+# in dependency and secondary indexes are found using its links and removed, before new ones are added
+def upsert_many_using_redis_script(conn: Redis, scripts: ScriptRegistry, metadata_store: MetadataStore,
+                                   records: list[TableRecord]) -> list[DependencyBrokenException | None]:
+    results: list[DependencyBrokenException | None] = [None] * len(records)
+    pending = list(range(len(records)))
+    old_records: dict[int, TableRecord] = dict()
+
+    while pending:
+        keys = []
+        args = []
+        for position in pending:
+            get_upsert_script_arguments(metadata_store, records[position], old_records.get(position), keys, args)
+
+        unlinked = []
+        for position, result in zip(pending, scripts.call("upsert_records", keys, args)):
+            if result == 0:
+                results[position] = DependencyBrokenException()
+            elif result == RECORD_UNLINKED:
+                unlinked.append(position)
+
+        for position in unlinked:
+            old_records[position] = read_record(conn, metadata_store, records[position])
+
+        pending = unlinked
+
+    return results
+
+
+def upsert_using_redis_script(conn: Redis, scripts: ScriptRegistry, metadata_store: MetadataStore,
+                              record: TableRecord) -> None:
+    result, = upsert_many_using_redis_script(conn, scripts, metadata_store, [record])
+
+    if result is not None:
+        raise result
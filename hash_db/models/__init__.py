@@ -1,3 +1,4 @@
 from hash_db.models.basic_models import TableDescriptor, FieldDescriptor, FieldValue, FieldDefinition, ResultRow, \
-    JoinStatement, SelectorCondition, SelectorConditionEquals, SelectorConditionIn, SelectorConditionNot, Selector
+    ResultSchema, CompactResultRow, JoinStatement, SelectorCondition, SelectorConditionEquals, SelectorConditionIn, \
+    SelectorConditionNot, Selector, PlanOperation, PlanStep, QueryPlan
 from hash_db.models.models import MetadataStore, FunctionalDependency, TableDefinition, TableRecord
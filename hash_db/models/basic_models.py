@@ -1,4 +1,6 @@
 from dataclasses import dataclass
+from enum import Enum
+from json import dumps
 
 
 @dataclass(frozen=True)
@@ -42,6 +44,74 @@ class ResultRow:
     values: dict[TableDescriptor, dict[FieldDescriptor, FieldValue]]
 
 
+class ResultSchema:
+    # Columns of select result as (table alias, field) pairs, shared by all rows of one select
+    __slots__ = ("columns", "column_indexes")
+
+    def __init__(self, columns: list[tuple[str, FieldDescriptor]]):
+        self.columns = tuple(columns)
+        self.column_indexes = {column: index for index, column in enumerate(self.columns)}
+
+    def __eq__(self, other):
+        if not isinstance(other, ResultSchema):
+            return False
+
+        return self.columns == other.columns
+
+    def __hash__(self):
+        return hash(self.columns)
+
+    def __repr__(self):
+        return f"ResultSchema({list(self.columns)})"
+
+
+class CompactResultRow:
+    # Row of select result, plain values are kept in tuple ordered as columns of schema.
+    # ResultRow with nested dicts is built only when requested, by to_result_row or values
+    __slots__ = ("schema", "row")
+
+    def __init__(self, schema: ResultSchema, row: tuple[str | None, ...]):
+        self.schema = schema
+        self.row = row
+
+    def get(self, alias: str, field: FieldDescriptor) -> str | None:
+        return self.row[self.schema.column_indexes[(alias, field)]]
+
+    def __getitem__(self, index: int) -> str | None:
+        return self.row[index]
+
+    def __len__(self):
+        return len(self.row)
+
+    def __iter__(self):
+        return iter(self.row)
+
+    def __eq__(self, other):
+        if not isinstance(other, CompactResultRow):
+            return False
+
+        return self.schema == other.schema and self.row == other.row
+
+    def __hash__(self):
+        return hash((self.schema, self.row))
+
+    def __repr__(self):
+        return f"CompactResultRow({dict(zip(self.schema.columns, self.row))})"
+
+    def to_result_row(self) -> ResultRow:
+        values = dict()
+
+        for (alias, field), value in zip(self.schema.columns, self.row):
+            values.setdefault(alias, dict())[field] = None if value is None else FieldValue(value)
+
+        return ResultRow(values)
+
+    # compatibility with ResultRow, every access builds new dicts
+    @property
+    def values(self) -> dict[str, dict[FieldDescriptor, FieldValue | None]]:
+        return self.to_result_row().values
+
+
 @dataclass
 class JoinStatement:
     base_fields: list[tuple[TableDescriptor, FieldDescriptor]]
@@ -58,6 +128,14 @@ class SelectorCondition:
     def compare(self, other_value: FieldValue):
         raise NotImplemented
 
+    def get_condition_data_fingerprint(self):
+        return self.condition_data
+
+    # conditions equal in meaning have equal fingerprints, no matter how condition data was passed
+    def get_fingerprint(self) -> list:
+        return [type(self).__name__, self.table_descriptor.name, self.table_descriptor.get_alias(),
+                self.field_descriptor.name, self.get_condition_data_fingerprint()]
+
 
 class SelectorConditionEquals(SelectorCondition):
     def compare(self, other_value: FieldValue):
@@ -69,7 +147,13 @@ class SelectorConditionEquals(SelectorCondition):
 
 class SelectorConditionIn(SelectorCondition):
     def compare(self, other_value: FieldValue):
-        return other_value in self.condition_data
+        if other_value is None:
+            return other_value in self.condition_data
+
+        return other_value.value in self.condition_data
+
+    def get_condition_data_fingerprint(self):
+        return sorted(set(self.condition_data), key=lambda value: (value is not None, value))
 
 
 class SelectorConditionNot(SelectorCondition):
@@ -80,6 +164,9 @@ class SelectorConditionNot(SelectorCondition):
     def compare(self, other_value: FieldValue):
         return not self.condition.compare(other_value)
 
+    def get_condition_data_fingerprint(self):
+        return self.condition.get_fingerprint()
+
 
 @dataclass
 class Selector:
@@ -90,8 +177,12 @@ class Selector:
 
     all_needed_fields: dict[TableDescriptor, set[FieldDescriptor]] = None
     parsed_conditions: dict[TableDescriptor, dict[FieldDescriptor, list[SelectorCondition]]] = None
+    result_schema: ResultSchema = None
 
     def __post_init__(self):
+        self.result_schema = ResultSchema([(table.get_alias(), field)
+                                           for table, fields in self.select_fields.items() for field in fields])
+
         self.all_needed_fields = dict()
 
         for table, field_list in self.select_fields.items():
@@ -120,3 +211,49 @@ class Selector:
                 self.all_needed_fields[condition.table_descriptor] = set()
 
             self.all_needed_fields[condition.table_descriptor].add(condition.field_descriptor)
+
+    def get_tables(self) -> set[TableDescriptor]:
+        return {self.from_table} | {statement.target_table for statement in self.join_statements}
+
+    # Canonical form of selector, order of conditions does not change results, so they are sorted,
+    # while order of joins and selected fields, which is order of result columns, is kept
+    def get_fingerprint(self) -> str:
+        select_fields = [[table.name, table.get_alias(), [field.name for field in fields]]
+                         for table, fields in self.select_fields.items()]
+        join_statements = [[[[table.get_alias(), field.name] for table, field in statement.base_fields],
+                            statement.target_table.name, statement.target_table.get_alias(),
+                            [field.name for field in statement.target_fields]]
+                           for statement in self.join_statements]
+        conditions = sorted((condition.get_fingerprint() for condition in self.conditions),
+                            key=lambda fingerprint: dumps(fingerprint))
+
+        return dumps([select_fields, [self.from_table.name, self.from_table.get_alias()], join_statements, conditions],
+                     separators=(',', ':'))
+
+
+class PlanOperation(Enum):
+    SCAN = "scan"
+    PRIMARY_KEY_JOIN = "primary_key_join"
+    NESTED_LOOPS_JOIN = "nested_loops_join"
+    HASH_JOIN = "hash_join"
+
+
+@dataclass
+class PlanStep:
+    operation: PlanOperation
+    table_descriptor: TableDescriptor
+    join_statement: JoinStatement | None = None
+    estimated_rows: float | None = None
+    actual_rows: int | None = None
+
+
+@dataclass
+class QueryPlan:
+    steps: list[PlanStep]
+
+    def __str__(self):
+        lines = []
+        for step in self.steps:
+            lines.append(f"{step.operation.value} {step.table_descriptor.get_alias()} "
+                         f"(estimated rows: {step.estimated_rows}, actual rows: {step.actual_rows})")
+        return "\n".join(lines)
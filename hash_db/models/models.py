@@ -1,15 +1,21 @@
 from __future__ import annotations
 
+from hashlib import sha256
+from json import dumps
+from threading import Lock
+
 from hash_db.models.basic_models import TableDescriptor, FieldDescriptor, FieldValue, FieldDefinition
 from hash_db.exceptions import InvalidDescriptorException
 from hash_db.tools.tools import get_key_generator
-from hash_db.config import CoreConfiguration
+from hash_db.config import CoreConfiguration, StorageLayout
 
 
 class MetadataStore:
     tables: dict[str, TableDefinition]
     config: CoreConfiguration
     insert_retries: int
+    update_retries: int
+    statistics_lock: Lock
 
     def __init__(self, tables: list[TableDefinition], config: CoreConfiguration | None = None):
         self.tables = self.init_tables(tables)
@@ -20,6 +26,34 @@ class MetadataStore:
             self.config = config
 
         self.insert_retries = 0
+        self.update_retries = 0
+        self.statistics_lock = Lock()
+
+    # many threads can share one Core, so statistics are updated under lock
+    def add_insert_retry(self) -> None:
+        with self.statistics_lock:
+            self.insert_retries += 1
+
+    def add_update_retry(self) -> None:
+        with self.statistics_lock:
+            self.update_retries += 1
+
+    # Changes whenever tables or the way their keys are built change, so clients using other schema
+    # on the same server are told apart
+    def get_schema_version(self) -> str:
+        schema = {
+            "key_policy": self.config.key_policy.value,
+            "storage_layout": self.config.storage_layout.value,
+            "tables": {
+                name: {
+                    "fields": [(field.field_descriptor.name, field.primary_key) for field in table.fields.values()],
+                    "dependencies": sorted(dependency.key_name for dependency in table.get_dependencies()),
+                    "indexes": sorted(field.name for field in table.indexes)
+                } for name, table in sorted(self.tables.items())
+            }
+        }
+
+        return sha256(dumps(schema).encode("utf-8")).hexdigest()
 
     @staticmethod
     def init_tables(tables: list[TableDefinition]) -> dict[str, TableDefinition]:
@@ -43,32 +77,44 @@ class FunctionalDependency:
         self.determinants = determinants
         self.dependent = dependent
 
-    def get_determinant_values(self, record: TableRecord):
-        determinant_values: dict[FieldDescriptor, FieldValue | None] = dict()
-
-        for determinant in self.determinants:
-            determinant_values[determinant] = record.get_value_object(determinant)
+        # part of index keys shared by all values of determinants
+        determinant_names = "&".join(sorted(determinant.name for determinant in self.determinants))
+        self.key_name = f"{determinant_names}=>{self.dependent.name}"
 
-        return determinant_values
+    def get_determinant_values(self, record: TableRecord):
+        return {determinant: record.values.get(determinant) for determinant in self.determinants}
 
     def get_dependency_identifier(self, metadata_store: MetadataStore, record: TableRecord):
         return get_key_generator(metadata_store.config.key_policy)(self.get_determinant_values(record))
 
+    def get_key_suffix(self, metadata_store: MetadataStore, record: TableRecord):
+        return f"{self.key_name}:{self.get_dependency_identifier(metadata_store, record)}"
+
     def get_key(self, metadata_store: MetadataStore, record: TableRecord):
-        determinant_names = "&".join(sorted(determinant.name for determinant in self.determinants))
-        dependent_name = self.dependent.name
-        dependency_identifier = self.get_dependency_identifier(metadata_store, record)
+        return f"__dependency_index__:{self.get_key_suffix(metadata_store, record)}"
 
-        return f"__dependency_index__:{determinant_names}=>{dependent_name}:{dependency_identifier}"
+    # common part of index keys of this dependency, for all values of determinants
+    def get_key_prefix(self) -> str:
+        return f"__dependency_index__:{self.key_name}:"
+
+    # companion key of dependency index, holding dependent value shared by all members of the index
+    def get_value_key(self, metadata_store: MetadataStore, record: TableRecord):
+        return f"__dependency_value__:{self.get_key_suffix(metadata_store, record)}"
+
+    # index key and its companion key, with determinant values encoded only once
+    def get_keys(self, metadata_store: MetadataStore, record: TableRecord) -> tuple[str, str]:
+        key_suffix = self.get_key_suffix(metadata_store, record)
+        return f"__dependency_index__:{key_suffix}", f"__dependency_value__:{key_suffix}"
 
 
 class TableDefinition:
     table_descriptor: TableDescriptor
     fields: dict[FieldDescriptor, FieldDefinition]
     functional_dependencies: dict[FieldDescriptor, list[FunctionalDependency]]
+    indexes: set[FieldDescriptor]
 
     def __init__(self, table_descriptor: TableDescriptor, fields: list[FieldDefinition],
-                 dependencies: list[FunctionalDependency] = None):
+                 dependencies: list[FunctionalDependency] = None, indexes: list[FieldDescriptor] = None):
 
         self.table_descriptor = table_descriptor
         self.fields = self.init_fields(fields)
@@ -78,6 +124,29 @@ class TableDefinition:
         else:
             self.functional_dependencies = self.init_dependencies(dependencies)
 
+        if indexes is None:
+            self.indexes = set()
+        else:
+            self.indexes = set(indexes)
+
+        self.init_encoders()
+
+    # Field lists and key prefixes are computed once, since they are needed for every field of every record.
+    # Returned lists are shared, so they must not be modified by callers
+    def init_encoders(self) -> None:
+        name = self.table_descriptor.name
+
+        self.all_fields = list(self.fields.keys())
+        self.primary_key_fields = [field.field_descriptor for field in self.fields.values() if field.primary_key]
+        self.normal_fields = [field.field_descriptor for field in self.fields.values() if not field.primary_key]
+
+        self.table_key = f"__table_keys__:{name}"
+        self.version_key = f"__table_version__:{name}"
+        self.record_key_prefix = f"__record__:{name}"
+        self.links_key_prefix = f"__record_links__:{name}"
+        self.field_key_prefixes = {field: f"__value__:{name}:{field.name}" for field in self.all_fields}
+        self.index_key_prefixes = {field: f"__secondary_index__:{name}:{field.name}" for field in self.indexes}
+
     @staticmethod
     def init_fields(fields: list[FieldDefinition]) -> dict[FieldDescriptor, FieldDefinition]:
         parsed_fields = dict()
@@ -98,30 +167,71 @@ class TableDefinition:
         return parsed_dependencies
 
     def get_all_fields(self) -> list[FieldDescriptor]:
-        return list(self.fields.keys())
+        return self.all_fields
 
     def get_primary_key_fields(self) -> list[FieldDescriptor]:
-        result = []
-        for field in self.fields.values():
-            if field.primary_key:
-                result.append(field.field_descriptor)
-        return result
+        return self.primary_key_fields
 
     def get_normal_fields(self) -> list[FieldDescriptor]:
-        result = []
-        for field in self.fields.values():
-            if not field.primary_key:
-                result.append(field.field_descriptor)
-        return result
+        return self.normal_fields
 
     def get_table_key(self):
-        return f"__table_keys__:{self.table_descriptor.name}"
+        return self.table_key
+
+    # counter incremented by every write to the table, so cached results of other processes become outdated
+    def get_version_key(self):
+        return self.version_key
 
     def get_field_key_prefix(self, field: FieldDescriptor = None) -> str:
         if field is None:
-            field = next(iter(self.fields.keys()))
+            field = self.all_fields[0]
+
+        return self.field_key_prefixes[field]
+
+    def get_index_key(self, field: FieldDescriptor, value: str) -> str:
+        return f"{self.index_key_prefixes[field]}:{value}"
+
+    def get_index_key_prefix(self, field: FieldDescriptor) -> str:
+        return f"{self.index_key_prefixes[field]}:"
+
+    def get_dependencies(self) -> list[FunctionalDependency]:
+        return [dependency for dependencies in self.functional_dependencies.values() for dependency in dependencies]
+
+    def get_index_keys(self, field: FieldDescriptor, value: str | None) -> list[str]:
+        if field not in self.indexes or value is None:
+            return []
+        return [self.get_index_key(field, value)]
 
-        return f"__value__:{self.table_descriptor.name}:{field.name}"
+    # keys read by selects of the table, whose replies can be kept in client side cache
+    def get_cached_key_prefixes(self) -> list[str]:
+        return [self.table_key, self.version_key, f"{self.record_key_prefix}:",
+                *(f"{prefix}:" for prefix in self.field_key_prefixes.values()),
+                *(f"{prefix}:" for prefix in self.index_key_prefixes.values())]
+
+    def get_record_key_prefix(self) -> str:
+        return self.record_key_prefix
+
+    # List of dependency and secondary indexes which record was added to, as triples of index key,
+    # name of dependent field (empty for secondary index) and companion key of dependency index (empty for
+    # secondary index), so record can be deleted knowing only its primary key
+    def get_links_key(self, key_identifier: str) -> str:
+        return f"{self.links_key_prefix}:{key_identifier}"
+
+    # records of tables without any dependency or index are not linked anywhere, so they have no links
+    def has_links(self) -> bool:
+        return bool(self.functional_dependencies or self.indexes)
+
+    def get_key_prefix(self, storage_layout: StorageLayout, field: FieldDescriptor = None) -> str:
+        if storage_layout == StorageLayout.HASH_PER_RECORD:
+            return self.get_record_key_prefix()
+        return self.get_field_key_prefix(field)
+
+    def get_field_location(self, storage_layout: StorageLayout, field: FieldDescriptor,
+                           key_identifier: str) -> tuple[str, str]:
+        # returns key holding the value and name of hash field, which is empty if value is kept in string key
+        if storage_layout == StorageLayout.HASH_PER_RECORD:
+            return f"{self.record_key_prefix}:{key_identifier}", field.name
+        return f"{self.field_key_prefixes[field]}:{key_identifier}", ""
 
 
 class TableRecord:
@@ -133,21 +243,20 @@ class TableRecord:
         self.values = values
 
     def get_primary_key(self, metadata_store: MetadataStore) -> dict[FieldDescriptor, FieldValue | None]:
-        primary_key: dict[FieldDescriptor, FieldValue | None] = dict()
-
-        for field in metadata_store.get_table_by_name(self.table_descriptor).get_primary_key_fields():
-            primary_key[field] = self.get_value_object(field)
-
-        return primary_key
+        return {field: self.values.get(field)
+                for field in metadata_store.get_table_by_name(self.table_descriptor).get_primary_key_fields()}
 
     def get_primary_key_identifier(self, metadata_store: MetadataStore) -> str:
         return get_key_generator(metadata_store.config.key_policy)(self.get_primary_key(metadata_store))
 
-    def get_field_key(self, metadata_store: MetadataStore, field: FieldDescriptor) -> str:
-        key_prefix = metadata_store.get_table_by_name(self.table_descriptor).get_field_key_prefix(field)
-        key_identifier = self.get_primary_key_identifier(metadata_store)
+    def get_field_location(self, metadata_store: MetadataStore, field: FieldDescriptor,
+                           key_identifier: str | None = None) -> tuple[str, str]:
+        # primary key identifier can be passed, so it is encoded once for all fields of the record
+        table = metadata_store.get_table_by_name(self.table_descriptor)
+        if key_identifier is None:
+            key_identifier = self.get_primary_key_identifier(metadata_store)
 
-        return f"{key_prefix}:{key_identifier}"
+        return table.get_field_location(metadata_store.config.storage_layout, field, key_identifier)
 
     def get_value_object(self, field_descriptor: FieldDescriptor) -> FieldValue | None:
         return self.values.get(field_descriptor, None)
@@ -0,0 +1,77 @@
+from array import array
+from dataclasses import dataclass
+from sys import byteorder
+
+from hash_db.models import ResultSchema, FieldDescriptor
+
+
+@dataclass
+class ArrowBuffers:
+    # Buffers of arrow large_string array: validity bitmap (None when there are no nulls),
+    # 64-bit offsets and utf-8 data, so pyarrow can wrap them without copying
+    # https://arrow.apache.org/docs/format/Columnar.html#variable-size-binary-layout
+    length: int
+    null_count: int
+    validity: bytes | None
+    offsets: bytes
+    data: bytes
+
+
+def get_arrow_buffers(column: list[str | None]) -> ArrowBuffers:
+    validity = bytearray((len(column) + 7) // 8)
+    offsets = array("q", [0])
+    data = bytearray()
+    null_count = 0
+
+    for index, value in enumerate(column):
+        if value is None:
+            null_count += 1
+        else:
+            data += value.encode()
+            validity[index >> 3] |= 1 << (index & 7)
+
+        offsets.append(len(data))
+
+    # arrow buffers are little-endian
+    if byteorder == "big":
+        offsets.byteswap()
+
+    return ArrowBuffers(len(column), null_count, bytes(validity) if null_count else None, offsets.tobytes(),
+                        bytes(data))
+
+
+@dataclass
+class ColumnBatch:
+    # Part of select result stored by columns, one list of plain values per column of schema
+    schema: ResultSchema
+    columns: list[list[str | None]]
+
+    def __len__(self):
+        return len(self.columns[0]) if self.columns else 0
+
+    def get_column(self, alias: str, field: FieldDescriptor) -> list[str | None]:
+        return self.columns[self.schema.column_indexes[(alias, field)]]
+
+    def get_column_names(self) -> list[str]:
+        return [f"{alias}.{field.name}" for alias, field in self.schema.columns]
+
+    def get_arrow_buffers(self) -> list[ArrowBuffers]:
+        return [get_arrow_buffers(column) for column in self.columns]
+
+    # numpy and pyarrow are optional, they are imported only when batch is converted
+    def to_numpy(self) -> list:
+        import numpy
+
+        return [numpy.array(column, dtype=object) for column in self.columns]
+
+    def to_arrow(self):
+        import pyarrow
+
+        arrays = []
+        for buffers in self.get_arrow_buffers():
+            validity = None if buffers.validity is None else pyarrow.py_buffer(buffers.validity)
+            arrays.append(pyarrow.Array.from_buffers(pyarrow.large_string(), buffers.length,
+                                                     [validity, pyarrow.py_buffer(buffers.offsets),
+                                                      pyarrow.py_buffer(buffers.data)], buffers.null_count))
+
+        return pyarrow.RecordBatch.from_arrays(arrays, names=self.get_column_names())
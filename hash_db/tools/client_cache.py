@@ -0,0 +1,155 @@
+from collections import OrderedDict
+from threading import RLock
+from typing import Iterable
+
+from redis.cache import CacheConfig, CacheConfigurationInterface, CacheEntry, CacheEntryStatus, CacheInterface, \
+    CacheKey, DefaultCache, EvictionPolicyInterface
+
+from hash_db.models import TableDefinition
+
+
+# Replies of read commands (MGET, SMISMEMBER, SMEMBERS, ...) are cached by redis-py client side caching,
+# which turns on client tracking for every RESP3 connection of the pool and drops cached replies when redis sends
+# invalidation for any of their keys, requires redis 7.4 or newer
+# https://redis.readthedocs.io/en/stable/resp3_features.html#client-side-caching
+def get_cache_kwargs(client_cache_size: int | None, tables: Iterable[TableDefinition]) -> dict:
+    if client_cache_size is None:
+        return dict()
+
+    return dict(protocol=3, cache=ClientCache(CacheConfig(max_size=client_cache_size), tables))
+
+
+def decode_key(key: str | bytes) -> str:
+    return key.decode() if isinstance(key, bytes) else key
+
+
+class ClientCache(CacheInterface):
+    # Cache shared by all connections of the pool. redis-py locks it separately in every connection, so all
+    # operations take one lock here. Replies are indexed by their keys and tables, so invalidation sent by redis
+    # and invalidation of tables written by Core touch only matching replies, instead of scanning whole cache
+    cache: DefaultCache
+    lock: RLock
+    table_prefixes: list[tuple[str, str]]
+    replies_by_key: dict[str, set[CacheKey]]
+    replies_by_table: dict[str, set[CacheKey]]
+    lookups: int
+    misses: int
+
+    def __init__(self, cache_config: CacheConfig, tables: Iterable[TableDefinition]):
+        self.cache = DefaultCache(cache_config)
+        self.lock = RLock()
+        self.table_prefixes = [(prefix, table.table_descriptor.name)
+                               for table in tables for prefix in table.get_cached_key_prefixes()]
+        self.replies_by_key = dict()
+        self.replies_by_table = dict()
+        self.lookups = 0
+        self.misses = 0
+
+    @property
+    def collection(self) -> OrderedDict:
+        return self.cache.collection
+
+    @property
+    def config(self) -> CacheConfigurationInterface:
+        return self.cache.config
+
+    @property
+    def eviction_policy(self) -> EvictionPolicyInterface:
+        return self.cache.eviction_policy
+
+    @property
+    def size(self) -> int:
+        with self.lock:
+            return self.cache.size
+
+    # Connection asks whether every command it sends can be cached, and puts placeholder into the cache
+    # when reply of cachable command has to be read from redis, so hits are lookups which did not need it
+    @property
+    def hits(self) -> int:
+        with self.lock:
+            return self.lookups - self.misses
+
+    # prefixes not ending with separator are whole keys, like set of table keys
+    def get_table_name(self, key: str) -> str | None:
+        for prefix, table_name in self.table_prefixes:
+            if key == prefix or (prefix.endswith(":") and key.startswith(prefix)):
+                return table_name
+        return None
+
+    def add_to_index(self, cache_key: CacheKey) -> None:
+        for key in map(decode_key, cache_key.redis_keys):
+            self.replies_by_key.setdefault(key, set()).add(cache_key)
+
+            table_name = self.get_table_name(key)
+            if table_name is not None:
+                self.replies_by_table.setdefault(table_name, set()).add(cache_key)
+
+    def remove_from_index(self, cache_key: CacheKey) -> None:
+        for key in map(decode_key, cache_key.redis_keys):
+            replies = self.replies_by_key.get(key)
+            if replies is not None:
+                replies.discard(cache_key)
+                if not replies:
+                    del self.replies_by_key[key]
+
+            table_name = self.get_table_name(key)
+            if table_name is not None:
+                self.replies_by_table.get(table_name, set()).discard(cache_key)
+
+    def get(self, key: CacheKey) -> CacheEntry | None:
+        with self.lock:
+            return self.cache.get(key)
+
+    def set(self, entry: CacheEntry) -> bool:
+        with self.lock:
+            if not self.cache.set(entry):
+                return False
+
+            if entry.status == CacheEntryStatus.IN_PROGRESS:
+                self.misses += 1
+
+            self.add_to_index(entry.cache_key)
+
+            if self.cache.config.is_exceeds_max_size(self.cache.size):
+                self.remove_from_index(self.cache.eviction_policy.evict_next())
+
+            return True
+
+    def delete_by_cache_keys(self, cache_keys: list[CacheKey]) -> list[bool]:
+        with self.lock:
+            deleted = self.cache.delete_by_cache_keys(cache_keys)
+
+            for cache_key, was_deleted in zip(cache_keys, deleted):
+                if was_deleted:
+                    self.remove_from_index(cache_key)
+
+            return deleted
+
+    # reply of MGET can hold many of the given keys, so every reply is deleted once
+    def delete_by_redis_keys(self, redis_keys: list[bytes] | list[str]) -> list[bool]:
+        with self.lock:
+            cache_keys = {cache_key for key in redis_keys for cache_key in self.replies_by_key.get(decode_key(key), ())}
+            return self.delete_by_cache_keys(list(cache_keys))
+
+    def flush(self) -> int:
+        with self.lock:
+            self.replies_by_key.clear()
+            self.replies_by_table.clear()
+            return self.cache.flush()
+
+    def is_cachable(self, key: CacheKey) -> bool:
+        with self.lock:
+            cachable = self.cache.is_cachable(key)
+            if cachable:
+                self.lookups += 1
+            return cachable
+
+    # Invalidation sent by redis is read only when the connection which cached the reply is used again,
+    # so replies of tables written by the same Core are dropped right after the write, and read after write
+    # never returns replies cached before it
+    def invalidate_tables(self, tables: Iterable[TableDefinition]) -> None:
+        with self.lock:
+            cache_keys = {cache_key for table in tables
+                          for cache_key in self.replies_by_table.get(table.table_descriptor.name, ())}
+            if cache_keys:
+                self.delete_by_cache_keys(list(cache_keys))
@@ -0,0 +1,59 @@
+from redis import Redis
+
+from hash_db.models import MetadataStore, TableRecord, FieldValue
+from hash_db.config import StorageLayout
+from hash_db.tools.selection_tools import TableIterator
+from hash_db.tools.storage import fetch_field_values, write_field, delete_field
+
+
+# Every chunk of records is read and rewritten in separate round trips, and other clients keep writing in layout
+# of their own configuration, so all writers have to be stopped during migration and started with target layout
+def migrate_storage_layout(conn: Redis, metadata_store: MetadataStore, target_layout: StorageLayout) -> int:
+    source_layout = metadata_store.config.storage_layout
+    if source_layout == target_layout:
+        return 0
+
+    migrated_records = 0
+
+    for table in metadata_store.tables.values():
+        fields = table.get_all_fields()
+
+        # records are read in source layout, so configuration is switched only after all tables are migrated
+        for key_identifiers in TableIterator(conn, metadata_store, table.table_descriptor).chunks():
+            records_values = fetch_field_values(conn, metadata_store, table, key_identifiers, fields)
+
+            with conn.pipeline() as pipeline:
+                pipeline.multi()
+
+                for key_identifier, record_values in zip(key_identifiers, records_values):
+                    record = TableRecord(
+                        table_descriptor=table.table_descriptor,
+                        values={field: FieldValue(value) for field, value in zip(fields, record_values)
+                                if value is not None}
+                    )
+
+                    for field, value in zip(fields, record_values):
+                        source_key, source_hash_field = table.get_field_location(source_layout, field, key_identifier)
+                        target_key, target_hash_field = table.get_field_location(target_layout, field, key_identifier)
+
+                        # dependency indexes keep keys holding the values, so members have to be replaced
+                        for dependency in table.functional_dependencies.get(field, []):
+                            dependency_key = dependency.get_key(metadata_store, record)
+                            pipeline.srem(dependency_key, source_key)
+                            pipeline.sadd(dependency_key, target_key)
+
+                        delete_field(pipeline, source_key, source_hash_field)
+
+                        if value is not None:
+                            write_field(pipeline, target_key, target_hash_field, value)
+
+                # selects cached by table version do not return records from the source layout
+                pipeline.incr(table.get_version_key())
+
+                pipeline.execute()
+
+            migrated_records += len(key_identifiers)
+
+    metadata_store.config.storage_layout = target_layout
+
+    return migrated_records
@@ -0,0 +1,106 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from threading import Lock
+from time import monotonic
+from typing import Callable, Iterable, Iterator
+
+from redis import Redis
+
+from hash_db.models import MetadataStore, Selector, CompactResultRow
+
+
+@dataclass
+class ResultCacheEntry:
+    table_versions: list[str | None]
+    expires_at: float
+    rows: list[CompactResultRow]
+
+
+class ResultCache:
+    # Results of selects, addressed by selector fingerprint. Entry is valid only as long as versions
+    # of all selected tables stored in redis are the same as when the select started
+    ttl: float
+    max_rows: int
+    entries: OrderedDict[str, ResultCacheEntry]
+    rows_count: int
+    hits: int
+    misses: int
+    lock: Lock
+
+    def __init__(self, ttl: float, max_rows: int):
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.entries = OrderedDict()
+        self.rows_count = 0
+
+        self.hits = 0
+        self.misses = 0
+
+        self.lock = Lock()
+
+    def get(self, fingerprint: str, table_versions: list[str | None]) -> list[CompactResultRow] | None:
+        with self.lock:
+            entry = self.entries.get(fingerprint)
+
+            if entry is None or entry.table_versions != table_versions or entry.expires_at <= monotonic():
+                if entry is not None:
+                    self.remove(fingerprint)
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.entries.move_to_end(fingerprint)
+            return entry.rows
+
+    def put(self, fingerprint: str, table_versions: list[str | None], rows: list[CompactResultRow]) -> None:
+        if len(rows) > self.max_rows:
+            return
+
+        with self.lock:
+            if fingerprint in self.entries:
+                self.remove(fingerprint)
+
+            self.entries[fingerprint] = ResultCacheEntry(table_versions, monotonic() + self.ttl, rows)
+            self.rows_count += len(rows)
+
+            # least recently used results are dropped, until all cached results fit in memory cap
+            while self.rows_count > self.max_rows:
+                self.remove(next(iter(self.entries)))
+
+    def remove(self, fingerprint: str) -> None:
+        self.rows_count -= len(self.entries.pop(fingerprint).rows)
+
+
+def get_table_versions(conn: Redis, metadata_store: MetadataStore, selector: Selector) -> list[str | None]:
+    table_names = sorted({table_descriptor.name for table_descriptor in selector.get_tables()})
+
+    return conn.mget([metadata_store.tables[table_name].get_version_key() for table_name in table_names])
+
+
+# Table versions are read before select starts, so result of select which raced with a write
+# is stored with versions from before that write and will not be served
+def cached_select(conn: Redis, metadata_store: MetadataStore, result_cache: ResultCache, selector: Selector,
+                  select_function: Callable[[], Iterable[CompactResultRow]]) -> Iterator[CompactResultRow]:
+    fingerprint = selector.get_fingerprint()
+    table_versions = get_table_versions(conn, metadata_store, selector)
+
+    rows = result_cache.get(fingerprint, table_versions)
+    if rows is not None:
+        # rows are immutable, so consumer cannot modify cached result and they are served without copying
+        yield from rows
+        return
+
+    collected_rows: list[CompactResultRow] | None = []
+    for result_row in select_function():
+        if collected_rows is not None:
+            collected_rows.append(result_row)
+
+            # results bigger than whole cache are streamed without being kept in memory
+            if len(collected_rows) > result_cache.max_rows:
+                collected_rows = None
+
+        yield result_row
+
+    # only results of selects consumed to the end are complete
+    if collected_rows is not None:
+        result_cache.put(fingerprint, table_versions, collected_rows)
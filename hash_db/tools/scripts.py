@@ -0,0 +1,235 @@
+from hashlib import sha256
+from threading import Lock
+
+from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
+from redis.exceptions import NoScriptError, ResponseError
+
+
+class ScriptRegistry:
+    conn: Redis
+    scripts: dict[str, str]
+    shas: dict[str, str]
+    script_calls: int
+    script_reloads: int
+    statistics_lock: Lock
+
+    def __init__(self, conn: Redis, scripts: dict[str, str]):
+        self.conn = conn
+        self.scripts = scripts
+        self.shas = dict()
+
+        self.script_calls = 0
+        self.script_reloads = 0
+        # registry is shared by all threads using the same Core
+        self.statistics_lock = Lock()
+
+        self.load_all()
+
+    def load_all(self) -> None:
+        for name in self.scripts:
+            self.load(name)
+
+    # Loading script source once, later calls send only its SHA
+    # https://redis.io/docs/latest/commands/script-load/
+    def load(self, name: str) -> str:
+        self.shas[name] = self.conn.script_load(self.scripts[name])
+        return self.shas[name]
+
+    # https://redis.io/docs/latest/commands/evalsha/
+    def call(self, name: str, keys: list[str], args: list):
+        with self.statistics_lock:
+            self.script_calls += 1
+
+        try:
+            return self.conn.evalsha(self.shas[name], len(keys), *keys, *args)
+        except NoScriptError:
+            # script cache was flushed (e.g. SCRIPT FLUSH or server restart), so source is sent again
+            with self.statistics_lock:
+                self.script_reloads += 1
+            return self.conn.evalsha(self.load(name), len(keys), *keys, *args)
+
+
+LIBRARY_PREFIX = "hash_db_"
+
+
+# Every script becomes function of single library, whose name changes with sources and schema, so clients
+# with different versions can use the same server. Functions are stored by server itself, so unlike script
+# cache they survive restarts (with persistence enabled) and are replicated, requires redis 7 or newer
+# https://redis.io/docs/latest/develop/programmability/functions-intro/
+def get_library_name(scripts: dict[str, str], schema_version: str) -> str:
+    digest = sha256(schema_version.encode())
+    for name in sorted(scripts):
+        digest.update(f"{name}\n{scripts[name]}".encode())
+
+    return f"{LIBRARY_PREFIX}{digest.hexdigest()[:16]}"
+
+
+def get_function_name(library_name: str, name: str) -> str:
+    return f"{library_name}_{name}"
+
+
+# scripts read KEYS and ARGV, so their sources become bodies of functions having them as arguments
+def get_library_code(library_name: str, scripts: dict[str, str]) -> str:
+    code = [f"#!lua name={library_name}"]
+
+    for name in sorted(scripts):
+        code.append(f"local function {name}(KEYS, ARGV)\n{scripts[name]}\nend")
+        code.append(f"redis.register_function('{get_function_name(library_name, name)}', {name})")
+
+    return "\n".join(code)
+
+
+def is_library_loaded_error(error: ResponseError) -> bool:
+    return "already exists" in str(error)
+
+
+def is_function_missing_error(error: ResponseError) -> bool:
+    return "Function not found" in str(error)
+
+
+def is_library_missing_error(error: ResponseError) -> bool:
+    return "Library not found" in str(error)
+
+
+# FUNCTION LIST replies with flat list of names and values in RESP2, and with map in RESP3
+# https://redis.io/docs/latest/commands/function-list/
+def get_other_library_names(libraries: list, library_name: str) -> list[str]:
+    names = []
+    for library in libraries:
+        if not isinstance(library, dict):
+            library = dict(zip(library[::2], library[1::2]))
+
+        if library["library_name"] != library_name:
+            names.append(library["library_name"])
+
+    return names
+
+
+class FunctionRegistry(ScriptRegistry):
+    library_name: str
+
+    def __init__(self, conn: Redis, scripts: dict[str, str], schema_version: str):
+        self.library_name = get_library_name(scripts, schema_version)
+        super().__init__(conn, scripts)
+
+    # Libraries of other versions are deleted when client starts, so they do not pile up on the server.
+    # Clients still running other version get "Function not found" and load their library again, without
+    # deleting others, so the library of the newest started client is never deleted by older ones
+    def load_all(self) -> None:
+        self.load_library()
+        self.delete_other_libraries()
+
+    # library is loaded only if it is not on the server yet, since other clients may be calling it
+    # https://redis.io/docs/latest/commands/function-load/
+    def load_library(self) -> None:
+        try:
+            self.conn.function_load(get_library_code(self.library_name, self.scripts))
+        except ResponseError as error:
+            if not is_library_loaded_error(error):
+                raise
+
+    # https://redis.io/docs/latest/commands/function-delete/
+    def delete_other_libraries(self) -> None:
+        libraries = self.conn.function_list(library=f"{LIBRARY_PREFIX}*")
+        for library_name in get_other_library_names(libraries, self.library_name):
+            try:
+                self.conn.function_delete(library_name)
+            except ResponseError as error:
+                # other client deleted it first
+                if not is_library_missing_error(error):
+                    raise
+
+    # https://redis.io/docs/latest/commands/fcall/
+    def call(self, name: str, keys: list[str], args: list):
+        with self.statistics_lock:
+            self.script_calls += 1
+
+        function_name = get_function_name(self.library_name, name)
+        try:
+            return self.conn.fcall(function_name, len(keys), *keys, *args)
+        except ResponseError as error:
+            # library was deleted (e.g. FUNCTION FLUSH or restart without persistence), so it is loaded again
+            if not is_function_missing_error(error):
+                raise
+
+            with self.statistics_lock:
+                self.script_reloads += 1
+            self.load_library()
+            return self.conn.fcall(function_name, len(keys), *keys, *args)
+
+
+class AsyncScriptRegistry:
+    conn: AsyncRedis
+    scripts: dict[str, str]
+    shas: dict[str, str]
+    script_calls: int
+    script_reloads: int
+
+    # scripts cannot be loaded in constructor, load_all has to be awaited before first call
+    def __init__(self, conn: AsyncRedis, scripts: dict[str, str]):
+        self.conn = conn
+        self.scripts = scripts
+        self.shas = dict()
+
+        self.script_calls = 0
+        self.script_reloads = 0
+
+    async def load_all(self) -> None:
+        for name in self.scripts:
+            await self.load(name)
+
+    async def load(self, name: str) -> str:
+        self.shas[name] = await self.conn.script_load(self.scripts[name])
+        return self.shas[name]
+
+    async def call(self, name: str, keys: list[str], args: list):
+        self.script_calls += 1
+
+        try:
+            return await self.conn.evalsha(self.shas[name], len(keys), *keys, *args)
+        except NoScriptError:
+            self.script_reloads += 1
+            return await self.conn.evalsha(await self.load(name), len(keys), *keys, *args)
+
+
+class AsyncFunctionRegistry(AsyncScriptRegistry):
+    library_name: str
+
+    def __init__(self, conn: AsyncRedis, scripts: dict[str, str], schema_version: str):
+        super().__init__(conn, scripts)
+        self.library_name = get_library_name(scripts, schema_version)
+
+    async def load_all(self) -> None:
+        await self.load_library()
+        await self.delete_other_libraries()
+
+    async def load_library(self) -> None:
+        try:
+            await self.conn.function_load(get_library_code(self.library_name, self.scripts))
+        except ResponseError as error:
+            if not is_library_loaded_error(error):
+                raise
+
+    async def delete_other_libraries(self) -> None:
+        libraries = await self.conn.function_list(library=f"{LIBRARY_PREFIX}*")
+        for library_name in get_other_library_names(libraries, self.library_name):
+            try:
+                await self.conn.function_delete(library_name)
+            except ResponseError as error:
+                if not is_library_missing_error(error):
+                    raise
+
+    async def call(self, name: str, keys: list[str], args: list):
+        self.script_calls += 1
+
+        function_name = get_function_name(self.library_name, name)
+        try:
+            return await self.conn.fcall(function_name, len(keys), *keys, *args)
+        except ResponseError as error:
+            if not is_function_missing_error(error):
+                raise
+
+            self.script_reloads += 1
+            await self.load_library()
+            return await self.conn.fcall(function_name, len(keys), *keys, *args)
@@ -1,40 +1,55 @@
+import pickle
+from tempfile import TemporaryFile
+from typing import AsyncIterable, AsyncIterator, Callable, Hashable, IO, Iterable, Iterator
+
 from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
 
-from hash_db.models import TableDefinition, MetadataStore, TableDescriptor, Selector, ResultRow
+from hash_db.models import TableDefinition, MetadataStore, TableDescriptor, Selector, ResultRow, \
+    CompactResultRow
 from hash_db.config import ListRecordsType
+from hash_db.tools.tools import chunked, async_chunked
 
 
 class TableIterator:
     conn: Redis
     table: TableDefinition
     metadata_store: MetadataStore
+    # Cursor of SCAN or SSCAN, it is updated after every fully yielded reply, so iteration interrupted
+    # between replies can be resumed by new iterator created with this cursor. Identifiers of reply
+    # interrupted in the middle are yielded again after resuming
+    cursor: int
+    completed: bool
 
-    def __init__(self, conn: Redis, metadata_store: MetadataStore, table: TableDescriptor):
+    def __init__(self, conn: Redis, metadata_store: MetadataStore, table: TableDescriptor, cursor: int = 0):
         self.conn = conn
         self.table = metadata_store.get_table_by_name(table)
         self.metadata_store = metadata_store
+        self.cursor = cursor
+        self.completed = False
+
+    def get_key_prefix(self) -> str:
+        return self.table.get_key_prefix(self.metadata_store.config.storage_layout)
 
-    @staticmethod
-    def extract_key_identifier(key):
-        return ":".join(key.split(":")[3:])
+    def extract_key_identifier(self, key):
+        return key[len(self.get_key_prefix()) + 1:]
 
     # Iterating with SCAN
     # https://redis.io/docs/latest/commands/scan/
     def scan_generator(self):
-        pattern = self.table.get_field_key_prefix() + ":*"
+        pattern = self.get_key_prefix() + ":*"
 
-        cursor = 0
-        while True:
-            cursor, keys = self.conn.scan(cursor=cursor, match=pattern)
+        while not self.completed:
+            cursor, keys = self.conn.scan(cursor=self.cursor, match=pattern,
+                                          count=self.metadata_store.config.scan_count)
             for key in keys:
                 yield self.extract_key_identifier(key)
-            if cursor == 0:
-                break
+            self.advance(cursor)
 
     # Iterating with KEYS
     # https://redis.io/docs/latest/commands/keys/
     def keys_generator(self):
-        pattern = self.table.get_field_key_prefix() + ":*"
+        pattern = self.get_key_prefix() + ":*"
 
         for key in self.conn.keys(pattern=pattern):
             yield self.extract_key_identifier(key)
@@ -44,21 +59,118 @@ class TableIterator:
         for key in self.conn.smembers(self.table.get_table_key()):
             yield key
 
-    def __iter__(self):
+    # Iterating set of all keys that belong to table with SSCAN, every reply has about scan_count identifiers
+    # https://redis.io/docs/latest/commands/sscan/
+    def sscan_generator(self):
+        while not self.completed:
+            cursor, keys = self.conn.sscan(self.table.get_table_key(), cursor=self.cursor,
+                                           count=self.metadata_store.config.scan_count)
+            yield from keys
+            self.advance(cursor)
+
+    def advance(self, cursor: int) -> None:
+        self.cursor = cursor
+        self.completed = cursor == 0
+
+    def get_generators(self) -> dict:
         return {
             ListRecordsType.SCAN: self.scan_generator,
             ListRecordsType.KEYS: self.keys_generator,
-            ListRecordsType.SET: self.set_generator
-        }[self.metadata_store.config.list_records_type]()
+            ListRecordsType.SET: self.set_generator,
+            ListRecordsType.SSCAN: self.sscan_generator
+        }
+
+    def __iter__(self):
+        return self.get_generators()[self.metadata_store.config.list_records_type]()
+
+    def chunks(self) -> Iterator[list[str]]:
+        return chunked(self, self.metadata_store.config.scan_chunk_size)
+
+
+class AsyncTableIterator(TableIterator):
+    conn: AsyncRedis
+
+    async def scan_generator(self):
+        pattern = self.get_key_prefix() + ":*"
+
+        while not self.completed:
+            cursor, keys = await self.conn.scan(cursor=self.cursor, match=pattern,
+                                                count=self.metadata_store.config.scan_count)
+            for key in keys:
+                yield self.extract_key_identifier(key)
+            self.advance(cursor)
+
+    async def keys_generator(self):
+        pattern = self.get_key_prefix() + ":*"
+
+        for key in await self.conn.keys(pattern=pattern):
+            yield self.extract_key_identifier(key)
+
+    async def set_generator(self):
+        for key in await self.conn.smembers(self.table.get_table_key()):
+            yield key
+
+    async def sscan_generator(self):
+        while not self.completed:
+            cursor, keys = await self.conn.sscan(self.table.get_table_key(), cursor=self.cursor,
+                                                 count=self.metadata_store.config.scan_count)
+            for key in keys:
+                yield key
+            self.advance(cursor)
+
+    def __iter__(self):
+        raise TypeError("AsyncTableIterator has to be iterated with async for")
+
+    def __aiter__(self):
+        return self.get_generators()[self.metadata_store.config.list_records_type]()
+
+    def chunks(self) -> AsyncIterator[list[str]]:
+        return async_chunked(self, self.metadata_store.config.scan_chunk_size)
+
+
+# Columns of result are resolved once per select in Selector.result_schema, so each row is projected
+# by walking that list of columns into tuple of plain values
+def select_projection(selector: Selector, result_row: ResultRow) -> CompactResultRow:
+    values = result_row.values
+    row = []
+
+    for alias, field in selector.result_schema.columns:
+        field_value = values[alias][field]
+        row.append(None if field_value is None else field_value.value)
 
+    return CompactResultRow(selector.result_schema, tuple(row))
 
-def select_projection(selector: Selector, result_row: ResultRow) -> ResultRow:
-    projected_values = dict()
 
-    for table, fields in selector.select_fields.items():
-        projected_values[table.get_alias()] = dict()
+def spill_to_partitions(records: Iterable[ResultRow], partition_key: Callable[[ResultRow], Hashable],
+                        partitions_count: int) -> list[IO[bytes]]:
+    partitions = [TemporaryFile() for _ in range(partitions_count)]
 
-        for field in fields:
-            projected_values[table.get_alias()][field] = result_row.values[table.get_alias()][field]
+    for record in records:
+        pickle.dump(record, partitions[hash(partition_key(record)) % partitions_count])
 
-    return ResultRow(projected_values)
+    for partition in partitions:
+        partition.seek(0)
+
+    return partitions
+
+
+async def async_spill_to_partitions(records: AsyncIterable[ResultRow], partition_key: Callable[[ResultRow], Hashable],
+                                    partitions_count: int) -> list[IO[bytes]]:
+    partitions = [TemporaryFile() for _ in range(partitions_count)]
+
+    async for record in records:
+        pickle.dump(record, partitions[hash(partition_key(record)) % partitions_count])
+
+    for partition in partitions:
+        partition.seek(0)
+
+    return partitions
+
+
+def read_partition(partition: IO[bytes]) -> Iterator[ResultRow]:
+    with partition:
+        while True:
+            try:
+                yield pickle.load(partition)
+            except EOFError:
+                return
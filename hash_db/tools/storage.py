@@ -0,0 +1,84 @@
+from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
+from redis.client import Pipeline
+
+from hash_db.models import TableDefinition, MetadataStore, FieldDescriptor
+from hash_db.config import StorageLayout
+
+
+# Field location is a pair of key and hash field, where empty hash field means plain string key
+def read_field(conn: Redis | Pipeline, key: str, hash_field: str) -> str | None:
+    if hash_field:
+        return conn.hget(key, hash_field)
+    return conn.get(key)
+
+
+def write_field(conn: Redis | Pipeline, key: str, hash_field: str, value: str) -> None:
+    if hash_field:
+        conn.hset(key, hash_field, value)
+    else:
+        conn.set(key, value)
+
+
+def delete_field(conn: Redis | Pipeline, key: str, hash_field: str) -> None:
+    if hash_field:
+        conn.hdel(key, hash_field)
+    else:
+        conn.delete(key)
+
+
+def get_field_keys(table: TableDefinition, key_identifiers: list[str], fields: list[FieldDescriptor]) -> list[str]:
+    key_prefixes = [table.get_field_key_prefix(field) for field in fields]
+
+    return [f"{key_prefix}:{key_identifier}" for key_identifier in key_identifiers for key_prefix in key_prefixes]
+
+
+def split_field_values(values: list[str | None], fields: list[FieldDescriptor]) -> list[list[str | None]]:
+    return [values[i:i + len(fields)] for i in range(0, len(values), len(fields))]
+
+
+# Fetching all fields of many records in single round trip
+# https://redis.io/docs/latest/commands/mget/
+# https://redis.io/docs/latest/commands/hmget/
+def fetch_field_values(conn: Redis, metadata_store: MetadataStore, table: TableDefinition, key_identifiers: list[str],
+                       fields: list[FieldDescriptor]) -> list[list[str | None]]:
+    if not fields or not key_identifiers:
+        return [[] for _ in key_identifiers]
+
+    if metadata_store.config.storage_layout == StorageLayout.HASH_PER_RECORD:
+        key_prefix = table.get_record_key_prefix()
+        field_names = [field.name for field in fields]
+
+        with conn.pipeline(transaction=False) as pipeline:
+            for key_identifier in key_identifiers:
+                pipeline.hmget(f"{key_prefix}:{key_identifier}", field_names)
+
+            return pipeline.execute()
+
+    return split_field_values(conn.mget(get_field_keys(table, key_identifiers, fields)), fields)
+
+
+# https://redis.io/docs/latest/commands/smismember/
+def check_table_membership(conn: Redis, table: TableDefinition, key_identifiers: list[str]) -> list[bool]:
+    if not key_identifiers:
+        return []
+
+    return [bool(is_member) for is_member in conn.smismember(table.get_table_key(), key_identifiers)]
+
+
+async def async_fetch_field_values(conn: AsyncRedis, metadata_store: MetadataStore, table: TableDefinition,
+                                   key_identifiers: list[str], fields: list[FieldDescriptor]) -> list[list[str | None]]:
+    if not fields or not key_identifiers:
+        return [[] for _ in key_identifiers]
+
+    if metadata_store.config.storage_layout == StorageLayout.HASH_PER_RECORD:
+        key_prefix = table.get_record_key_prefix()
+        field_names = [field.name for field in fields]
+
+        async with conn.pipeline(transaction=False) as pipeline:
+            for key_identifier in key_identifiers:
+                pipeline.hmget(f"{key_prefix}:{key_identifier}", field_names)
+
+            return await pipeline.execute()
+
+    return split_field_values(await conn.mget(get_field_keys(table, key_identifiers, fields)), fields)
@@ -1,9 +1,16 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from hashlib import sha256
+from itertools import islice
 from json import dumps
+from typing import AsyncIterable, AsyncIterator, Callable, Iterable, Iterator, TypeVar
 
 from hash_db.models import FieldDescriptor, FieldValue
 from hash_db.config import KeyPolicyType
 
+T = TypeVar("T")
+R = TypeVar("R")
+
 
 def json_key_policy(values: dict[FieldDescriptor, FieldValue | None]):
     values_dict = dict()
@@ -25,8 +32,57 @@ def key_policy(values: dict[FieldDescriptor, FieldValue | None]):
     return json_key_policy(values)
 
 
+KEY_GENERATORS = {
+    KeyPolicyType.JSON: json_key_policy,
+    KeyPolicyType.HASH: sha256_key_policy,
+}
+
+
 def get_key_generator(key_policy: KeyPolicyType):
-    return {
-        KeyPolicyType.JSON: json_key_policy,
-        KeyPolicyType.HASH: sha256_key_policy,
-    }[key_policy]
+    return KEY_GENERATORS[key_policy]
+
+
+def chunked(iterable: Iterable[T], chunk_size: int) -> Iterator[list[T]]:
+    iterator = iter(iterable)
+
+    while chunk := list(islice(iterator, chunk_size)):
+        yield chunk
+
+
+# Calls function for items in thread pool and yields results in order of items. At most twice as many calls
+# as workers are in flight, so input is read lazily and results do not pile up when consumer is slower
+def parallel_map(function: Callable[[T], R], iterable: Iterable[T], workers: int) -> Iterator[R]:
+    if workers <= 1:
+        yield from map(function, iterable)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+
+        try:
+            for item in iterable:
+                pending.append(executor.submit(function, item))
+
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().result()
+
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # consumer stopped early or call failed, calls which did not start yet are not needed
+            for future in pending:
+                future.cancel()
+
+
+async def async_chunked(iterable: AsyncIterable[T], chunk_size: int) -> AsyncIterator[list[T]]:
+    chunk = []
+
+    async for item in iterable:
+        chunk.append(item)
+
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
@@ -0,0 +1,242 @@
+import asyncio
+
+from dotenv import load_dotenv
+import os
+import pytest
+
+from hash_db import Core, AsyncCore, MetadataStore, TableDescriptor, TableDefinition, FieldDescriptor, \
+    FieldDefinition, FieldValue, TableRecord, Selector, SelectorConditionEquals, JoinStatement, CoreConfiguration, \
+    JoiningAlgorithm, StorageLayout, ListRecordsType, FunctionalDependency
+from hash_db.exceptions import DependencyBrokenException
+
+
+@pytest.fixture(params=[
+    CoreConfiguration(joining_algorithm=JoiningAlgorithm.NESTED_LOOPS),
+    CoreConfiguration(joining_algorithm=JoiningAlgorithm.HASH_JOIN),
+    CoreConfiguration(joining_algorithm=JoiningAlgorithm.HASH_JOIN, hash_join_memory_budget=1),
+    CoreConfiguration(joining_algorithm=JoiningAlgorithm.COST_BASED),
+    CoreConfiguration(scan_chunk_size=1),
+    CoreConfiguration(storage_layout=StorageLayout.HASH_PER_RECORD, list_records_type=ListRecordsType.SCAN),
+    CoreConfiguration(list_records_type=ListRecordsType.SSCAN, scan_count=1, scan_chunk_size=2)
+])
+def init_core(request):
+    load_dotenv()
+    redis_host = os.environ["REDIS_HOST"]
+    redis_port = os.environ["REDIS_PORT"]
+
+    table1 = TableDefinition(
+        table_descriptor=TableDescriptor("test_table_1"),
+        fields=[
+            FieldDefinition(FieldDescriptor("table1_primary_field_1"), primary_key=True),
+            FieldDefinition(FieldDescriptor("table1_field_1")),
+            FieldDefinition(FieldDescriptor("table1_field_2")),
+        ],
+        dependencies=[
+            FunctionalDependency(
+                determinants=[
+                    FieldDescriptor("table1_field_1")
+                ],
+                dependent=FieldDescriptor("table1_field_2")
+            )
+        ],
+        indexes=[
+            FieldDescriptor("table1_field_1")
+        ]
+    )
+
+    table2 = TableDefinition(
+        table_descriptor=TableDescriptor("test_table_2"),
+        fields=[
+            FieldDefinition(FieldDescriptor("table2_primary_field_1"), primary_key=True),
+            FieldDefinition(FieldDescriptor("table2_field_1")),
+        ]
+    )
+
+    metadata_store = MetadataStore(
+        tables=[
+            table1,
+            table2
+        ],
+        config=request.param
+    )
+
+    core = Core(
+        redis_host=redis_host,
+        redis_port=redis_port,
+        metadata_store=metadata_store,
+        clean_redis=True
+    )
+
+    for primary, field_1, field_2 in [("p1", "f1", "x"), ("p2", "f2", "y"), ("p3", "f1", "x"), ("p4", "f3", "z")]:
+        core.insert(TableRecord(
+            table_descriptor=TableDescriptor("test_table_1"),
+            values={
+                FieldDescriptor("table1_primary_field_1"): FieldValue(primary),
+                FieldDescriptor("table1_field_1"): FieldValue(field_1),
+                FieldDescriptor("table1_field_2"): FieldValue(field_2),
+            }
+        ))
+
+    for primary, field_1 in [("f1", "a"), ("f2", "b")]:
+        core.insert(TableRecord(
+            table_descriptor=TableDescriptor("test_table_2"),
+            values={
+                FieldDescriptor("table2_primary_field_1"): FieldValue(primary),
+                FieldDescriptor("table2_field_1"): FieldValue(field_1),
+            }
+        ))
+
+    yield core, redis_host, redis_port
+
+
+def get_join_selector(conditions=None):
+    return Selector(
+        select_fields={
+            TableDescriptor("test_table_1"): [
+                FieldDescriptor("table1_primary_field_1")
+            ],
+            TableDescriptor("test_table_2"): [
+                FieldDescriptor("table2_field_1")
+            ]
+        },
+        from_table=TableDescriptor("test_table_1"),
+        join_statements=[
+            JoinStatement(
+                base_fields=[(TableDescriptor("test_table_1"), FieldDescriptor("table1_field_1"))],
+                target_table=TableDescriptor("test_table_2"),
+                target_fields=[FieldDescriptor("table2_primary_field_1")]
+            )
+        ],
+        conditions=conditions or []
+    )
+
+
+def result_values(results):
+    return sorted(
+        tuple(sorted((alias, field.name, None if value is None else value.value)
+                     for alias, values in result.values.items() for field, value in values.items()))
+        for result in results
+    )
+
+
+async def collect(async_core: AsyncCore, selector: Selector):
+    return [result async for result in async_core.select(selector)]
+
+
+def test_select_matches_sync_core(init_core):
+    core, redis_host, redis_port = init_core
+
+    async def run():
+        async_core = await AsyncCore.create(redis_host, redis_port, core.metadata_store)
+        try:
+            return await collect(async_core, get_join_selector())
+        finally:
+            await async_core.close()
+
+    results = asyncio.run(run())
+
+    assert len(results) == 3
+    assert result_values(results) == result_values(core.select(get_join_selector()))
+
+
+def test_select_uses_indexes(init_core):
+    core, redis_host, redis_port = init_core
+
+    selector = get_join_selector([
+        SelectorConditionEquals(TableDescriptor("test_table_1"), FieldDescriptor("table1_field_1"), "f1")
+    ])
+
+    async def run():
+        async_core = await AsyncCore.create(redis_host, redis_port, core.metadata_store)
+        try:
+            return await collect(async_core, selector)
+        finally:
+            await async_core.close()
+
+    results = asyncio.run(run())
+
+    assert sorted(result.values["test_table_1"][FieldDescriptor("table1_primary_field_1")].value
+                  for result in results) == ["p1", "p3"]
+
+
+def test_insert_and_delete(init_core):
+    core, redis_host, redis_port = init_core
+
+    record = TableRecord(
+        table_descriptor=TableDescriptor("test_table_1"),
+        values={
+            FieldDescriptor("table1_primary_field_1"): FieldValue("p5"),
+            FieldDescriptor("table1_field_1"): FieldValue("f2"),
+            FieldDescriptor("table1_field_2"): FieldValue("y"),
+        }
+    )
+    broken_record = TableRecord(
+        table_descriptor=TableDescriptor("test_table_1"),
+        values={
+            FieldDescriptor("table1_primary_field_1"): FieldValue("p6"),
+            FieldDescriptor("table1_field_1"): FieldValue("f2"),
+            FieldDescriptor("table1_field_2"): FieldValue("z"),
+        }
+    )
+
+    async def run():
+        async_core = await AsyncCore.create(redis_host, redis_port, core.metadata_store)
+        try:
+            await async_core.insert(record)
+            with pytest.raises(DependencyBrokenException):
+                await async_core.insert(broken_record)
+
+            inserted = await collect(async_core, get_join_selector())
+            await async_core.delete(record)
+            deleted = await collect(async_core, get_join_selector())
+
+            return inserted, deleted
+        finally:
+            await async_core.close()
+
+    inserted, deleted = asyncio.run(run())
+
+    assert len(inserted) == 4
+    assert len(deleted) == 3
+    assert result_values(deleted) == result_values(core.select(get_join_selector()))
+
+
+def test_delete_where(init_core):
+    core, redis_host, redis_port = init_core
+
+    selector = Selector(
+        select_fields={},
+        from_table=TableDescriptor("test_table_1"),
+        join_statements=[],
+        conditions=[
+            SelectorConditionEquals(TableDescriptor("test_table_1"), FieldDescriptor("table1_field_1"), "f1")
+        ]
+    )
+
+    async def run():
+        async_core = await AsyncCore.create(redis_host, redis_port, core.metadata_store)
+        try:
+            return await async_core.delete_where(selector, batch_size=1), await async_core.delete_where(selector)
+        finally:
+            await async_core.close()
+
+    assert asyncio.run(run()) == (2, 0)
+    assert list(core.select(selector)) == []
+
+
+def test_select_is_consumed_lazily(init_core):
+    core, redis_host, redis_port = init_core
+
+    async def run():
+        async_core = await AsyncCore.create(redis_host, redis_port, core.metadata_store)
+        try:
+            results = async_core.select(get_join_selector())
+            first_result = await anext(results)
+            await results.aclose()
+            return first_result
+        finally:
+            await async_core.close()
+
+    first_result = asyncio.run(run())
+
+    assert set(first_result.values) == {"test_table_1", "test_table_2"}
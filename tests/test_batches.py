@@ -0,0 +1,53 @@
+from array import array
+from sys import byteorder
+
+import pytest
+
+from hash_db import ResultSchema, FieldDescriptor
+from hash_db.tools.batches import ColumnBatch, get_arrow_buffers
+
+
+def test_arrow_buffers_layout():
+    buffers = get_arrow_buffers(["ab", None, "", "ćd"])
+
+    offsets = array("q")
+    offsets.frombytes(buffers.offsets)
+    if byteorder == "big":
+        offsets.byteswap()
+
+    assert buffers.length == 4
+    assert buffers.null_count == 1
+    assert buffers.validity == bytes([0b1101])
+    assert list(offsets) == [0, 2, 2, 2, 5]
+    assert buffers.data == "abćd".encode()
+
+
+def test_arrow_buffers_without_nulls_have_no_validity():
+    buffers = get_arrow_buffers(["a", "b"])
+
+    assert buffers.null_count == 0
+    assert buffers.validity is None
+
+
+def test_batch_converts_to_arrow():
+    pyarrow = pytest.importorskip("pyarrow")
+
+    schema = ResultSchema([("table", FieldDescriptor("field_1")), ("table", FieldDescriptor("field_2"))])
+    batch = ColumnBatch(schema, [["a", None, "c"], ["1", "2", "3"]])
+
+    record_batch = batch.to_arrow()
+
+    assert record_batch.schema.names == ["table.field_1", "table.field_2"]
+    assert record_batch.column(0).to_pylist() == ["a", None, "c"]
+    assert record_batch.column(1).type == pyarrow.large_string()
+
+
+def test_batch_converts_to_numpy():
+    pytest.importorskip("numpy")
+
+    schema = ResultSchema([("table", FieldDescriptor("field_1"))])
+    batch = ColumnBatch(schema, [["a", None]])
+
+    column, = batch.to_numpy()
+
+    assert column.tolist() == ["a", None]
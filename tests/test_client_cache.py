@@ -0,0 +1,164 @@
+from dotenv import load_dotenv
+import os
+from time import sleep
+
+import pytest
+from redis import Redis
+from redis.cache import CacheConfig, CacheEntry, CacheEntryStatus, CacheKey
+from redis.exceptions import RedisError
+
+from hash_db import Core, MetadataStore, TableDescriptor, TableDefinition, FieldDescriptor, FieldDefinition, FieldValue, \
+    TableRecord, CoreConfiguration, Selector
+from hash_db.tools.client_cache import ClientCache
+
+
+def create_table(name: str) -> TableDefinition:
+    return TableDefinition(
+        table_descriptor=TableDescriptor(name),
+        fields=[
+            FieldDefinition(FieldDescriptor("primary_field_1"), primary_key=True),
+            FieldDefinition(FieldDescriptor("field_1"))
+        ],
+        indexes=[
+            FieldDescriptor("field_1")
+        ]
+    )
+
+
+def cache_reply(cache: ClientCache, command: str, *keys: str) -> CacheKey:
+    cache_key = CacheKey(command=command, redis_keys=keys, redis_args=(command, *keys))
+    cache.set(CacheEntry(cache_key=cache_key, cache_value=b"reply", status=CacheEntryStatus.VALID,
+                         connection_ref=None))
+    return cache_key
+
+
+def test_replies_of_written_tables_are_invalidated():
+    client_cache = ClientCache(CacheConfig(max_size=10), [create_table("table_1"), create_table("table_2")])
+
+    field_reply = cache_reply(client_cache, "MGET", "__value__:table_1:field_1:p1", "__value__:table_1:field_1:p2")
+    membership_reply = cache_reply(client_cache, "SMISMEMBER", "__table_keys__:table_1")
+    index_reply = cache_reply(client_cache, "SMEMBERS", "__secondary_index__:table_1:field_1:a")
+    other_reply = cache_reply(client_cache, "MGET", "__value__:table_2:field_1:p1")
+
+    client_cache.invalidate_tables([create_table("table_1")])
+
+    assert client_cache.get(field_reply) is None
+    assert client_cache.get(membership_reply) is None
+    assert client_cache.get(index_reply) is None
+    assert client_cache.get(other_reply) is not None
+    assert client_cache.size == 1
+
+
+def test_replies_are_invalidated_by_redis_keys():
+    client_cache = ClientCache(CacheConfig(max_size=2), [create_table("table_1")])
+
+    evicted_reply = cache_reply(client_cache, "GET", "__value__:table_1:field_1:p0")
+    field_reply = cache_reply(client_cache, "MGET", "__value__:table_1:field_1:p1", "__value__:table_1:field_1:p2")
+    membership_reply = cache_reply(client_cache, "SMISMEMBER", "__table_keys__:table_1")
+
+    assert client_cache.get(evicted_reply) is None
+    assert "__value__:table_1:field_1:p0" not in client_cache.replies_by_key
+
+    # invalidation sent by redis can name many keys of one reply
+    assert client_cache.delete_by_redis_keys([b"__value__:table_1:field_1:p1", b"__value__:table_1:field_1:p2"]) \
+           == [True]
+
+    assert client_cache.get(field_reply) is None
+    assert client_cache.get(membership_reply) is not None
+    assert client_cache.replies_by_table["table_1"] == {membership_reply}
+
+
+def test_hits_and_misses_are_counted():
+    client_cache = ClientCache(CacheConfig(max_size=10), [create_table("table_1")])
+    cache_key = CacheKey(command="MGET", redis_keys=("__value__:table_1:field_1:p1",),
+                         redis_args=("MGET", "__value__:table_1:field_1:p1"))
+
+    # connection sends command to redis and caches placeholder, until reply is read
+    assert client_cache.is_cachable(CacheKey(command="MGET", redis_keys=()))
+    assert client_cache.get(cache_key) is None
+    client_cache.set(CacheEntry(cache_key=cache_key, cache_value=b"", status=CacheEntryStatus.IN_PROGRESS,
+                                connection_ref=None))
+    client_cache.set(CacheEntry(cache_key=cache_key, cache_value=b"reply", status=CacheEntryStatus.VALID,
+                                connection_ref=None))
+
+    # cached reply is returned without sending command
+    for _ in range(2):
+        assert client_cache.is_cachable(CacheKey(command="MGET", redis_keys=()))
+        assert client_cache.get(cache_key).cache_value == b"reply"
+
+    # write commands are not looked up
+    assert not client_cache.is_cachable(CacheKey(command="SET", redis_keys=()))
+
+    assert client_cache.misses == 1
+    assert client_cache.hits == 2
+
+
+def test_client_cache_serves_selects_and_sees_writes():
+    load_dotenv()
+    redis_host = os.environ["REDIS_HOST"]
+    redis_port = os.environ["REDIS_PORT"]
+
+    # client side caching needs RESP3 and client tracking, which test server may not support
+    try:
+        core = Core(
+            redis_host=redis_host,
+            redis_port=redis_port,
+            metadata_store=MetadataStore(
+                tables=[
+                    create_table("test_table")
+                ],
+                config=CoreConfiguration(client_cache_size=100)
+            ),
+            clean_redis=True
+        )
+    except RedisError as error:
+        pytest.skip(f"server does not support client side caching: {error}")
+
+    core.insert_many([TableRecord(
+        table_descriptor=TableDescriptor("test_table"),
+        values={
+            FieldDescriptor("primary_field_1"): FieldValue(f"p{i}"),
+            FieldDescriptor("field_1"): FieldValue("a")
+        }
+    ) for i in range(3)])
+
+    selector = Selector(
+        select_fields={
+            TableDescriptor("test_table"): [
+                FieldDescriptor("primary_field_1"),
+                FieldDescriptor("field_1")
+            ]
+        },
+        from_table=TableDescriptor("test_table"),
+        join_statements=[],
+        conditions=[]
+    )
+
+    def select_all() -> dict[str, str]:
+        return {result[0]: result[1] for result in core.select(selector)}
+
+    assert select_all() == {"p0": "a", "p1": "a", "p2": "a"}
+    assert core.cache.size > 0
+    assert select_all() == {"p0": "a", "p1": "a", "p2": "a"}
+    assert core.cache.hits > 0
+
+    # write through the same Core is seen right away
+    core.update(TableRecord(
+        table_descriptor=TableDescriptor("test_table"),
+        values={FieldDescriptor("primary_field_1"): FieldValue("p1")}
+    ), {FieldDescriptor("field_1"): FieldValue("b")})
+
+    assert select_all()["p1"] == "b"
+
+    # write of other client is seen once redis sends invalidation
+    other_conn = Redis(host=redis_host, port=redis_port, decode_responses=True)
+    field_key, _ = core.metadata_store.get_table_by_name(TableDescriptor("test_table")).get_field_location(
+        core.metadata_store.config.storage_layout, FieldDescriptor("field_1"), '{"primary_field_1":"p2"}')
+    other_conn.set(field_key, "c")
+
+    for _ in range(100):
+        if select_all()["p2"] == "c":
+            break
+        sleep(0.01)
+
+    assert select_all()["p2"] == "c"
@@ -3,7 +3,8 @@ import os
 import pytest
 
 from hash_db import Core, MetadataStore, TableDescriptor, TableDefinition, FieldDescriptor, FieldDefinition, FieldValue, \
-    FunctionalDependency, TableRecord
+    FunctionalDependency, TableRecord, StorageLayout, DeleteType, InsertType, Selector, SelectorConditionEquals, \
+    JoinStatement, CoreConfiguration
 
 
 @pytest.fixture()
@@ -26,6 +27,9 @@ def init_core():
                 ],
                 dependent=FieldDescriptor("field_1")
             ),
+        ],
+        indexes=[
+            FieldDescriptor("field_2")
         ]
     )
 
@@ -86,6 +90,18 @@ def test_functional_dependency_indexes_are_cleared(init_core):
                                    f'__value__:test_table:field_1:{key_identifier}')
 
 
+def test_secondary_index_is_cleared(init_core):
+    core, basic_record = init_core
+
+    core.insert(basic_record)
+
+    assert core.conn.sismember('__secondary_index__:test_table:field_2:f2', '{"primary_field_1":"p1"}')
+
+    core.delete(basic_record)
+
+    assert not core.conn.exists('__secondary_index__:test_table:field_2:f2')
+
+
 def test_row_cleared_from_table_index(init_core):
     core, basic_record = init_core
 
@@ -98,3 +114,252 @@ def test_row_cleared_from_table_index(init_core):
     core.delete(basic_record)
 
     assert not core.conn.sismember('__table_keys__:test_table', key_identifier)
+
+
+def test_record_per_hash_layout_is_deleted(init_core):
+    core, basic_record = init_core
+    core.metadata_store.config.storage_layout = StorageLayout.HASH_PER_RECORD
+
+    core.insert(basic_record)
+
+    key_identifier = '{"primary_field_1":"p1"}'
+
+    assert core.conn.exists(f'__record__:test_table:{key_identifier}')
+
+    core.delete(basic_record)
+
+    assert not core.conn.exists(f'__record__:test_table:{key_identifier}')
+    assert not core.conn.exists('__dependency_index__:primary_field_1=>field_1:{"primary_field_1":"p1"}')
+    assert not core.conn.sismember('__table_keys__:test_table', key_identifier)
+
+
+@pytest.mark.parametrize("delete_type", list(DeleteType))
+def test_dependency_value_is_cleared_with_last_member(init_core, delete_type):
+    core, basic_record = init_core
+    core.metadata_store.config.delete_type = delete_type
+
+    core.insert(basic_record)
+
+    dependency_value_key = '__dependency_value__:primary_field_1=>field_1:{"primary_field_1":"p1"}'
+
+    assert core.conn.get(dependency_value_key) == "f1"
+
+    core.delete(basic_record)
+
+    assert not core.conn.exists(dependency_value_key)
+
+
+def create_records(count: int) -> list[TableRecord]:
+    return [TableRecord(
+        table_descriptor=TableDescriptor("test_table"),
+        values={
+            FieldDescriptor("primary_field_1"): FieldValue(f"p{i}"),
+            FieldDescriptor("field_1"): FieldValue(f"f{i}"),
+            FieldDescriptor("field_2"): FieldValue(f"group_{i % 2}"),
+        }
+    ) for i in range(count)]
+
+
+@pytest.mark.parametrize("delete_type", list(DeleteType))
+def test_many_records_are_deleted_in_batches(init_core, delete_type):
+    core, basic_record = init_core
+    core.metadata_store.config.delete_type = delete_type
+
+    records = create_records(5)
+    core.insert_many(records)
+
+    assert core.delete_many(records[:3], batch_size=2) == 3
+    # records which are already deleted are not counted
+    assert core.delete_many(records, batch_size=2) == 2
+
+    assert not core.conn.exists('__table_keys__:test_table')
+    assert not core.conn.keys('__value__:*')
+    assert not core.conn.keys('__dependency_index__:*')
+    assert not core.conn.keys('__dependency_value__:*')
+    assert not core.conn.keys('__secondary_index__:*')
+    assert not core.conn.keys('__record_links__:*')
+
+
+@pytest.mark.parametrize("storage_layout", list(StorageLayout))
+def test_records_matching_selector_are_deleted(init_core, storage_layout):
+    core, basic_record = init_core
+    core.metadata_store.config.storage_layout = storage_layout
+
+    core.insert_many(create_records(6))
+
+    selector = Selector(
+        select_fields={},
+        from_table=TableDescriptor("test_table"),
+        join_statements=[],
+        conditions=[
+            SelectorConditionEquals(TableDescriptor("test_table"), FieldDescriptor("field_2"), "group_0")
+        ]
+    )
+
+    assert core.delete_where(selector, batch_size=2) == 3
+    assert core.delete_where(selector) == 0
+
+    assert core.conn.smembers('__table_keys__:test_table') == {
+        f'{{"primary_field_1":"p{i}"}}' for i in [1, 3, 5]
+    }
+    assert not core.conn.exists('__secondary_index__:test_table:field_2:group_0')
+
+
+def test_self_joined_records_are_read_before_delete(init_core):
+    core, basic_record = init_core
+
+    core.insert_many(create_records(4))
+
+    # every record joins with itself, so every one of them is deleted
+    selector = Selector(
+        select_fields={
+            TableDescriptor("test_table"): [FieldDescriptor("primary_field_1")]
+        },
+        from_table=TableDescriptor("test_table"),
+        join_statements=[
+            JoinStatement(
+                base_fields=[(TableDescriptor("test_table"), FieldDescriptor("primary_field_1"))],
+                target_table=TableDescriptor("test_table", "same_table"),
+                target_fields=[FieldDescriptor("primary_field_1")]
+            )
+        ],
+        conditions=[]
+    )
+
+    assert core.delete_where(selector, batch_size=1) == 4
+    assert not core.conn.exists('__table_keys__:test_table')
+
+
+def assert_table_is_empty(core: Core):
+    for pattern in ['__table_keys__:*', '__value__:*', '__record__:*', '__record_links__:*', '__dependency_index__:*',
+                    '__dependency_value__:*', '__secondary_index__:*']:
+        assert not core.conn.keys(pattern)
+
+
+def get_primary_key_record(record: TableRecord) -> TableRecord:
+    return TableRecord(
+        table_descriptor=record.table_descriptor,
+        values={FieldDescriptor("primary_field_1"): record.values[FieldDescriptor("primary_field_1")]}
+    )
+
+
+@pytest.mark.parametrize("insert_type", list(InsertType))
+@pytest.mark.parametrize("storage_layout", list(StorageLayout))
+def test_record_is_deleted_by_primary_key(init_core, insert_type, storage_layout):
+    core, basic_record = init_core
+    core.metadata_store.config.insert_type = insert_type
+    core.metadata_store.config.storage_layout = storage_layout
+    core.metadata_store.config.delete_type = DeleteType.REDIS_SCRIPT_BY_KEY
+
+    core.insert(basic_record)
+
+    assert core.conn.exists('__record_links__:test_table:{"primary_field_1":"p1"}')
+
+    assert core.delete(get_primary_key_record(basic_record)) == 1
+    assert core.delete(get_primary_key_record(basic_record)) == 0
+
+    assert_table_is_empty(core)
+
+
+@pytest.mark.parametrize("insert_type", list(InsertType))
+def test_links_are_replaced_by_reinsert(init_core, insert_type):
+    core, basic_record = init_core
+    core.metadata_store.config.insert_type = insert_type
+
+    for _ in range(5):
+        core.insert(basic_record)
+
+    # one dependency index and one secondary index, stored as triples
+    assert core.conn.llen('__record_links__:test_table:{"primary_field_1":"p1"}') == 6
+
+
+@pytest.mark.parametrize("insert_type", list(InsertType))
+def test_reinserted_record_is_deleted_by_primary_key(insert_type):
+    load_dotenv()
+
+    table = TableDefinition(
+        table_descriptor=TableDescriptor("dependency_table"),
+        fields=[
+            FieldDefinition(FieldDescriptor("primary_field_1"), primary_key=True),
+            FieldDefinition(FieldDescriptor("field_1")),
+            FieldDefinition(FieldDescriptor("field_2"))
+        ],
+        dependencies=[
+            FunctionalDependency(
+                determinants=[
+                    FieldDescriptor("field_1")
+                ],
+                dependent=FieldDescriptor("field_2")
+            ),
+        ]
+    )
+    core = Core(
+        redis_host=os.environ["REDIS_HOST"],
+        redis_port=os.environ["REDIS_PORT"],
+        metadata_store=MetadataStore(
+            tables=[
+                table
+            ],
+            config=CoreConfiguration(insert_type=insert_type, delete_type=DeleteType.REDIS_SCRIPT_BY_KEY)
+        ),
+        clean_redis=True
+    )
+
+    def create_record(primary_key: str, field_1: str, field_2: str) -> TableRecord:
+        return TableRecord(
+            table_descriptor=TableDescriptor("dependency_table"),
+            values={
+                FieldDescriptor("primary_field_1"): FieldValue(primary_key),
+                FieldDescriptor("field_1"): FieldValue(field_1),
+                FieldDescriptor("field_2"): FieldValue(field_2),
+            }
+        )
+
+    core.insert(create_record("p1", "x", "y"))
+    core.insert(create_record("p1", "z", "w"))
+
+    # membership of the old version is gone together with its dependent value
+    assert not core.conn.exists('__dependency_index__:field_1=>field_2:{"field_1":"x"}')
+    assert core.conn.llen('__record_links__:dependency_table:{"primary_field_1":"p1"}') == 3
+
+    assert core.delete(create_record("p1", "z", "w")) == 1
+
+    core.insert(create_record("p2", "x", "v"))
+
+    assert core.conn.get('__value__:dependency_table:field_2:{"primary_field_1":"p2"}') == "v"
+    assert not core.conn.exists('__dependency_index__:field_1=>field_2:{"field_1":"z"}')
+
+
+def test_record_without_links_is_deleted_by_primary_key(init_core):
+    core, basic_record = init_core
+    core.metadata_store.config.delete_type = DeleteType.REDIS_SCRIPT_BY_KEY
+
+    records = create_records(3)
+    core.insert_many(records)
+
+    # record inserted before links were stored
+    core.conn.delete('__record_links__:test_table:{"primary_field_1":"p1"}')
+
+    assert core.delete_many([get_primary_key_record(record) for record in records]) == 3
+
+    assert_table_is_empty(core)
+
+
+def test_records_matching_selector_are_deleted_by_primary_key(init_core):
+    core, basic_record = init_core
+    core.metadata_store.config.delete_type = DeleteType.REDIS_SCRIPT_BY_KEY
+
+    core.insert_many(create_records(4))
+
+    selector = Selector(
+        select_fields={},
+        from_table=TableDescriptor("test_table"),
+        join_statements=[],
+        conditions=[
+            SelectorConditionEquals(TableDescriptor("test_table"), FieldDescriptor("field_2"), "group_1")
+        ]
+    )
+
+    assert core.delete_where(selector) == 2
+    assert core.conn.smembers('__table_keys__:test_table') == {'{"primary_field_1":"p0"}', '{"primary_field_1":"p2"}'}
+    assert not core.conn.exists('__record_links__:test_table:{"primary_field_1":"p1"}')
@@ -1,10 +1,15 @@
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 import os
 import pytest
+from redis import Redis
+from redis.exceptions import ResponseError
 
 from hash_db import Core, MetadataStore, TableDescriptor, TableDefinition, FieldDescriptor, FieldDefinition, FieldValue, \
-    FunctionalDependency, TableRecord
+    FunctionalDependency, TableRecord, StorageLayout, InsertType, CoreConfiguration, ScriptType
 from hash_db.exceptions import DependencyBrokenException
+from hash_db.extensions.insertion import INSERT_SCRIPTS
+from hash_db.tools.scripts import get_library_name, get_library_code, LIBRARY_PREFIX
 
 
 @pytest.fixture()
@@ -36,6 +41,9 @@ def init_core():
                 ],
                 dependent=FieldDescriptor("field_3")
             )
+        ],
+        indexes=[
+            FieldDescriptor("field_2")
         ]
     )
 
@@ -91,6 +99,62 @@ def test_functional_dependency_indexes_are_set(init_core):
                                f'__value__:test_table:field_3:{key_identifier}')
 
 
+@pytest.mark.parametrize("insert_type", list(InsertType))
+def test_dependent_value_is_checked_using_companion_key(init_core, insert_type):
+    core, basic_record = init_core
+    core.metadata_store.config.insert_type = insert_type
+
+    core.insert(basic_record)
+
+    dependency_value_key = '__dependency_value__:field_1&field_2=>field_3:{"field_1":"f1","field_2":"f2"}'
+    assert core.conn.get(dependency_value_key) == "f3"
+
+    # dependency is checked against companion key, not against values of records in the index
+    core.conn.set(dependency_value_key, "other")
+
+    with pytest.raises(DependencyBrokenException):
+        core.insert(TableRecord(
+            table_descriptor=TableDescriptor("test_table"),
+            values={
+                FieldDescriptor("primary_field_1"): FieldValue("p3"),
+                FieldDescriptor("primary_field_2"): FieldValue("p2"),
+                FieldDescriptor("field_1"): FieldValue("f1"),
+                FieldDescriptor("field_2"): FieldValue("f2"),
+                FieldDescriptor("field_3"): FieldValue("f3"),
+            }
+        ))
+
+
+def test_dependent_value_falls_back_to_index_members(init_core):
+    core, basic_record = init_core
+
+    core.insert(basic_record)
+    # dependency index created before companion keys were introduced
+    core.conn.delete('__dependency_value__:field_1&field_2=>field_3:{"field_1":"f1","field_2":"f2"}')
+
+    with pytest.raises(DependencyBrokenException):
+        core.insert(TableRecord(
+            table_descriptor=TableDescriptor("test_table"),
+            values={
+                FieldDescriptor("primary_field_1"): FieldValue("p3"),
+                FieldDescriptor("primary_field_2"): FieldValue("p2"),
+                FieldDescriptor("field_1"): FieldValue("f1"),
+                FieldDescriptor("field_2"): FieldValue("f2"),
+                FieldDescriptor("field_3"): FieldValue("other"),
+            }
+        ))
+
+
+def test_secondary_index_is_set(init_core):
+    core, basic_record = init_core
+
+    core.insert(basic_record)
+
+    key_identifier = '{"primary_field_1":"p1","primary_field_2":"p2"}'
+
+    assert core.conn.smembers('__secondary_index__:test_table:field_2:f2') == {key_identifier}
+
+
 def test_row_added_to_table_index(init_core):
     core, basic_record = init_core
 
@@ -180,3 +244,242 @@ def test_multiple_inserts_without_breaking_functional_dependency(init_core):
             FieldDescriptor("field_3"): FieldValue("f3 prim2"),
         }
     ))
+
+
+def test_insert_many_reports_broken_records(init_core):
+    core, basic_record = init_core
+
+    results = core.insert_many([
+        basic_record,
+        TableRecord(
+            table_descriptor=TableDescriptor("test_table"),
+            values={
+                FieldDescriptor("primary_field_1"): FieldValue("p1"),
+                FieldDescriptor("primary_field_2"): FieldValue("p2 prim"),
+                FieldDescriptor("field_1"): FieldValue("f1 prim"),
+                FieldDescriptor("field_2"): FieldValue("f2"),
+                FieldDescriptor("field_3"): FieldValue("f3"),
+            }
+        ),
+        TableRecord(
+            table_descriptor=TableDescriptor("test_table"),
+            values={
+                FieldDescriptor("primary_field_1"): FieldValue("p1 prim"),
+                FieldDescriptor("primary_field_2"): FieldValue("p2"),
+                FieldDescriptor("field_1"): FieldValue("f1"),
+                FieldDescriptor("field_2"): FieldValue("f2"),
+                FieldDescriptor("field_3"): FieldValue("f3"),
+            }
+        )
+    ], batch_size=2)
+
+    assert results[0] is None
+    assert isinstance(results[1], DependencyBrokenException)
+    assert results[2] is None
+
+    assert core.conn.sismember('__table_keys__:test_table', '{"primary_field_1":"p1","primary_field_2":"p2"}')
+    assert not core.conn.sismember('__table_keys__:test_table', '{"primary_field_1":"p1","primary_field_2":"p2 prim"}')
+    assert core.conn.sismember('__table_keys__:test_table', '{"primary_field_1":"p1 prim","primary_field_2":"p2"}')
+
+
+def test_scripts_are_called_by_sha(init_core):
+    core, basic_record = init_core
+
+    core.insert(basic_record)
+    core.insert_many([basic_record, basic_record])
+
+    assert core.scripts.script_calls == 2
+    assert core.scripts.script_reloads == 0
+
+    core.conn.script_flush()
+    core.insert(basic_record)
+
+    assert core.scripts.script_calls == 3
+    assert core.scripts.script_reloads == 1
+
+
+def test_function_library_is_versioned_by_schema(init_core):
+    core, _ = init_core
+    metadata_store = core.metadata_store
+    library_name = get_library_name(INSERT_SCRIPTS, metadata_store.get_schema_version())
+    code = get_library_code(library_name, INSERT_SCRIPTS)
+
+    assert code.startswith(f"#!lua name={library_name}\n")
+    assert f"redis.register_function('{library_name}_insert_records', insert_records)" in code
+    assert get_library_name(INSERT_SCRIPTS, metadata_store.get_schema_version()) == library_name
+
+    metadata_store.config.storage_layout = StorageLayout.HASH_PER_RECORD
+    assert get_library_name(INSERT_SCRIPTS, metadata_store.get_schema_version()) != library_name
+
+
+def test_scripts_are_called_as_functions(init_core):
+    core, basic_record = init_core
+    metadata_store = core.metadata_store
+    metadata_store.config.script_type = ScriptType.FUNCTION
+
+    try:
+        core = Core(redis_host=os.environ["REDIS_HOST"], redis_port=os.environ["REDIS_PORT"],
+                    metadata_store=metadata_store)
+    except ResponseError:
+        pytest.skip("server does not support Redis Functions")
+
+    core.insert(basic_record)
+    assert core.scripts.script_calls == 1
+
+    core.conn.function_flush()
+    core.insert_many([basic_record])
+
+    assert core.scripts.script_calls == 2
+    assert core.scripts.script_reloads == 1
+    assert core.conn.sismember('__table_keys__:test_table', '{"primary_field_1":"p1","primary_field_2":"p2"}')
+
+
+@pytest.fixture()
+def fake_functions(monkeypatch):
+    # test server may not support Redis Functions, so libraries are kept here and functions are run by EVAL
+    libraries: dict[str, str] = {f"{LIBRARY_PREFIX}0000000000000000": ""}
+
+    def function_load(conn: Redis, code: str, replace: bool = False):
+        library_name = code.split("\n", 1)[0].removeprefix("#!lua name=")
+        if library_name in libraries:
+            raise ResponseError(f"Library '{library_name}' already exists")
+        libraries[library_name] = code
+        return library_name
+
+    def function_list(conn: Redis, library: str = "*", withcode: bool = False):
+        return [["library_name", library_name, "engine", "LUA"] for library_name in libraries
+                if library_name.startswith(library.removesuffix("*"))]
+
+    def function_delete(conn: Redis, library: str):
+        if libraries.pop(library, None) is None:
+            raise ResponseError("Library not found")
+        return True
+
+    def fcall(conn: Redis, function: str, numkeys: int, *keys_and_args):
+        code = next((code for code in libraries.values() if f"redis.register_function('{function}'," in code), None)
+        if code is None:
+            raise ResponseError("Function not found")
+
+        body = code.split("\n", 1)[1].replace("redis.register_function(", "register_function(")
+        return conn.eval("local functions = {}\n"
+                         "local function register_function(name, callback) functions[name] = callback end\n"
+                         f"{body}\nreturn functions['{function}'](KEYS, ARGV)", numkeys, *keys_and_args)
+
+    for command in [function_load, function_list, function_delete, fcall]:
+        monkeypatch.setattr(Redis, command.__name__, command)
+
+    return libraries
+
+
+def test_scripts_are_called_as_functions_of_library(init_core, fake_functions):
+    core, basic_record = init_core
+    metadata_store = core.metadata_store
+    metadata_store.config.script_type = ScriptType.FUNCTION
+
+    core = Core(redis_host=os.environ["REDIS_HOST"], redis_port=os.environ["REDIS_PORT"],
+                metadata_store=metadata_store)
+
+    # library of other version is deleted when client starts
+    assert list(fake_functions) == [core.scripts.library_name]
+
+    core.insert(basic_record)
+    core.update(basic_record, {FieldDescriptor("field_3"): FieldValue("f3")})
+
+    with pytest.raises(DependencyBrokenException):
+        core.insert(TableRecord(
+            table_descriptor=TableDescriptor("test_table"),
+            values={**basic_record.values, FieldDescriptor("primary_field_1"): FieldValue("p3"),
+                    FieldDescriptor("field_3"): FieldValue("other")}
+        ))
+
+    # library deleted by client of other version is loaded again, without deleting the other one
+    fake_functions.clear()
+    fake_functions[f"{LIBRARY_PREFIX}0000000000000000"] = ""
+    assert core.delete(basic_record) == 1
+
+    assert core.scripts.script_reloads == 1
+    assert len(fake_functions) == 2
+    assert not core.conn.exists('__table_keys__:test_table')
+
+
+def test_record_per_hash_layout(init_core):
+    core, basic_record = init_core
+    core.metadata_store.config.storage_layout = StorageLayout.HASH_PER_RECORD
+
+    core.insert(basic_record)
+
+    key_identifier = '{"primary_field_1":"p1","primary_field_2":"p2"}'
+
+    assert core.conn.hgetall(f'__record__:test_table:{key_identifier}') == {
+        "primary_field_1": "p1",
+        "primary_field_2": "p2",
+        "field_1": "f1",
+        "field_2": "f2",
+        "field_3": "f3",
+    }
+    assert core.conn.sismember('__dependency_index__:field_1&field_2=>field_3:{"field_1":"f1","field_2":"f2"}',
+                               f'__record__:test_table:{key_identifier}')
+
+    with pytest.raises(DependencyBrokenException):
+        core.insert(TableRecord(
+            table_descriptor=TableDescriptor("test_table"),
+            values={
+                FieldDescriptor("primary_field_1"): FieldValue("p1 prim"),
+                FieldDescriptor("primary_field_2"): FieldValue("p2"),
+                FieldDescriptor("field_1"): FieldValue("f1"),
+                FieldDescriptor("field_2"): FieldValue("f2"),
+                FieldDescriptor("field_3"): FieldValue("f3 prim"),
+            }
+        ))
+
+
+# simple insert is not atomic, so only transactional and script inserts can be used concurrently
+@pytest.mark.parametrize("insert_type", [InsertType.TRANSACTIONAL, InsertType.REDIS_SCRIPT])
+def test_core_is_shared_by_threads(init_core, insert_type):
+    core, basic_record = init_core
+    core.metadata_store.config.insert_type = insert_type
+
+    def insert_records(thread_id):
+        for i in range(20):
+            core.insert(TableRecord(
+                table_descriptor=TableDescriptor("test_table"),
+                values={
+                    FieldDescriptor("primary_field_1"): FieldValue(f"p{thread_id}_{i}"),
+                    FieldDescriptor("primary_field_2"): FieldValue("p2"),
+                    FieldDescriptor("field_1"): FieldValue(f"f{i % 3}"),
+                    FieldDescriptor("field_2"): FieldValue("f2"),
+                    FieldDescriptor("field_3"): FieldValue(f"f{i % 3}"),
+                }
+            ))
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(insert_records, range(8)))
+
+    assert core.conn.scard("__table_keys__:test_table") == 160
+    assert core.conn.scard("__secondary_index__:test_table:field_2:f2") == 160
+    if insert_type == InsertType.REDIS_SCRIPT:
+        assert core.scripts.script_calls == 160
+
+
+def test_connection_pool_is_configured():
+    load_dotenv()
+
+    core = Core(
+        redis_host=os.environ["REDIS_HOST"],
+        redis_port=os.environ["REDIS_PORT"],
+        metadata_store=MetadataStore(
+            tables=[],
+            config=CoreConfiguration(max_connections=2, socket_keepalive=True, socket_timeout=5)
+        )
+    )
+
+    def ping(_):
+        return core.conn.ping()
+
+    # threads wait for free connection instead of failing, when there are more threads than connections
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        assert all(executor.map(ping, range(32)))
+
+    assert core.conn.connection_pool.max_connections == 2
+    assert core.conn.connection_pool.connection_kwargs["socket_keepalive"] is True
+    assert core.conn.connection_pool.connection_kwargs["socket_timeout"] == 5
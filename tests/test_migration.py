@@ -0,0 +1,119 @@
+from dotenv import load_dotenv
+import os
+import pytest
+
+from hash_db import Core, MetadataStore, TableDescriptor, TableDefinition, FieldDescriptor, FieldDefinition, FieldValue, \
+    FunctionalDependency, TableRecord, StorageLayout, Selector
+from hash_db.exceptions import DependencyBrokenException
+from hash_db.tools.migration import migrate_storage_layout
+
+
+@pytest.fixture()
+def init_core():
+    load_dotenv()
+    redis_host = os.environ["REDIS_HOST"]
+    redis_port = os.environ["REDIS_PORT"]
+
+    table = TableDefinition(
+        table_descriptor=TableDescriptor("test_table"),
+        fields=[
+            FieldDefinition(FieldDescriptor("primary_field_1"), primary_key=True),
+            FieldDefinition(FieldDescriptor("field_1")),
+            FieldDefinition(FieldDescriptor("field_2"))
+        ],
+        dependencies=[
+            FunctionalDependency(
+                determinants=[
+                    FieldDescriptor("field_1")
+                ],
+                dependent=FieldDescriptor("field_2")
+            ),
+        ]
+    )
+
+    core = Core(
+        redis_host=redis_host,
+        redis_port=redis_port,
+        metadata_store=MetadataStore(
+            tables=[
+                table
+            ]
+        ),
+        clean_redis=True
+    )
+
+    for i in range(5):
+        core.insert(TableRecord(
+            table_descriptor=TableDescriptor("test_table"),
+            values={
+                FieldDescriptor("primary_field_1"): FieldValue(f"p{i}"),
+                FieldDescriptor("field_1"): FieldValue(f"f{i % 2}"),
+                FieldDescriptor("field_2"): FieldValue(f"g{i % 2}"),
+            }
+        ))
+
+    return core
+
+
+def select_all(core):
+    selector = Selector(
+        select_fields={
+            TableDescriptor("test_table"): [
+                FieldDescriptor("primary_field_1"),
+                FieldDescriptor("field_1"),
+                FieldDescriptor("field_2")
+            ]
+        },
+        from_table=TableDescriptor("test_table"),
+        join_statements=[],
+        conditions=[]
+    )
+
+    return sorted(
+        tuple(value.value for value in result.values["test_table"].values()) for result in core.select(selector)
+    )
+
+
+def test_migration_keeps_records(init_core):
+    core = init_core
+
+    records_before = select_all(core)
+
+    assert migrate_storage_layout(core.conn, core.metadata_store, StorageLayout.HASH_PER_RECORD) == 5
+    assert core.metadata_store.config.storage_layout == StorageLayout.HASH_PER_RECORD
+    assert core.conn.keys("__value__:*") == []
+    assert select_all(core) == records_before
+
+    assert migrate_storage_layout(core.conn, core.metadata_store, StorageLayout.KEY_PER_FIELD) == 5
+    assert core.conn.keys("__record__:*") == []
+    assert select_all(core) == records_before
+
+
+def test_migration_moves_dependency_indexes(init_core):
+    core = init_core
+
+    migrate_storage_layout(core.conn, core.metadata_store, StorageLayout.HASH_PER_RECORD)
+
+    assert core.conn.smembers('__dependency_index__:field_1=>field_2:{"field_1":"f1"}') == {
+        '__record__:test_table:{"primary_field_1":"p1"}',
+        '__record__:test_table:{"primary_field_1":"p3"}',
+    }
+
+    with pytest.raises(DependencyBrokenException):
+        core.insert(TableRecord(
+            table_descriptor=TableDescriptor("test_table"),
+            values={
+                FieldDescriptor("primary_field_1"): FieldValue("p5"),
+                FieldDescriptor("field_1"): FieldValue("f1"),
+                FieldDescriptor("field_2"): FieldValue("g0"),
+            }
+        ))
+
+
+def test_migration_changes_table_version(init_core):
+    core = init_core
+    version = int(core.conn.get("__table_version__:test_table"))
+
+    migrate_storage_layout(core.conn, core.metadata_store, StorageLayout.HASH_PER_RECORD)
+
+    assert int(core.conn.get("__table_version__:test_table")) > version
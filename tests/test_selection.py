@@ -3,11 +3,26 @@ import os
 import pytest
 
 from hash_db import Core, MetadataStore, TableDescriptor, TableDefinition, FieldDescriptor, FieldDefinition, FieldValue, \
-    TableRecord, Selector, SelectorConditionEquals, SelectorConditionNot, JoinStatement
-
-
-@pytest.fixture()
-def init_core():
+    TableRecord, Selector, SelectorConditionEquals, SelectorConditionIn, SelectorConditionNot, JoinStatement, CoreConfiguration, \
+    JoiningAlgorithm, StorageLayout, ListRecordsType, FunctionalDependency, PlanOperation, ResultRow
+from hash_db.extensions import selection
+from hash_db.extensions.selection import get_indexed_key_identifiers, hash_join
+from hash_db.tools.result_cache import ResultCache
+from hash_db.tools.selection_tools import TableIterator
+
+
+@pytest.fixture(params=[
+    CoreConfiguration(joining_algorithm=JoiningAlgorithm.NESTED_LOOPS),
+    CoreConfiguration(joining_algorithm=JoiningAlgorithm.HASH_JOIN),
+    CoreConfiguration(joining_algorithm=JoiningAlgorithm.HASH_JOIN, hash_join_memory_budget=1),
+    CoreConfiguration(joining_algorithm=JoiningAlgorithm.COST_BASED),
+    CoreConfiguration(scan_chunk_size=3),
+    CoreConfiguration(scan_chunk_size=1, scan_workers=4),
+    CoreConfiguration(storage_layout=StorageLayout.HASH_PER_RECORD),
+    CoreConfiguration(storage_layout=StorageLayout.HASH_PER_RECORD, list_records_type=ListRecordsType.SCAN),
+    CoreConfiguration(list_records_type=ListRecordsType.SSCAN, scan_count=1, scan_chunk_size=2)
+])
+def init_core(request):
     load_dotenv()
     redis_host = os.environ["REDIS_HOST"]
     redis_port = os.environ["REDIS_PORT"]
@@ -17,6 +32,17 @@ def init_core():
         fields=[
             FieldDefinition(FieldDescriptor("table1_primary_field_1"), primary_key=True),
             FieldDefinition(FieldDescriptor("table1_field_1")),
+        ],
+        dependencies=[
+            FunctionalDependency(
+                determinants=[
+                    FieldDescriptor("table1_primary_field_1")
+                ],
+                dependent=FieldDescriptor("table1_field_1")
+            )
+        ],
+        indexes=[
+            FieldDescriptor("table1_field_1")
         ]
     )
 
@@ -35,7 +61,8 @@ def init_core():
             tables=[
                 table1,
                 table2
-            ]
+            ],
+            config=request.param
         ),
         clean_redis=True
     )
@@ -118,6 +145,55 @@ def test_equals_condition_is_respected(init_core):
         assert result.values["test_table_1"][FieldDescriptor("table1_field_1")].value == "f1"
 
 
+def test_indexed_conditions_are_intersected(init_core):
+    core = init_core
+
+    selector = Selector(
+        select_fields={
+            TableDescriptor("test_table_1"): [
+                FieldDescriptor("table1_primary_field_1")
+            ]
+        },
+        from_table=TableDescriptor("test_table_1"),
+        join_statements=[],
+        conditions=[
+            SelectorConditionIn(TableDescriptor("test_table_1"), FieldDescriptor("table1_field_1"), ["f1", "f2"]),
+            SelectorConditionEquals(TableDescriptor("test_table_1"), FieldDescriptor("table1_field_1"), "f2")
+        ]
+    )
+
+    results = list(core.select(selector))
+
+    assert len(results) == 1
+    assert results[0].values["test_table_1"][FieldDescriptor("table1_primary_field_1")].value == "p2"
+
+
+def test_functional_dependency_index_is_used(init_core):
+    core = init_core
+
+    selector = Selector(
+        select_fields={
+            TableDescriptor("test_table_1"): [
+                FieldDescriptor("table1_field_1")
+            ]
+        },
+        from_table=TableDescriptor("test_table_1"),
+        join_statements=[],
+        conditions=[
+            SelectorConditionEquals(TableDescriptor("test_table_1"), FieldDescriptor("table1_primary_field_1"), "p2")
+        ]
+    )
+
+    assert get_indexed_key_identifiers(core.conn, core.metadata_store, selector, TableDescriptor("test_table_1")) == {
+        '{"table1_primary_field_1":"p2"}'
+    }
+
+    results = list(core.select(selector))
+
+    assert len(results) == 1
+    assert results[0].values["test_table_1"][FieldDescriptor("table1_field_1")].value == "f2"
+
+
 def test_condition_negation_is_respected(init_core):
     core = init_core
 
@@ -232,3 +308,401 @@ def test_simple_join(init_core):
 
     for expected in [("p1", "f1 prim"), ("p2", "f2 prim"), ("p4", "f1 prim")]:
         assert check.get(expected, False)
+
+
+def test_select_returns_compact_rows_sharing_schema(init_core):
+    core = init_core
+
+    selector = Selector(
+        select_fields={
+            TableDescriptor("test_table_1"): [
+                FieldDescriptor("table1_primary_field_1")
+            ],
+            TableDescriptor("test_table_2"): [
+                FieldDescriptor("table2_field_1")
+            ]
+        },
+        from_table=TableDescriptor("test_table_1"),
+        join_statements=[
+            JoinStatement(
+                base_fields=[(TableDescriptor("test_table_1"), FieldDescriptor("table1_field_1"))],
+                target_table=TableDescriptor("test_table_2"),
+                target_fields=[FieldDescriptor("table2_primary_field_1")]
+            )
+        ],
+        conditions=[]
+    )
+
+    results = list(core.select(selector))
+
+    assert selector.result_schema.columns == (("test_table_1", FieldDescriptor("table1_primary_field_1")),
+                                              ("test_table_2", FieldDescriptor("table2_field_1")))
+    assert all(result.schema is selector.result_schema for result in results)
+    assert sorted(tuple(result) for result in results) == [("p1", "f1 prim"), ("p2", "f2 prim"), ("p4", "f1 prim")]
+
+    for result in results:
+        assert result.get("test_table_2", FieldDescriptor("table2_field_1")) == result[1]
+        assert result.to_result_row() == ResultRow({
+            "test_table_1": {FieldDescriptor("table1_primary_field_1"): FieldValue(result[0])},
+            "test_table_2": {FieldDescriptor("table2_field_1"): FieldValue(result[1])}
+        })
+
+
+@pytest.mark.parametrize("join", [False, True])
+def test_select_batches_match_select(init_core, join):
+    core = init_core
+
+    select_fields = {
+        TableDescriptor("test_table_1"): [
+            FieldDescriptor("table1_field_1"),
+            FieldDescriptor("table1_primary_field_1")
+        ]
+    }
+    join_statements = []
+    if join:
+        select_fields[TableDescriptor("test_table_2")] = [FieldDescriptor("table2_field_1")]
+        join_statements.append(JoinStatement(
+            base_fields=[(TableDescriptor("test_table_1"), FieldDescriptor("table1_field_1"))],
+            target_table=TableDescriptor("test_table_2"),
+            target_fields=[FieldDescriptor("table2_primary_field_1")]
+        ))
+
+    selector = Selector(
+        select_fields=select_fields,
+        from_table=TableDescriptor("test_table_1"),
+        join_statements=join_statements,
+        conditions=[
+            SelectorConditionNot(
+                SelectorConditionEquals(TableDescriptor("test_table_1"), FieldDescriptor("table1_primary_field_1"), "p2")
+            )
+        ]
+    )
+
+    batches = list(core.select_batches(selector, batch_size=2))
+
+    assert all(len(batch) <= 2 for batch in batches)
+    assert all(batch.schema is selector.result_schema for batch in batches)
+
+    batch_rows = [row for batch in batches for row in zip(*batch.columns)]
+    assert sorted(batch_rows, key=str) == sorted((tuple(result) for result in core.select(selector)), key=str)
+    assert "p2" not in [value for batch in batches
+                        for value in batch.get_column("test_table_1", FieldDescriptor("table1_primary_field_1"))]
+
+
+def test_join_on_normal_fields(init_core):
+    core = init_core
+
+    selector = Selector(
+        select_fields={
+            TableDescriptor("test_table_1", "alias_name_1"): [
+                FieldDescriptor("table1_primary_field_1")
+            ],
+            TableDescriptor("test_table_1", "alias_name_2"): [
+                FieldDescriptor("table1_primary_field_1")
+            ]
+        },
+        from_table=TableDescriptor("test_table_1", "alias_name_1"),
+        join_statements=[
+            JoinStatement(
+                base_fields=[(TableDescriptor("test_table_1", "alias_name_1"), FieldDescriptor("table1_field_1"))],
+                target_table=TableDescriptor("test_table_1", "alias_name_2"),
+                target_fields=[FieldDescriptor("table1_field_1")]
+            )
+        ],
+        conditions=[]
+    )
+
+    results = list(core.select(selector))
+    assert len(results) == 6
+
+    check = set()
+    for result in results:
+        t1 = result.values["alias_name_1"][FieldDescriptor("table1_primary_field_1")].value
+        t2 = result.values["alias_name_2"][FieldDescriptor("table1_primary_field_1")].value
+        check.add((t1, t2))
+
+    assert check == {("p1", "p1"), ("p1", "p4"), ("p4", "p1"), ("p4", "p4"), ("p2", "p2"), ("p3", "p3")}
+
+
+def test_join_target_conditions_are_respected(init_core):
+    core = init_core
+
+    selector = Selector(
+        select_fields={
+            TableDescriptor("test_table_1"): [
+                FieldDescriptor("table1_primary_field_1")
+            ],
+            TableDescriptor("test_table_2"): [
+                FieldDescriptor("table2_field_1")
+            ]
+        },
+        from_table=TableDescriptor("test_table_1"),
+        join_statements=[
+            JoinStatement(
+                base_fields=[(TableDescriptor("test_table_1"), FieldDescriptor("table1_field_1"))],
+                target_table=TableDescriptor("test_table_2"),
+                target_fields=[FieldDescriptor("table2_primary_field_1")]
+            )
+        ],
+        conditions=[
+            SelectorConditionEquals(TableDescriptor("test_table_2"), FieldDescriptor("table2_field_1"), "f2 prim")
+        ]
+    )
+
+    results = list(core.select(selector))
+
+    assert len(results) == 1
+    assert results[0].values["test_table_1"][FieldDescriptor("table1_primary_field_1")].value == "p2"
+
+
+def test_explain_reports_row_counts(init_core):
+    core = init_core
+
+    selector = Selector(
+        select_fields={
+            TableDescriptor("test_table_1"): [
+                FieldDescriptor("table1_primary_field_1")
+            ],
+            TableDescriptor("test_table_2"): [
+                FieldDescriptor("table2_field_1")
+            ]
+        },
+        from_table=TableDescriptor("test_table_1"),
+        join_statements=[
+            JoinStatement(
+                base_fields=[(TableDescriptor("test_table_1"), FieldDescriptor("table1_field_1"))],
+                target_table=TableDescriptor("test_table_2"),
+                target_fields=[FieldDescriptor("table2_primary_field_1")]
+            )
+        ],
+        conditions=[]
+    )
+
+    plan = core.explain(selector)
+
+    assert [step.table_descriptor for step in plan.steps] == [TableDescriptor("test_table_1"),
+                                                              TableDescriptor("test_table_2")]
+    assert plan.steps[0].operation == PlanOperation.SCAN
+    assert plan.steps[0].estimated_rows == 4
+    assert plan.steps[0].actual_rows == 4
+    assert plan.steps[1].estimated_rows is not None
+    assert plan.steps[1].actual_rows == 3
+
+
+def test_cost_based_planner_joins_smaller_result_first(init_core):
+    core = init_core
+    core.metadata_store.config.joining_algorithm = JoiningAlgorithm.COST_BASED
+
+    selector = Selector(
+        select_fields={
+            TableDescriptor("test_table_1", "alias_name_1"): [
+                FieldDescriptor("table1_primary_field_1")
+            ]
+        },
+        from_table=TableDescriptor("test_table_1", "alias_name_1"),
+        join_statements=[
+            JoinStatement(
+                base_fields=[],
+                target_table=TableDescriptor("test_table_1", "alias_name_2"),
+                target_fields=[]
+            ),
+            JoinStatement(
+                base_fields=[(TableDescriptor("test_table_1", "alias_name_1"), FieldDescriptor("table1_field_1"))],
+                target_table=TableDescriptor("test_table_2"),
+                target_fields=[FieldDescriptor("table2_primary_field_1")]
+            )
+        ],
+        conditions=[]
+    )
+
+    plan = core.explain(selector)
+
+    assert [step.table_descriptor for step in plan.steps] == [TableDescriptor("test_table_1", "alias_name_1"),
+                                                              TableDescriptor("test_table_2"),
+                                                              TableDescriptor("test_table_1", "alias_name_2")]
+    assert [step.actual_rows for step in plan.steps] == [4, 3, 12]
+    assert len(list(core.select(selector))) == 12
+
+
+def test_primary_key_join_in_batches(init_core):
+    core = init_core
+    core.metadata_store.config.join_batch_size = 3
+
+    selector = Selector(
+        select_fields={
+            TableDescriptor("test_table_1"): [
+                FieldDescriptor("table1_primary_field_1")
+            ],
+            TableDescriptor("test_table_2"): [
+                FieldDescriptor("table2_field_1")
+            ]
+        },
+        from_table=TableDescriptor("test_table_1"),
+        join_statements=[
+            JoinStatement(
+                base_fields=[(TableDescriptor("test_table_1"), FieldDescriptor("table1_field_1"))],
+                target_table=TableDescriptor("test_table_2"),
+                target_fields=[FieldDescriptor("table2_primary_field_1")]
+            )
+        ],
+        conditions=[]
+    )
+
+    results = list(core.select(selector))
+
+    assert sorted(
+        (result.values["test_table_1"][FieldDescriptor("table1_primary_field_1")].value,
+         result.values["test_table_2"][FieldDescriptor("table2_field_1")].value) for result in results
+    ) == [("p1", "f1 prim"), ("p2", "f2 prim"), ("p4", "f1 prim")]
+
+
+def test_select_is_consumed_lazily(init_core):
+    core = init_core
+
+    selector = Selector(
+        select_fields={
+            TableDescriptor("test_table_1", "alias_name_1"): [
+                FieldDescriptor("table1_primary_field_1")
+            ],
+            TableDescriptor("test_table_1", "alias_name_2"): [
+                FieldDescriptor("table1_primary_field_1")
+            ]
+        },
+        from_table=TableDescriptor("test_table_1", "alias_name_1"),
+        join_statements=[
+            JoinStatement(
+                base_fields=[],
+                target_table=TableDescriptor("test_table_1", "alias_name_2"),
+                target_fields=[]
+            )
+        ],
+        conditions=[]
+    )
+
+    results = core.select(selector)
+    first_result = next(results)
+    results.close()
+
+    assert set(first_result.values) == {"alias_name_1", "alias_name_2"}
+
+
+def test_result_cache_is_invalidated_by_writes(init_core):
+    core = init_core
+    core.result_cache = ResultCache(ttl=60, max_rows=100)
+
+    selector = Selector(
+        select_fields={
+            TableDescriptor("test_table_1"): [
+                FieldDescriptor("table1_primary_field_1")
+            ]
+        },
+        from_table=TableDescriptor("test_table_1"),
+        join_statements=[],
+        conditions=[]
+    )
+
+    first_results = list(core.select(selector))
+    second_results = list(core.select(selector))
+
+    assert [result.values for result in second_results] == [result.values for result in first_results]
+    assert core.result_cache.hits == 1
+    assert core.result_cache.misses == 1
+
+    core.insert(TableRecord(
+        table_descriptor=TableDescriptor("test_table_1"),
+        values={
+            FieldDescriptor("table1_primary_field_1"): FieldValue("p5"),
+            FieldDescriptor("table1_field_1"): FieldValue("f5"),
+        }
+    ))
+
+    assert len(list(core.select(selector))) == len(first_results) + 1
+    assert core.result_cache.misses == 2
+
+
+@pytest.mark.parametrize("accumulator_size, target_size, build_table", [
+    (1, 3, "base_table"),
+    (3, 1, "target_table"),
+    (2, 5, "base_table"),
+    (5, 2, "target_table")
+])
+def test_hash_table_is_built_on_smaller_input(monkeypatch, accumulator_size, target_size, build_table):
+    def create_rows(table_name: str, count: int) -> list[ResultRow]:
+        return [ResultRow(values={table_name: {FieldDescriptor("field_1"): FieldValue(str(i))}}) for i in range(count)]
+
+    build_tables = []
+    build_hash_table = selection.build_hash_table
+
+    def spy_build_hash_table(build_records, build_fields):
+        build_tables.append(build_fields[0][0])
+        return build_hash_table(build_records, build_fields)
+
+    monkeypatch.setattr(selection, "build_hash_table", spy_build_hash_table)
+
+    join_statement = JoinStatement(
+        base_fields=[(TableDescriptor("base_table"), FieldDescriptor("field_1"))],
+        target_table=TableDescriptor("target_table"),
+        target_fields=[FieldDescriptor("field_1")]
+    )
+    metadata_store = MetadataStore(tables=[], config=CoreConfiguration(hash_join_memory_budget=3))
+
+    results = list(hash_join(iter(create_rows("base_table", accumulator_size)),
+                             iter(create_rows("target_table", target_size)), join_statement, metadata_store))
+
+    assert len(results) == min(accumulator_size, target_size)
+    # only input fitting in memory budget can be the build side, otherwise smaller input is chosen
+    assert build_tables == [build_table]
+
+
+def test_selector_fingerprint_ignores_condition_order():
+    conditions = [
+        SelectorConditionEquals(TableDescriptor("test_table_1"), FieldDescriptor("table1_field_1"), "f1"),
+        SelectorConditionIn(TableDescriptor("test_table_1"), FieldDescriptor("table1_primary_field_1"), ["p2", "p1"])
+    ]
+
+    def get_selector(selector_conditions):
+        return Selector(
+            select_fields={
+                TableDescriptor("test_table_1"): [
+                    FieldDescriptor("table1_primary_field_1"),
+                    FieldDescriptor("table1_field_1")
+                ]
+            },
+            from_table=TableDescriptor("test_table_1"),
+            join_statements=[],
+            conditions=selector_conditions
+        )
+
+    reordered_conditions = [
+        SelectorConditionIn(TableDescriptor("test_table_1"), FieldDescriptor("table1_primary_field_1"), ["p1", "p2"]),
+        SelectorConditionEquals(TableDescriptor("test_table_1"), FieldDescriptor("table1_field_1"), "f1")
+    ]
+    negated_conditions = [SelectorConditionNot(condition) for condition in conditions]
+
+    assert get_selector(conditions).get_fingerprint() == get_selector(reordered_conditions).get_fingerprint()
+    assert get_selector(conditions).get_fingerprint() != get_selector(negated_conditions).get_fingerprint()
+
+
+@pytest.mark.parametrize("list_records_type", [ListRecordsType.SSCAN, ListRecordsType.SCAN])
+def test_table_iteration_resumes_from_cursor(init_core, list_records_type):
+    core = init_core
+    core.metadata_store.config = CoreConfiguration(storage_layout=core.metadata_store.config.storage_layout,
+                                                   list_records_type=list_records_type, scan_count=1)
+    table_descriptor = TableDescriptor("test_table_1")
+
+    iterator = TableIterator(core.conn, core.metadata_store, table_descriptor)
+    first_part = []
+    for key_identifier in iterator:
+        first_part.append(key_identifier)
+
+        # cursor changes once first reply was yielded whole
+        if iterator.cursor != 0:
+            break
+
+    resumed_iterator = TableIterator(core.conn, core.metadata_store, table_descriptor, iterator.cursor)
+    second_part = list(resumed_iterator)
+
+    assert not iterator.completed
+    assert resumed_iterator.completed
+    assert set(first_part) | set(second_part) == core.conn.smembers(
+        core.metadata_store.get_table_by_name(table_descriptor).get_table_key())
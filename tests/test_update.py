@@ -0,0 +1,341 @@
+from dotenv import load_dotenv
+import os
+import pytest
+
+from hash_db import Core, MetadataStore, TableDescriptor, TableDefinition, FieldDescriptor, FieldDefinition, FieldValue, \
+    FunctionalDependency, TableRecord, StorageLayout, InsertType, DeleteType, CoreConfiguration, Selector
+from hash_db.exceptions import DependencyBrokenException, RecordNotFoundException, InvalidDescriptorException
+from hash_db.extensions.update import get_update_script_arguments, VALUES_CHANGED
+
+
+@pytest.fixture(params=[
+    CoreConfiguration(),
+    CoreConfiguration(storage_layout=StorageLayout.HASH_PER_RECORD),
+    CoreConfiguration(insert_type=InsertType.TRANSACTIONAL)
+])
+def init_core(request):
+    load_dotenv()
+    redis_host = os.environ["REDIS_HOST"]
+    redis_port = os.environ["REDIS_PORT"]
+
+    table = TableDefinition(
+        table_descriptor=TableDescriptor("test_table"),
+        fields=[
+            FieldDefinition(FieldDescriptor("primary_field_1"), primary_key=True),
+            FieldDefinition(FieldDescriptor("field_1")),
+            FieldDefinition(FieldDescriptor("field_2")),
+            FieldDefinition(FieldDescriptor("field_3")),
+            FieldDefinition(FieldDescriptor("field_4"))
+        ],
+        dependencies=[
+            FunctionalDependency(
+                determinants=[
+                    FieldDescriptor("field_1")
+                ],
+                dependent=FieldDescriptor("field_2")
+            ),
+            FunctionalDependency(
+                determinants=[
+                    FieldDescriptor("field_1"),
+                    FieldDescriptor("field_3")
+                ],
+                dependent=FieldDescriptor("field_4")
+            )
+        ],
+        indexes=[
+            FieldDescriptor("field_3")
+        ]
+    )
+
+    core = Core(
+        redis_host=redis_host,
+        redis_port=redis_port,
+        metadata_store=MetadataStore(
+            tables=[
+                table
+            ],
+            config=request.param
+        ),
+        clean_redis=True
+    )
+
+    core.insert_many([create_record("p1", "a", "x", "c1", "y"),
+                      create_record("p2", "a", "x", "c1", "y"),
+                      create_record("p3", "b", "z", "c2", "w")])
+
+    return core
+
+
+def create_record(primary_value: str, value_1: str, value_2: str, value_3: str, value_4: str) -> TableRecord:
+    return TableRecord(
+        table_descriptor=TableDescriptor("test_table"),
+        values={
+            FieldDescriptor("primary_field_1"): FieldValue(primary_value),
+            FieldDescriptor("field_1"): FieldValue(value_1),
+            FieldDescriptor("field_2"): FieldValue(value_2),
+            FieldDescriptor("field_3"): FieldValue(value_3),
+            FieldDescriptor("field_4"): FieldValue(value_4),
+        }
+    )
+
+
+def primary_key(primary_value: str) -> TableRecord:
+    return TableRecord(
+        table_descriptor=TableDescriptor("test_table"),
+        values={FieldDescriptor("primary_field_1"): FieldValue(primary_value)}
+    )
+
+
+def select_all(core: Core) -> dict[str, tuple]:
+    selector = Selector(
+        select_fields={
+            TableDescriptor("test_table"): [
+                FieldDescriptor("primary_field_1"),
+                FieldDescriptor("field_1"),
+                FieldDescriptor("field_2"),
+                FieldDescriptor("field_3"),
+                FieldDescriptor("field_4")
+            ]
+        },
+        from_table=TableDescriptor("test_table"),
+        join_statements=[],
+        conditions=[]
+    )
+
+    return {result[0]: tuple(result)[1:] for result in core.select(selector)}
+
+
+def test_untouched_fields_are_kept(init_core):
+    core = init_core
+
+    core.update(primary_key("p3"), {FieldDescriptor("field_2"): FieldValue("changed")})
+
+    assert select_all(core)["p3"] == ("b", "changed", "c2", "w")
+    assert core.conn.get('__dependency_value__:field_1=>field_2:{"field_1":"b"}') == "changed"
+
+
+def test_dependent_field_is_revalidated(init_core):
+    core = init_core
+
+    # p2 shares field_1 with p1, so its field_2 has to stay the same
+    with pytest.raises(DependencyBrokenException):
+        core.update(primary_key("p2"), {FieldDescriptor("field_2"): FieldValue("changed")})
+
+    assert select_all(core)["p2"] == ("a", "x", "c1", "y")
+
+
+def test_changed_determinant_moves_record_between_dependency_indexes(init_core):
+    core = init_core
+    field_2_key, _ = core.metadata_store.get_table_by_name(TableDescriptor("test_table")).get_field_location(
+        core.metadata_store.config.storage_layout, FieldDescriptor("field_2"), '{"primary_field_1":"p3"}')
+
+    core.update(primary_key("p3"), {FieldDescriptor("field_1"): FieldValue("new"),
+                                    FieldDescriptor("field_2"): FieldValue("new_value")})
+
+    assert not core.conn.exists('__dependency_index__:field_1=>field_2:{"field_1":"b"}')
+    assert not core.conn.exists('__dependency_value__:field_1=>field_2:{"field_1":"b"}')
+    assert core.conn.smembers('__dependency_index__:field_1=>field_2:{"field_1":"new"}') == {field_2_key}
+    assert core.conn.get('__dependency_value__:field_1=>field_2:{"field_1":"new"}') == "new_value"
+    # value of field_3 is read to compute new key of dependency field_1, field_3 => field_4
+    assert core.conn.get('__dependency_value__:field_1&field_3=>field_4:{"field_1":"new","field_3":"c2"}') == "w"
+
+    # record moved into index of other records has to match their dependent value
+    with pytest.raises(DependencyBrokenException):
+        core.update(primary_key("p3"), {FieldDescriptor("field_1"): FieldValue("a")})
+
+    core.update(primary_key("p3"), {FieldDescriptor("field_1"): FieldValue("a"),
+                                    FieldDescriptor("field_2"): FieldValue("x")})
+
+    assert select_all(core)["p3"] == ("a", "x", "c2", "w")
+
+
+def test_secondary_index_is_moved(init_core):
+    core = init_core
+
+    core.update(primary_key("p1"), {FieldDescriptor("field_3"): FieldValue("c2")})
+
+    assert core.conn.smembers('__secondary_index__:test_table:field_3:c1') == {'{"primary_field_1":"p2"}'}
+    assert core.conn.smembers('__secondary_index__:test_table:field_3:c2') == {'{"primary_field_1":"p1"}',
+                                                                                 '{"primary_field_1":"p3"}'}
+
+
+def test_invalid_updates_are_reported(init_core):
+    core = init_core
+
+    with pytest.raises(RecordNotFoundException):
+        core.update(primary_key("missing"), {FieldDescriptor("field_2"): FieldValue("x")})
+
+    with pytest.raises(InvalidDescriptorException):
+        core.update(primary_key("p1"), {FieldDescriptor("primary_field_1"): FieldValue("p9")})
+
+    results = core.update_many([
+        (primary_key("p3"), {FieldDescriptor("field_2"): FieldValue("changed")}),
+        (primary_key("p1"), {FieldDescriptor("field_4"): FieldValue("changed")}),
+        (primary_key("missing"), {FieldDescriptor("field_4"): FieldValue("changed")}),
+        (primary_key("p3"), {FieldDescriptor("field_3"): FieldValue("c1"), FieldDescriptor("field_1"): FieldValue("a"),
+                             FieldDescriptor("field_2"): FieldValue("x")})
+    ], batch_size=3)
+
+    assert results[0] is None
+    # p1 shares field_1 and field_3 with p2, so its field_4 has to stay the same
+    assert isinstance(results[1], DependencyBrokenException)
+    assert isinstance(results[2], RecordNotFoundException)
+    # p3 would join p1 and p2 in dependency field_1, field_3 => field_4 with different field_4
+    assert isinstance(results[3], DependencyBrokenException)
+    assert select_all(core) == {"p1": ("a", "x", "c1", "y"), "p2": ("a", "x", "c1", "y"),
+                                "p3": ("b", "changed", "c2", "w")}
+
+
+def test_record_without_links_is_updated(init_core):
+    core = init_core
+
+    # record inserted before links were stored
+    core.conn.delete('__record_links__:test_table:{"primary_field_1":"p3"}')
+
+    core.update(primary_key("p3"), {FieldDescriptor("field_1"): FieldValue("new")})
+
+    assert select_all(core)["p3"] == ("new", "z", "c2", "w")
+    assert not core.conn.exists('__dependency_index__:field_1=>field_2:{"field_1":"b"}')
+    assert core.conn.exists('__record_links__:test_table:{"primary_field_1":"p3"}')
+
+
+def test_update_is_not_applied_when_read_values_changed(init_core):
+    core = init_core
+    metadata_store = core.metadata_store
+
+    keys = []
+    args = []
+    # value of field_3 read by client before other client changed it
+    get_update_script_arguments(metadata_store, primary_key("p3"), {FieldDescriptor("field_1"): FieldValue("new")},
+                                {FieldDescriptor("field_3"): "stale"}, False, keys, args)
+
+    assert core.scripts.call("update_records", keys, args) == [VALUES_CHANGED]
+    assert select_all(core)["p3"] == ("b", "z", "c2", "w")
+
+
+def test_updated_records_are_deleted_by_key(init_core):
+    core = init_core
+    core.metadata_store.config.delete_type = DeleteType.REDIS_SCRIPT_BY_KEY
+
+    core.update(primary_key("p3"), {FieldDescriptor("field_1"): FieldValue("new"),
+                                    FieldDescriptor("field_3"): FieldValue("c3")})
+
+    assert core.delete_many([primary_key("p1"), primary_key("p2"), primary_key("p3")]) == 3
+
+    for pattern in ['__table_keys__:*', '__value__:*', '__record__:*', '__record_links__:*', '__dependency_index__:*',
+                    '__dependency_value__:*', '__secondary_index__:*']:
+        assert not core.conn.keys(pattern)
+
+
+def test_upsert_moves_dependency_index_memberships(init_core):
+    core = init_core
+    field_2_key, _ = core.metadata_store.get_table_by_name(TableDescriptor("test_table")).get_field_location(
+        core.metadata_store.config.storage_layout, FieldDescriptor("field_2"), '{"primary_field_1":"p3"}')
+
+    core.upsert(create_record("p3", "new", "new_value", "c3", "w"))
+
+    assert select_all(core)["p3"] == ("new", "new_value", "c3", "w")
+    assert not core.conn.exists('__dependency_index__:field_1=>field_2:{"field_1":"b"}')
+    assert not core.conn.exists('__dependency_value__:field_1=>field_2:{"field_1":"b"}')
+    assert not core.conn.exists('__secondary_index__:test_table:field_3:c2')
+    assert core.conn.smembers('__dependency_index__:field_1=>field_2:{"field_1":"new"}') == {field_2_key}
+    assert core.conn.smembers('__secondary_index__:test_table:field_3:c3') == {'{"primary_field_1":"p3"}'}
+
+    # old value of the record itself does not break dependency, when it is the only member
+    core.upsert(create_record("p3", "new", "other_value", "c3", "w"))
+
+    assert core.conn.get('__dependency_value__:field_1=>field_2:{"field_1":"new"}') == "other_value"
+
+
+def test_upsert_reports_broken_dependencies(init_core):
+    core = init_core
+
+    # p1 shares field_1 with p2, so its field_2 has to stay the same
+    with pytest.raises(DependencyBrokenException):
+        core.upsert(create_record("p1", "a", "changed", "c1", "y"))
+
+    results = core.upsert_many([create_record("p4", "b", "z", "c4", "v"),
+                                create_record("p5", "b", "changed", "c4", "v"),
+                                create_record("p3", "c", "z", "c2", "w")])
+
+    assert results[0] is None
+    assert isinstance(results[1], DependencyBrokenException)
+    assert results[2] is None
+    assert select_all(core) == {"p1": ("a", "x", "c1", "y"), "p2": ("a", "x", "c1", "y"),
+                                "p3": ("c", "z", "c2", "w"), "p4": ("b", "z", "c4", "v")}
+
+
+def test_upsert_removes_missing_fields(init_core):
+    core = init_core
+
+    core.upsert(TableRecord(
+        table_descriptor=TableDescriptor("test_table"),
+        values={
+            FieldDescriptor("primary_field_1"): FieldValue("p3"),
+            FieldDescriptor("field_1"): FieldValue("b"),
+            FieldDescriptor("field_2"): FieldValue("z")
+        }
+    ))
+
+    assert select_all(core)["p3"] == ("b", "z", None, None)
+    assert not core.conn.exists('__secondary_index__:test_table:field_3:c2')
+
+
+def test_record_without_links_is_upserted(init_core):
+    core = init_core
+
+    # record inserted before links were stored
+    core.conn.delete('__record_links__:test_table:{"primary_field_1":"p3"}')
+
+    core.upsert(create_record("p3", "new", "z", "c3", "w"))
+
+    assert select_all(core)["p3"] == ("new", "z", "c3", "w")
+    assert not core.conn.exists('__dependency_index__:field_1=>field_2:{"field_1":"b"}')
+    assert not core.conn.exists('__secondary_index__:test_table:field_3:c2')
+    assert core.conn.exists('__record_links__:test_table:{"primary_field_1":"p3"}')
+
+
+def test_upsert_insert_type(init_core):
+    core = init_core
+    core.metadata_store.config.insert_type = InsertType.REDIS_SCRIPT_UPSERT
+
+    assert core.insert_many([create_record("p1", "a", "x", "c2", "v"), create_record("p2", "a", "x", "c2", "v")]) == [
+        None, None]
+
+    assert core.conn.smembers('__secondary_index__:test_table:field_3:c2') == {'{"primary_field_1":"p1"}',
+                                                                                 '{"primary_field_1":"p2"}',
+                                                                                 '{"primary_field_1":"p3"}'}
+    assert not core.conn.exists('__dependency_index__:field_1&field_3=>field_4:{"field_1":"a","field_3":"c1"}')
+
+
+def test_update_after_reinsert_uses_current_values(init_core):
+    core = init_core
+
+    core.insert(create_record("p3", "n", "z", "c3", "w"))
+    core.update(primary_key("p3"), {FieldDescriptor("field_2"): FieldValue("q")})
+
+    assert core.conn.get('__dependency_value__:field_1=>field_2:{"field_1":"n"}') == "q"
+
+    with pytest.raises(DependencyBrokenException):
+        core.insert(create_record("p4", "n", "z", "c4", "v"))
+
+    assert select_all(core)["p3"] == ("n", "q", "c3", "w")
+
+
+def test_reinserted_records_are_updated_and_deleted_by_key(init_core):
+    core = init_core
+    core.metadata_store.config.delete_type = DeleteType.REDIS_SCRIPT_BY_KEY
+
+    core.insert(create_record("p3", "n", "z", "c3", "w"))
+    core.update(primary_key("p3"), {FieldDescriptor("field_1"): FieldValue("m"),
+                                    FieldDescriptor("field_3"): FieldValue("c4")})
+
+    assert core.delete_many([primary_key("p1"), primary_key("p2"), primary_key("p3")]) == 3
+
+    for pattern in ['__table_keys__:*', '__value__:*', '__record__:*', '__record_links__:*', '__dependency_index__:*',
+                    '__dependency_value__:*', '__secondary_index__:*']:
+        assert not core.conn.keys(pattern)
+
+    # dependent values of old versions do not outlive the record
+    core.insert(create_record("p5", "b", "v", "c2", "v"))
+    core.insert(create_record("p6", "n", "v", "c3", "v"))